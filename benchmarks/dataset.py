@@ -0,0 +1,136 @@
+# benchmarks/dataset.py
+
+"""
+Generación del conjunto de datos sintético (categories, cameras, videos, object, detections) a una escala
+configurable, en el sustituto SQLite o en un servidor MySQL/MariaDB local.
+
+La escala es el número de filas de 'object'; 'detections' tiene dos filas por objeto (placa y color)
+y 'videos' una fila por cada 100 objetos.
+"""
+
+import random
+import string
+
+CATEGORIES = ["car", "motorcycle", "truck", "bus", "bicycle", "person"]
+COLORS = ["red", "blue", "green", "yellow", "black", "white", "gray", "silver"]
+LOCATIONS = ["Norte", "Sur", "Centro", "Oriente", "Occidente"]
+
+# Inicio del rango temporal de los datos: 2025-02-01 00:00:00 UTC en milisegundos.
+EPOCH_START_MS = 1738368000000
+EPOCH_SPAN_MS = 10 * 24 * 3600 * 1000
+# Los objetos con placas conocidas caen dentro del rango de fechas que usa la consulta por placa.
+KNOWN_PLATE_EPOCH_MS = 1738584000000  # 2025-02-03 12:00:00 UTC
+
+DDL = [
+    """CREATE TABLE categories (
+        id INTEGER PRIMARY KEY,
+        category VARCHAR(64) NOT NULL
+    )""",
+    """CREATE TABLE cameras (
+        id INTEGER PRIMARY KEY,
+        camera_id VARCHAR(32) NOT NULL,
+        location VARCHAR(64) NOT NULL
+    )""",
+    """CREATE TABLE videos (
+        id INTEGER PRIMARY KEY,
+        camera_id INTEGER NOT NULL REFERENCES cameras(id),
+        epoch BIGINT NOT NULL
+    )""",
+    """CREATE TABLE object (
+        id INTEGER PRIMARY KEY,
+        img_id INTEGER NOT NULL,
+        category_id INTEGER NOT NULL REFERENCES categories(id),
+        video_id INTEGER NOT NULL REFERENCES videos(id),
+        epoch BIGINT NOT NULL,
+        accuracy FLOAT NOT NULL
+    )""",
+    """CREATE TABLE detections (
+        id INTEGER PRIMARY KEY,
+        object_id INTEGER NOT NULL REFERENCES object(id),
+        attribute_id INTEGER NOT NULL,
+        status INTEGER NOT NULL,
+        description VARCHAR(64) NOT NULL,
+        accuracy FLOAT NOT NULL
+    )""",
+]
+
+
+def random_plate(rng):
+    return "".join(rng.choices(string.ascii_uppercase, k=3)) + "".join(rng.choices(string.digits, k=3))
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(conn, scale=1000, cameras=20, seed_value=42, batch_size=10000, known_plates=None):
+    """
+    Crea las tablas y las llena con datos sintéticos.
+
+    :param conn: Conexión (StandInConnection o mysql.connector) sobre una base de datos vacía.
+    :param scale: Número de filas de 'object' (de 1k a 50M).
+    :param cameras: Número de cámaras.
+    :param seed_value: Semilla del generador aleatorio, para resultados reproducibles.
+    :param batch_size: Filas por inserción masiva.
+    :param known_plates: Placas que se asignan a los primeros objetos (útiles para las consultas del benchmark).
+    :return: Lista de placas conocidas insertadas.
+    """
+    rng = random.Random(seed_value)
+    known_plates = list(known_plates or ["ABQ874", "XYZ123", "KLM456"])
+    cursor = conn.cursor()
+    for statement in DDL:
+        cursor.execute(statement)
+
+    cursor.executemany("INSERT INTO categories (id, category) VALUES (%s, %s)",
+                       [(i + 1, name) for i, name in enumerate(CATEGORIES)])
+    cursor.executemany("INSERT INTO cameras (id, camera_id, location) VALUES (%s, %s, %s)",
+                       [(i + 1, f"CAM-{i + 1:03d}", LOCATIONS[i % len(LOCATIONS)]) for i in range(cameras)])
+
+    video_count = max(1, scale // 100)
+    video_epochs = [EPOCH_START_MS + rng.randrange(EPOCH_SPAN_MS) for _ in range(video_count)]
+    for batch in _batches(((i + 1, rng.randrange(cameras) + 1, video_epochs[i]) for i in range(video_count)),
+                          batch_size):
+        cursor.executemany("INSERT INTO videos (id, camera_id, epoch) VALUES (%s, %s, %s)", batch)
+
+    def objects():
+        for i in range(scale):
+            video_id = rng.randrange(video_count) + 1
+            epoch = video_epochs[video_id - 1] + rng.randrange(60000)
+            if i < len(known_plates):
+                epoch = KNOWN_PLATE_EPOCH_MS
+            yield (i + 1, rng.randrange(10 ** 6), rng.randrange(len(CATEGORIES)) + 1, video_id,
+                   epoch, round(rng.uniform(0.5, 1.0), 3))
+
+    for batch in _batches(objects(), batch_size):
+        cursor.executemany(
+            "INSERT INTO object (id, img_id, category_id, video_id, epoch, accuracy) VALUES (%s, %s, %s, %s, %s, %s)",
+            batch
+        )
+
+    def detections():
+        detection_id = 0
+        for i in range(scale):
+            object_id = i + 1
+            plate = known_plates[i] if i < len(known_plates) else random_plate(rng)
+            color = "yellow" if i < len(known_plates) else rng.choice(COLORS)
+            detection_id += 1
+            yield (detection_id, object_id, 1, 1, plate, round(rng.uniform(0.5, 1.0), 3))
+            detection_id += 1
+            yield (detection_id, object_id, 2, 1, color, round(rng.uniform(0.5, 1.0), 3))
+
+    for batch in _batches(detections(), batch_size):
+        cursor.executemany(
+            "INSERT INTO detections (id, object_id, attribute_id, status, description, accuracy) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            batch
+        )
+    conn.commit()
+    cursor.close()
+    return known_plates
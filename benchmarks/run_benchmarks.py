@@ -0,0 +1,433 @@
+# benchmarks/run_benchmarks.py
+
+"""
+Benchmark reproducible y sin conexión del pipeline de consultas.
+
+Genera el conjunto de datos sintético en el sustituto SQLite (o en un MySQL/MariaDB local con --mysql),
+reemplaza la llamada a OpenAI por respuestas grabadas y mide el rendimiento (throughput y latencias
+p50/p95/p99) de process_query, de cada agente por separado y de la búsqueda por placa.
+
+Uso:
+    python benchmarks/run_benchmarks.py --scale 10000 --iterations 50
+    python benchmarks/run_benchmarks.py --scale 1000000 --cold --json resultados.json
+    python benchmarks/run_benchmarks.py --mysql root:secret@127.0.0.1:3306/bench --seed
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, BENCH_DIR)
+
+from connection_pool import get_pool, pool_key  # noqa: E402
+from db_schema import DBSchemaAgent  # noqa: E402
+from semantic_mapping import SemanticMappingAgent  # noqa: E402
+from query_interpreter import UserQueryAgent  # noqa: E402
+from sql_generator import SQLGenerationAgent  # noqa: E402
+from query_executor import QueryExecutor  # noqa: E402
+from response_formatter import ResponseFormatter  # noqa: E402
+from intent_parser import RuleBasedIntentParser  # noqa: E402
+from llm_cache import normalizar_consulta, get_llm_cache  # noqa: E402
+from schema_cache import get_schema_cache  # noqa: E402
+from result_cache import get_result_cache, estimar_bytes  # noqa: E402
+from plate_search import PlateSearchService, IndexAdvisor, epoch_bounds  # noqa: E402
+from plate_index import PlateIndex  # noqa: E402
+from data_analyzer import DataAnalysisAgent  # noqa: E402
+from rollups import RollupManager  # noqa: E402
+from batch import process_batch  # noqa: E402
+from chart_cache import ChartCache  # noqa: E402
+from cost_guard import CostGuard  # noqa: E402
+import app  # noqa: E402
+
+import dataset  # noqa: E402
+from sqlite_standin import make_connect_func, refresh_information_schema, StandInConnection  # noqa: E402
+
+DEFAULT_PROMPTS = [
+    "cuantos carros rojos hay",
+    "cuantos objetos de la camara norte se detectaron",
+    "lista los videos grabados",
+    "cual es la precision promedio de los objetos",
+    "muestrame las detecciones de color amarillo",
+]
+
+
+# Consulta por placa original (FROM_UNIXTIME sobre la columna y doble JOIN a detections), como referencia.
+LEGACY_PLATE_SQL = """
+SELECT o.id AS object_id, o.img_id, c.id AS cls, c.category AS tipo, m.camera_id AS camara, v.epoch AS fecha,
+    m.location AS ubication, o.accuracy AS object_accuracy, d1.description AS plate, d1.accuracy AS plate_accuracy,
+    d2.description AS color, d2.accuracy AS color_accuracy
+FROM object o
+JOIN categories c ON c.id = o.category_id
+JOIN videos v ON v.id = o.video_id
+JOIN cameras m ON m.id = v.camera_id
+JOIN detections d1 ON d1.object_id = o.id AND d1.attribute_id = 1 AND d1.status = 1 AND d1.description = %s
+JOIN detections d2 ON d2.object_id = o.id AND d2.attribute_id = 2 AND d2.status = 1 AND d2.description = 'yellow'
+WHERE (FROM_UNIXTIME(o.epoch / 1000 - 3600 * 5) BETWEEN '2025-02-02' AND '2025-02-05')
+ORDER BY o.id DESC
+"""
+
+
+def percentile(sorted_values, pct):
+    """
+    Percentil por el método del rango más cercano sobre una lista ya ordenada.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def measure(name, func, iterations, before_each=None):
+    """
+    Ejecuta 'func(i)' 'iterations' veces y retorna las métricas de latencia en milisegundos.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        if before_each is not None:
+            before_each()
+        t0 = time.perf_counter()
+        func(i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "throughput_per_s": round(iterations / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+
+def install_recorded_llm(responses):
+    """
+    Reemplaza UserQueryAgent._obtener_respuesta_llm por una búsqueda en las respuestas grabadas.
+    Las consultas sin respuesta grabada devuelven "{}" (igual que un error del LLM).
+    """
+    recorded = {normalizar_consulta(k): v for k, v in responses.items()}
+
+    def fake_llm(self, prompt):
+        match = re.search(r"Consulta: (.*)\n", prompt)
+        consulta = normalizar_consulta(match.group(1)) if match else ""
+        return recorded.get(consulta, "{}")
+
+    UserQueryAgent._obtener_respuesta_llm = fake_llm
+
+
+def full_scans(plan):
+    """
+    Tablas que el plan de EXPLAIN recorre completas (sin índice).
+
+    Acepta el formato de MySQL (columnas 'table' y 'type', donde 'ALL' es un recorrido completo) y el de
+    'EXPLAIN QUERY PLAN' de SQLite (columna 'detail' con "SCAN <tabla>" sin índice).
+    """
+    if not plan:
+        return None
+    columns = [c.lower() for c in plan["columns"]]
+    scans = []
+    for row in plan["data"]:
+        values = dict(zip(columns, row))
+        if "type" in values:
+            if str(values.get("type")).upper() == "ALL":
+                scans.append(values.get("table"))
+        else:
+            detail = str(values.get("detail", ""))
+            if detail.startswith("SCAN") and "INDEX" not in detail.upper():
+                scans.append(detail.split()[1] if len(detail.split()) > 1 else detail)
+    return scans
+
+
+def benchmark_plate_search(db_config, args, n):
+    """
+    Mide la búsqueda por placa (consulta original, PlateSearchService y PlateIndex), verifica los índices
+    recomendados con IndexAdvisor y el plan con EXPLAIN; con --create-indexes crea los que falten y repite.
+    """
+    get_connection = get_pool(db_config).get_connection
+    advisor = IndexAdvisor(get_connection, db_config["database"])
+    service = PlateSearchService(get_connection)
+    executor = QueryExecutor(get_connection)
+    search_args = ("ABQ874", "yellow", "2025-02-02", "2025-02-05")
+
+    def run_round(suffix):
+        return [
+            measure("plate_legacy" + suffix, lambda i: executor.ejecutar_sql(LEGACY_PLATE_SQL, params=["ABQ874"]), n),
+            measure("plate_search" + suffix, lambda i: service.search(*search_args), n),
+        ]
+
+    results = run_round("")
+    plate_index = PlateIndex(get_connection)
+    t0 = time.perf_counter()
+    plate_index.refresh(force=True)
+    load_ms = round((time.perf_counter() - t0) * 1000, 3)
+    epoch_min, epoch_max = epoch_bounds("2025-02-02", "2025-02-05")
+    results.append(measure("plate_index_lookup",
+                           lambda i: plate_index.lookup("ABQ874", epoch_min=epoch_min, epoch_max=epoch_max), n))
+    results.append(measure("plate_index_fuzzy", lambda i: plate_index.lookup("ABQ8T4", fuzzy=True), n))
+    report = {"indexes": advisor.check(), "full_scans": full_scans(service.explain(*search_args)),
+              "plate_index": dict(plate_index.stats(), load_ms=load_ms)}
+    if args.create_indexes:
+        report["created"] = advisor.create_missing()
+        if not args.mysql:
+            refresh_information_schema(db_config["path"])
+        results += run_round("_indexed")
+        report["indexes_after"] = advisor.check()
+        report["full_scans_after"] = full_scans(service.explain(*search_args))
+    return results, report
+
+
+def benchmark_rollups(db_config, n):
+    """
+    Mide el conteo y la serie diaria de objetos con COUNT(*) sobre 'object' frente a los agregados
+    materializados (se crean en la base de datos del benchmark si no existen).
+    """
+    get_connection = get_pool(db_config).get_connection
+    rollups = RollupManager(get_connection)
+    t0 = time.perf_counter()
+    rollups.rebuild()
+    build_ms = round((time.perf_counter() - t0) * 1000, 3)
+    executor = QueryExecutor(get_connection)
+    count_sql, count_params = rollups.route_count("object", {"category_id": 1})
+    direct = DataAnalysisAgent(time_unit='ms')
+    routed = DataAnalysisAgent(time_unit='ms', rollups=rollups)
+    results = [
+        measure("contar_scan", lambda i: executor.ejecutar_sql(
+            "SELECT COUNT(*) FROM `object` WHERE `category_id` = %s", params=[1]), n),
+        measure("contar_rollup", lambda i: executor.ejecutar_sql(count_sql, params=count_params), n),
+        measure("serie_conteo_scan", lambda i: direct.count_by_time(get_connection, "object", "epoch"), n),
+        measure("serie_conteo_rollup", lambda i: routed.count_by_time(get_connection, "object", "epoch"), n),
+    ]
+    return results, {"build_ms": build_ms, "high_water_mark": rollups.high_water_mark}
+
+
+def benchmark_charts(n, points=20000):
+    """
+    Mide el renderizado a PNG de una serie larga sin reducir, reducida con LTTB y servido desde la caché de
+    gráficos (los renderizados completos se limitan a unas pocas iteraciones porque tardan cientos de ms).
+    """
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    agg_df = pd.DataFrame({
+        "timestamp": pd.to_datetime(np.arange(points) * 60000, unit="ms"),
+        "mean": np.sin(np.arange(points) / 500) + rng.normal(0, 0.1, points),
+        "count": rng.integers(0, 100, points),
+    })
+    agent = DataAnalysisAgent(time_unit='ms')
+    cache = ChartCache(tempfile.mkdtemp(prefix="nlsql_charts_bench_"))
+    columns = ["mean", "count"]
+    agent.render_chart(agg_df, "timestamp", columns, cache=cache)
+    return [
+        measure(f"grafico_{points}_completo", lambda i: agent.render_chart(agg_df, "timestamp", columns,
+                                                                           max_points=None), min(n, 5)),
+        measure(f"grafico_{points}_lttb", lambda i: agent.render_chart(agg_df, "timestamp", columns), min(n, 5)),
+        measure(f"grafico_{points}_cache", lambda i: agent.render_chart(agg_df, "timestamp", columns,
+                                                                        cache=cache), n),
+    ]
+
+
+def parse_mysql_url(url):
+    match = re.match(r"(?P<user>[^:@]+)(?::(?P<password>[^@]*))?@(?P<host>[^:/]+)(?::(?P<port>\d+))?/(?P<db>\w+)", url)
+    if not match:
+        raise ValueError("Formato esperado: usuario:clave@host:puerto/base_de_datos")
+    return {
+        "user": match.group("user"),
+        "password": match.group("password") or "",
+        "host": match.group("host"),
+        "port": int(match.group("port") or 3306),
+        "database": match.group("db"),
+    }
+
+
+def setup_database(args):
+    """
+    Prepara la base de datos del benchmark y registra su pool de conexiones.
+
+    :return: db_config del benchmark.
+    """
+    if args.mysql:
+        db_config = parse_mysql_url(args.mysql)
+        pool = get_pool(db_config, pool_size=args.pool_size)
+        if args.seed:
+            conn = pool.get_connection()
+            try:
+                dataset.seed(conn, scale=args.scale)
+            finally:
+                conn.close()
+        return db_config
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="nlsql_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, f"bench_{args.scale}.sqlite")
+    if not os.path.exists(path):
+        print(f"Generando {args.scale} objetos en {path} ...", file=sys.stderr)
+        t0 = time.perf_counter()
+        conn = StandInConnection(path)
+        try:
+            dataset.seed(conn, scale=args.scale)
+        finally:
+            conn.close()
+        refresh_information_schema(path)
+        print(f"Datos generados en {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+    db_config = {"host": "sqlite", "port": 0, "user": "bench", "password": "", "database": "bench", "path": path}
+    get_pool(db_config, pool_size=args.pool_size, connect_func=make_connect_func(path))
+    return db_config
+
+
+def run(args):
+    with open(args.responses, "r", encoding="utf-8") as f:
+        install_recorded_llm(json.load(f))
+
+    db_config = setup_database(args)
+    get_connection = get_pool(db_config).get_connection
+    prompts = DEFAULT_PROMPTS
+
+    def clear_caches():
+        get_schema_cache().invalidate()
+        get_result_cache().invalidate()
+        get_llm_cache().clear()
+
+    before_each = clear_caches if args.cold else None
+    n = args.iterations
+    results = []
+
+    # Pipeline completo y búsqueda por placa.
+    results.append(measure("process_query", lambda i: app.process_query(prompts[i % len(prompts)], db_config, ""),
+                           n, before_each))
+    results.append(measure("plate_lookup", lambda i: app.process_query("placa: ABQ874", db_config, ""),
+                           n, before_each))
+    # Lote de consultas (con repetidas, como en un reporte): una por una frente a process_batch.
+    batch_prompts = prompts * 4 + ["placa: ABQ874"]
+    results.append(measure("process_query_lote_x%d" % len(batch_prompts),
+                           lambda i: [app.process_query(p, db_config, "") for p in batch_prompts], n, before_each))
+    results.append(measure("process_batch_x%d" % len(batch_prompts),
+                           lambda i: process_batch(batch_prompts, db_config, ""), n, before_each))
+
+    # Agentes por separado.
+    db_name = db_config["database"]
+    results.append(measure(
+        "schema_extraction_bulk",
+        lambda i: DBSchemaAgent(get_connection, db_name, include_sample_data=False).get_schema_dict(), n))
+    results.append(measure(
+        "schema_extraction_per_table",
+        lambda i: DBSchemaAgent(get_connection, db_name, include_sample_data=False, bulk=False).get_schema_dict(), n))
+
+    schema = DBSchemaAgent(get_connection, db_name, include_sample_data=False).get_schema_dict()
+    results.append(measure("semantic_map", lambda i: SemanticMappingAgent().generate_map(schema), n))
+    semantic_map = SemanticMappingAgent().generate_map(schema)
+
+    parser = RuleBasedIntentParser(schema, semantic_map, {"detections": {"description": {
+        c: c for c in dataset.COLORS}}})
+    results.append(measure("intent_parser", lambda i: parser.parse(prompts[i % len(prompts)]), n))
+
+    agent = UserQueryAgent(llm_api_key=None)
+    results.append(measure(
+        "interpretar_consulta_mock",
+        lambda i: agent.interpretar_consulta(prompts[i % len(prompts)], schema, semantic_map), n))
+
+    estructuras = [json.loads(v) for v in json.load(open(args.responses, encoding="utf-8")).values()]
+    generator = SQLGenerationAgent(limit=25)
+    results.append(measure("generar_sql", lambda i: generator.generar_sql(estructuras[i % len(estructuras)], schema), n))
+
+    sqls = [generator.generar_sql(e, schema) for e in estructuras]
+    executor = QueryExecutor(get_connection)
+    results.append(measure("ejecutar_sql", lambda i: executor.ejecutar_sql(sqls[i % len(sqls)]), n))
+    prepared = [generator.generar_sql_parametrizada(e, schema) for e in estructuras]
+    results.append(measure("ejecutar_sql_preparado",
+                           lambda i: executor.ejecutar_sql(*prepared[i % len(prepared)]), n))
+    # Control de costo previo a la ejecución (EXPLAIN cacheado por forma de consulta tras la primera evaluación).
+    guard = CostGuard(get_connection)
+    results.append(measure("cost_guard_evaluar", lambda i: guard.evaluar(*prepared[i % len(prepared)]), n))
+
+    plate_results, plate_report = benchmark_plate_search(db_config, args, n)
+    results += plate_results
+
+    columnar_executor = QueryExecutor(get_connection, columnar=True)
+    sample_sql = "SELECT * FROM detections LIMIT 1000"
+    results.append(measure("ejecutar_sql_1000_tuplas", lambda i: executor.ejecutar_sql(sample_sql), n))
+    results.append(measure("ejecutar_sql_1000_columnar", lambda i: columnar_executor.ejecutar_sql(sample_sql), n))
+    columnar_sample = columnar_executor.ejecutar_sql(sample_sql)
+
+    sample = executor.ejecutar_sql(sample_sql)
+    formatter = ResponseFormatter()
+    results.append(measure("formatear_respuesta_1000", lambda i: formatter.formatear_respuesta(sample, {}), n))
+    results.append(measure("formatear_respuesta_1000_columnar",
+                           lambda i: formatter.formatear_respuesta(columnar_sample, {}), n))
+    bounded_formatter = app.crear_formateador()
+    results.append(measure("formatear_respuesta_1000_acotada",
+                           lambda i: bounded_formatter.formatear_respuesta(sample, {}), n))
+    footprint = {"tuplas_bytes": estimar_bytes(sample), "columnar_bytes": columnar_sample.nbytes}
+
+    rollup_results, rollup_report = benchmark_rollups(db_config, n)
+    results += rollup_results
+    results += benchmark_charts(n)
+
+    return {
+        "scale": args.scale,
+        "backend": "mysql" if args.mysql else "sqlite",
+        "cold": bool(args.cold),
+        "pool": get_pool(db_config).get_metrics(),
+        "plate_search": plate_report,
+        "result_footprint_1000": footprint,
+        "rollups": rollup_report,
+        "results": results,
+    }
+
+
+def print_report(report):
+    print(f"\nEscala: {report['scale']} objetos | backend: {report['backend']} | cachés frías: {report['cold']}")
+    header = f"{'etapa':<36}{'it':>6}{'ops/s':>12}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in report["results"]:
+        print(f"{r['name']:<36}{r['iterations']:>6}{r['throughput_per_s']:>12}"
+              f"{r['p50_ms']:>12}{r['p95_ms']:>12}{r['p99_ms']:>12}")
+
+    footprint = report["result_footprint_1000"]
+    print(f"\nMemoria de 1000 filas: tuplas {footprint['tuplas_bytes']} B | columnar {footprint['columnar_bytes']} B")
+    rollups = report["rollups"]
+    print(f"Agregados materializados: construcción {rollups['build_ms']} ms "
+          f"(hasta el objeto {rollups['high_water_mark']})")
+
+    plate = report["plate_search"]
+    print("\nÍndices para la búsqueda por placa:")
+    for item in plate.get("indexes_after", plate["indexes"]):
+        estado = "ok" if item["present"] else f"FALTA -> {item['ddl']}"
+        print(f"  {item['table']}({', '.join(item['columns'])}): {estado}")
+    scans = plate.get("full_scans_after", plate["full_scans"])
+    print(f"Recorridos completos en el plan (EXPLAIN): {', '.join(scans) if scans else 'ninguno'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1000, help="Número de filas de 'object' (1k a 50M).")
+    parser.add_argument("--iterations", type=int, default=50, help="Repeticiones por etapa.")
+    parser.add_argument("--cold", action="store_true", help="Vaciar las cachés antes de cada iteración del pipeline.")
+    parser.add_argument("--mysql", help="Usar un MySQL/MariaDB local: usuario:clave@host:puerto/base_de_datos.")
+    parser.add_argument("--seed", action="store_true", help="Con --mysql, generar los datos en la base indicada (vacía).")
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="Crear los índices recomendados para la búsqueda por placa y repetir la medición.")
+    parser.add_argument("--workdir", help="Directorio para la base SQLite (se reutiliza si ya existe).")
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--responses", default=os.path.join(BENCH_DIR, "recorded_llm_responses.json"),
+                        help="Respuestas grabadas del LLM (consulta -> JSON).")
+    parser.add_argument("--json", help="Guardar el reporte en este archivo JSON.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
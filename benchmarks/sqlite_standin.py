@@ -0,0 +1,199 @@
+# benchmarks/sqlite_standin.py
+
+"""
+Sustituto local de MySQL basado en SQLite para ejecutar el pipeline sin servidor.
+
+Expone una conexión con la interfaz que usan los agentes (cursor(), execute con parámetros '%s',
+fetchall/fetchmany, description, ping, close) y emula lo necesario de MySQL:
+  - Un esquema 'information_schema' adjunto (tables, columns, key_column_usage, statistics)
+    que se regenera a partir de los metadatos de SQLite con 'refresh_information_schema'.
+  - Las funciones FROM_UNIXTIME, CRC32, CONCAT_WS y DATABASE().
+  - Las sentencias 'SET SESSION ...' se ignoran.
+  - 'EXPLAIN <consulta>' se traduce a 'EXPLAIN QUERY PLAN <consulta>'.
+  - 'INSERT ... ON DUPLICATE KEY UPDATE' se traduce a 'INSERT ... ON CONFLICT DO UPDATE'.
+  - 'KILL QUERY <connection_id>' interrumpe la sentencia en curso de esa conexión (sqlite3 interrupt).
+"""
+
+import datetime
+import itertools
+import re
+import sqlite3
+import threading
+import weakref
+import zlib
+
+PARAM_PATTERN = re.compile(r"%s")
+UPSERT_PATTERN = re.compile(r"ON DUPLICATE KEY UPDATE\s+(.*)$", re.IGNORECASE | re.DOTALL)
+VALUES_FUNC_PATTERN = re.compile(r"VALUES\((\w+)\)", re.IGNORECASE)
+KILL_PATTERN = re.compile(r"\s*KILL\s+QUERY\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+
+# Conexiones abiertas por identificador, para emular KILL QUERY.
+_connection_ids = itertools.count(1)
+_connections = weakref.WeakValueDictionary()
+_connections_lock = threading.Lock()
+
+
+def _translate(sql):
+    """
+    Traduce las construcciones de MySQL que SQLite no entiende: marcadores '%s' y
+    'ON DUPLICATE KEY UPDATE col = col + VALUES(col)' (-> 'ON CONFLICT DO UPDATE SET ... excluded.col').
+    """
+    sql = PARAM_PATTERN.sub("?", sql)
+    match = UPSERT_PATTERN.search(sql)
+    if match:
+        assignments = VALUES_FUNC_PATTERN.sub(r"excluded.\1", match.group(1))
+        sql = sql[:match.start()] + "ON CONFLICT DO UPDATE SET " + assignments
+    return sql
+
+
+def _from_unixtime(seconds):
+    if seconds is None:
+        return None
+    return datetime.datetime.utcfromtimestamp(seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _crc32(value):
+    if value is None:
+        return None
+    return zlib.crc32(str(value).encode("utf-8"))
+
+
+def _concat_ws(separator, *values):
+    return separator.join(str(v) for v in values if v is not None)
+
+
+class StandInCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn.raw.cursor()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, sql, params=None):
+        if sql.strip().upper().startswith("SET "):
+            return
+        kill = KILL_PATTERN.match(sql)
+        if kill:
+            with _connections_lock:
+                target = _connections.get(int(kill.group(1)))
+            if target is not None:
+                target.raw.interrupt()
+            return
+        sql = _translate(sql)
+        if re.match(r"\s*EXPLAIN\s", sql, re.IGNORECASE) and "QUERY PLAN" not in sql.upper():
+            # EXPLAIN de MySQL -> plan de consulta de SQLite (id, parent, notused, detail).
+            sql = re.sub(r"^\s*EXPLAIN", "EXPLAIN QUERY PLAN", sql, count=1, flags=re.IGNORECASE)
+        self._cursor.execute(sql, tuple(params) if params is not None else ())
+
+    def executemany(self, sql, seq_params):
+        self._cursor.executemany(_translate(sql), seq_params)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandInConnection:
+    """
+    Conexión SQLite con la interfaz mínima de mysql.connector usada por los agentes.
+    """
+
+    unread_result = False
+    in_transaction = False
+
+    def __init__(self, path, database="bench"):
+        self.raw = sqlite3.connect(path, check_same_thread=False)
+        self.database = database
+        self.raw.create_function("FROM_UNIXTIME", 1, _from_unixtime)
+        self.raw.create_function("CRC32", 1, _crc32)
+        self.raw.create_function("CONCAT_WS", -1, _concat_ws)
+        self.raw.create_function("DATABASE", 0, lambda: database)
+        self.raw.execute(f"ATTACH DATABASE '{path}.information_schema' AS information_schema")
+        with _connections_lock:
+            self.connection_id = next(_connection_ids)
+            _connections[self.connection_id] = self
+
+    def cursor(self, buffered=None, prepared=False, **kwargs):
+        return StandInCursor(self)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.raw.execute("SELECT 1")
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.raw.close()
+
+
+def refresh_information_schema(path, database="bench"):
+    """
+    Regenera las tablas de 'information_schema' a partir de los metadatos de SQLite.
+    """
+    conn = StandInConnection(path, database)
+    raw = conn.raw
+    raw.executescript("""
+        DROP TABLE IF EXISTS information_schema.tables;
+        DROP TABLE IF EXISTS information_schema.columns;
+        DROP TABLE IF EXISTS information_schema.key_column_usage;
+        DROP TABLE IF EXISTS information_schema.statistics;
+        CREATE TABLE information_schema.tables (
+            table_schema TEXT, table_name TEXT, table_rows INTEGER, create_time TEXT, update_time TEXT);
+        CREATE TABLE information_schema.columns (
+            table_schema TEXT, table_name TEXT, column_name TEXT, data_type TEXT, column_key TEXT,
+            ordinal_position INTEGER);
+        CREATE TABLE information_schema.key_column_usage (
+            table_schema TEXT, table_name TEXT, column_name TEXT, referenced_table_name TEXT,
+            referenced_column_name TEXT);
+        CREATE TABLE information_schema.statistics (
+            table_schema TEXT, table_name TEXT, index_name TEXT, seq_in_index INTEGER, column_name TEXT);
+    """)
+    now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    tables = [row[0] for row in raw.execute(
+        "SELECT name FROM main.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    )]
+    for table in tables:
+        rows = raw.execute(f"SELECT COUNT(*) FROM main.`{table}`").fetchone()[0]
+        raw.execute("INSERT INTO information_schema.tables VALUES (?, ?, ?, ?, ?)",
+                    (database, table, rows, now, now))
+        for cid, name, col_type, _notnull, _default, pk in raw.execute(f"PRAGMA main.table_info(`{table}`)"):
+            data_type = (col_type or "text").lower().split("(")[0]
+            raw.execute("INSERT INTO information_schema.columns VALUES (?, ?, ?, ?, ?, ?)",
+                        (database, table, name, data_type, "PRI" if pk else "", cid + 1))
+        for fk in raw.execute(f"PRAGMA main.foreign_key_list(`{table}`)").fetchall():
+            raw.execute("INSERT INTO information_schema.key_column_usage VALUES (?, ?, ?, ?, ?)",
+                        (database, table, fk[3], fk[2], fk[4]))
+        for index_row in raw.execute(f"PRAGMA main.index_list(`{table}`)").fetchall():
+            index_name = index_row[1]
+            for seq, _cid, column in raw.execute(f"PRAGMA main.index_info(`{index_name}`)").fetchall():
+                raw.execute("INSERT INTO information_schema.statistics VALUES (?, ?, ?, ?, ?)",
+                            (database, table, index_name, seq + 1, column))
+    raw.commit()
+    conn.close()
+
+
+def make_connect_func(path, database="bench"):
+    """
+    Retorna una función sin argumentos que abre una conexión al sustituto (para ConnectionPool(connect_func=...)).
+    """
+    return lambda: StandInConnection(path, database)
@@ -0,0 +1,138 @@
+# benchmarks/startup_benchmark.py
+
+"""
+Benchmark del arranque: tiempo de importación de app.py (y de los módulos que importa el frontend) y
+latencia de la primera respuesta en un proceso nuevo, sin y con precalentamiento (warmup.start_warmup).
+
+Cada medición se hace en un subproceso nuevo (importaciones y cachés frías) usando el sustituto SQLite y las
+respuestas grabadas del LLM de run_benchmarks.py. Con --max-import-ms / --max-first-answer-ms el script
+termina con código 1 si la mediana supera el umbral, para detectar regresiones.
+
+Uso:
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --max-import-ms 300 --json arranque.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+HEAVY_MODULES = ("numpy", "pandas", "matplotlib", "mysql.connector", "openai")
+DEFAULT_PROMPT = "lista los videos grabados"
+
+
+def child(mode, workdir, scale, prompt):
+    """
+    Medición dentro del subproceso; imprime un JSON con los tiempos en milisegundos.
+    """
+    sys.path.insert(0, SRC_DIR)
+    t0 = time.perf_counter()
+    import app
+    import data_analyzer  # noqa: F401
+    import warmup
+    import_ms = (time.perf_counter() - t0) * 1000
+    report = {"import_ms": import_ms, "heavy_modules_loaded": [m for m in HEAVY_MODULES if m in sys.modules]}
+    if mode == "import":
+        return report
+
+    sys.path.insert(0, BENCH_DIR)
+    import run_benchmarks
+    with open(os.path.join(BENCH_DIR, "recorded_llm_responses.json"), encoding="utf-8") as f:
+        run_benchmarks.install_recorded_llm(json.load(f))
+    args = argparse.Namespace(mysql=None, seed=False, workdir=workdir, scale=scale, pool_size=5)
+    db_config = run_benchmarks.setup_database(args)
+
+    if mode == "warm":
+        t1 = time.perf_counter()
+        warmup.start_warmup([db_config])
+        warmup.wait_warmup()
+        report["warmup_ms"] = (time.perf_counter() - t1) * 1000
+
+    t2 = time.perf_counter()
+    result = app.process_query(prompt, db_config, "")
+    report["first_answer_ms"] = (time.perf_counter() - t2) * 1000
+    if result.get("resultados"):
+        # Lo que hace el frontend para mostrar la tabla de resultados (importa pandas si aún no está cargado).
+        from columnar import as_dataframe
+        t_df = time.perf_counter()
+        as_dataframe(result["resultados"])
+        report["first_dataframe_ms"] = (time.perf_counter() - t_df) * 1000
+    t3 = time.perf_counter()
+    app.process_query(prompt, db_config, "")
+    report["second_answer_ms"] = (time.perf_counter() - t3) * 1000
+    return report
+
+
+def run_child(mode, args):
+    env = dict(os.environ)
+    # Sin cachés persistentes: cada subproceso arranca en frío.
+    for var in ("SCHEMA_CACHE_DIR", "LLM_CACHE_DB", "WARMUP_DATABASES"):
+        env.pop(var, None)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--workdir", args.workdir,
+         "--scale", str(args.scale), "--prompt", args.prompt],
+        check=True, capture_output=True, text=True, env=env,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    keys = sorted({k for s in samples for k, v in s.items() if isinstance(v, (int, float))})
+    summary = {k: round(statistics.median(s[k] for s in samples if k in s), 3) for k in keys}
+    summary["heavy_modules_loaded"] = samples[0].get("heavy_modules_loaded", [])
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Subprocesos por modo (se reporta la mediana).")
+    parser.add_argument("--scale", type=int, default=1000, help="Número de filas de 'object' del sustituto SQLite.")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "nlsql_startup_bench"),
+                        help="Directorio para la base SQLite (se reutiliza si ya existe).")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="Consulta de la primera respuesta.")
+    parser.add_argument("--max-import-ms", type=float, help="Umbral de la mediana de importación de app.py.")
+    parser.add_argument("--max-first-answer-ms", type=float, help="Umbral de la mediana de la primera respuesta.")
+    parser.add_argument("--json", help="Guardar el reporte en este archivo JSON.")
+    parser.add_argument("--child", choices=("import", "first", "warm"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child, args.workdir, args.scale, args.prompt)))
+        return 0
+
+    report = {}
+    for mode in ("import", "first", "warm"):
+        report[mode] = summarize([run_child(mode, args) for _ in range(args.runs)])
+
+    print(f"\nArranque (mediana de {args.runs} subprocesos, escala {args.scale}):")
+    print(f"  import app: {report['import']['import_ms']} ms "
+          f"(módulos pesados cargados: {', '.join(report['import']['heavy_modules_loaded']) or 'ninguno'})")
+    for mode, label in (("first", "sin precalentamiento"), ("warm", "con precalentamiento")):
+        r = report[mode]
+        extra = f" | precalentamiento {r['warmup_ms']} ms" if "warmup_ms" in r else ""
+        print(f"  primera respuesta {label}: {r['first_answer_ms']} ms "
+              f"(segunda {r['second_answer_ms']} ms, primer DataFrame {r.get('first_dataframe_ms', '-')} ms){extra}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    failed = []
+    if args.max_import_ms is not None and report["import"]["import_ms"] > args.max_import_ms:
+        failed.append(f"import app {report['import']['import_ms']} ms > {args.max_import_ms} ms")
+    if args.max_first_answer_ms is not None and report["first"]["first_answer_ms"] > args.max_first_answer_ms:
+        failed.append(f"primera respuesta {report['first']['first_answer_ms']} ms > {args.max_first_answer_ms} ms")
+    for message in failed:
+        print(f"REGRESIÓN: {message}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
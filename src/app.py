@@ -1,23 +1,61 @@
 # app.py
 
-import mysql.connector
-import pandas as pd
-import datetime
+import os
+import logging
+import threading
 
+from connection_pool import get_pool, pool_key
 from db_schema import DBSchemaAgent
+from schema_cache import get_schema_cache
 from semantic_mapping import SemanticMappingAgent
+from semantic_index import get_semantic_index
 from query_interpreter import UserQueryAgent
+from llm_cache import get_llm_cache
+from schema_pruning import SchemaPruner
+from intent_parser import RuleBasedIntentParser, get_value_dictionary, NUMERIC_TYPES
+from plate_search import PlateSearchService, parse_plate_prompt, epoch_bounds
+from plate_index import get_plate_index, plate_index_enabled
+from rollups import get_rollups
+from cost_guard import get_cost_guard
 from sql_generator import SQLGenerationAgent
 from query_executor import QueryExecutor
+from result_cache import get_result_cache
 from response_formatter import ResponseFormatter
 from data_analyzer import DataAnalysisAgent
+from tracing import Tracer, span, configure_from_env
+from deadline import deadline_scope, degrade, expired, request_timeout
 
+logger = logging.getLogger(__name__)
 
-def infer_table_from_query(query, semantic_map):
+# Filtros de la consulta de referencia por placa, usados cuando la consulta no indica color ni fechas.
+PLACA_COLOR_POR_DEFECTO = "yellow"
+PLACA_RANGO_POR_DEFECTO = ("2025-02-02", "2025-02-05")
+# Con más objetos que estos en el índice de placas (p. ej. un prefijo corto) se consulta directamente en SQL.
+PLATE_INDEX_MAX_IDS = 1000
+# Columnas de tiempo (epoch en milisegundos) sobre las que se generan series de conteos.
+TIME_COLUMNS = ("timestamp", "epoch")
+# Expresiones con las que el usuario pide una serie temporal, y la frecuencia de agrupación de cada una.
+SERIE_FRECUENCIAS = (
+    ("por minuto", "min"), ("por hora", "h"), ("por dia", "D"), ("por día", "D"), ("diari", "D"),
+    ("por semana", "W"), ("semanal", "W"), ("serie", "D"), ("tendencia", "D"), ("evolucion", "D"),
+    ("evolución", "D"), ("a lo largo del tiempo", "D"),
+)
+# Presupuesto de la tabla de texto de la respuesta (el resultado completo se muestra aparte como DataFrame).
+RESPUESTA_MAX_FILAS = 200
+RESPUESTA_MAX_BYTES = 64 * 1024
+RESPUESTA_MAX_ANCHO_COLUMNA = 80
+
+
+def infer_table_from_query(query, semantic_map, index=None):
     """
     Intenta inferir la tabla a consultar a partir de la consulta en lenguaje natural
-    y del mapa semántico.
+    y del mapa semántico. Si se proporciona un SemanticIndex, se usa su búsqueda por índice invertido.
     """
+    if index is not None:
+        table = index.best_table(query)
+        if table in semantic_map:
+            return table
+
     query_lower = query.lower()
     # Buscar coincidencia completa en el nombre humanizado
     for table, info in semantic_map.items():
@@ -38,7 +76,336 @@ def infer_table_from_query(query, semantic_map):
     return None
 
 
-def process_query(prompt, db_config, openai_api_key):
+def _refresh_semantic_index(schema_key, schema):
+    """
+    Suscriptor de la caché de esquemas: actualiza de forma incremental el índice semántico
+    de la base de datos cuando su esquema se carga o cambia.
+    """
+    semantic_map = SemanticMappingAgent(custom_rules=None).generate_map(schema)
+    get_semantic_index(schema_key, semantic_map)
+
+
+get_schema_cache().subscribe(_refresh_semantic_index)
+configure_from_env()
+
+# Mapa semántico del esquema vigente de cada base de datos (clave: pool_key(db_config)). La caché de esquemas
+# entrega el mismo objeto mientras el esquema no cambie, así que el mapa (y su huella en la caché del LLM)
+# se reutiliza entre solicitudes.
+_semantic_maps = {}
+_semantic_maps_lock = threading.Lock()
+
+
+def mapa_semantico(db_key, schema):
+    """
+    Retorna el mapa semántico de 'schema', generándolo solo si el esquema de 'db_key' cambió.
+    """
+    with _semantic_maps_lock:
+        entry = _semantic_maps.get(db_key)
+        if entry is not None and entry[0] is schema:
+            return entry[1]
+    semantic_map = SemanticMappingAgent(custom_rules=None).generate_map(schema)
+    with _semantic_maps_lock:
+        _semantic_maps[db_key] = (schema, semantic_map)
+    return semantic_map
+
+
+def es_consulta_de_capacidades(prompt):
+    """
+    Indica si el usuario pregunta qué puede hacer el asistente.
+    """
+    return "que puedes hacer" in prompt.lower() or "qué puedes hacer" in prompt.lower()
+
+
+def frecuencia_de_serie(prompt):
+    """
+    Frecuencia de la serie temporal que pide la consulta ('h', 'D', ...), o None si no pide una.
+    """
+    prompt_lower = (prompt or "").lower()
+    return next((freq for expresion, freq in SERIE_FRECUENCIAS if expresion in prompt_lower), None)
+
+
+def respuesta_capacidades():
+    """
+    Respuesta fija con la descripción de las funcionalidades del asistente.
+    """
+    return {
+        "estructura_consulta": {},
+        "sql": "",
+        "resultados": {},
+        "formatted_response": ("Puedo ayudarte a contar, listar y comparar datos de la base de datos. "
+                               "Por ejemplo, puedo buscar objetos por número de placa, comparar la cantidad de "
+                               "carros de diferentes colores, analizar series temporales y mucho más. ¿En qué te puedo ayudar?"),
+        "analysis_result": None
+    }
+
+
+def procesar_consulta_placa(prompt, db_config, columnar=False):
+    """
+    Busca objetos por número de placa con PlateSearchService (filtros indexables y parametrizados).
+
+    La placa, el color y el rango de fechas se toman de la consulta; si no se mencionan, se usan el color
+    y el rango de la consulta de referencia original.
+    """
+    filtros = parse_plate_prompt(prompt)
+    plate_value = filtros["placa"]
+    color = filtros["color"] or PLACA_COLOR_POR_DEFECTO
+    desde = filtros["desde"] or PLACA_RANGO_POR_DEFECTO[0]
+    hasta = filtros["hasta"] or (PLACA_RANGO_POR_DEFECTO[1] if not filtros["desde"] else None)
+
+    # Conexiones prestadas por el pool compartido del proceso
+    get_connection = get_pool(db_config).get_connection
+    service = PlateSearchService(get_connection, result_cache=get_result_cache(),
+                                 cache_namespace=pool_key(db_config), columnar=columnar,
+                                 cost_guard=get_cost_guard(pool_key(db_config), get_connection))
+    object_ids = None
+    placas_similares = []
+    index = None
+    epoch_min, epoch_max = epoch_bounds(desde, hasta)
+    if plate_index_enabled():
+        # Resolver la placa en el índice residente. El índice solo acelera: si aún no cargó o no tiene la placa
+        # (p. ej. detectada después de la última actualización) se busca en SQL.
+        index = get_plate_index(pool_key(db_config), get_connection)
+        if index.loaded:
+            matches = index.lookup(plate_value, prefix=filtros["prefijo"], epoch_min=epoch_min, epoch_max=epoch_max)
+            object_ids = sorted({m[1] for m in matches}) or None
+            if object_ids and len(object_ids) > PLATE_INDEX_MAX_IDS:
+                object_ids = None
+
+    if object_ids is not None:
+        result_custom, sql = service.search(None, color=color, desde=desde, hasta=hasta, object_ids=object_ids)
+    else:
+        result_custom, sql = service.search(plate_value, color=color, desde=desde, hasta=hasta,
+                                            prefix=filtros["prefijo"])
+        if (index is not None and index.loaded and not filtros["prefijo"]
+                and result_custom is not None and not result_custom.get("data")):
+            # Sin resultados en SQL: placas a distancia de edición 1 del índice (errores de OCR).
+            matches = index.lookup(plate_value, fuzzy=True, epoch_min=epoch_min, epoch_max=epoch_max)
+            similar_ids = sorted({m[1] for m in matches})
+            if similar_ids and len(similar_ids) <= PLATE_INDEX_MAX_IDS:
+                placas_similares = sorted({m[0] for m in matches})
+                result_custom, sql = service.search(None, color=color, desde=desde, hasta=hasta,
+                                                    object_ids=similar_ids)
+    # Formatear la respuesta
+    if result_custom and result_custom.get("data"):
+        formatted_response = f"Resultados para la placa {plate_value}: se encontraron {len(result_custom['data'])} registros."
+        if placas_similares:
+            formatted_response += f" (placas similares: {', '.join(placas_similares)})"
+    else:
+        formatted_response = f"No se encontraron resultados para la placa {plate_value}."
+    decision = service.executor.last_cost_decision
+    return {
+        "estructura_consulta": {"custom": True, "placa": plate_value, "color": color, "desde": desde, "hasta": hasta},
+        "sql": sql,
+        "resultados": result_custom,
+        "formatted_response": respuesta_con_control_de_costo(decision, formatted_response),
+        "analysis_result": None,
+        "cost_guard": decision
+    }
+
+
+def preparar_contexto(db_config):
+    """
+    Obtiene el esquema (de la caché del proceso), el mapa semántico y el índice semántico de la base de datos.
+
+    :return: Diccionario con 'get_connection', 'db_name', 'schema', 'semantic_map', 'semantic_index',
+             'rollups' (RollupManager, o None si los agregados materializados están desactivados) y
+             'cost_guard' (CostGuard, o None si el control de costo está desactivado).
+    """
+    # Conexiones prestadas por el pool compartido del proceso (evita un handshake por sentencia)
+    get_connection = get_pool(db_config).get_connection
+    
+    db_name = db_config.get("database", "")
+    # Extraer el esquema (reutilizando la caché del proceso mientras siga vigente)
+    db_agent = DBSchemaAgent(get_connection, db_name, main_tables=None, include_sample_data=False)
+    schema = get_schema_cache().get_schema(db_config, db_agent)
+
+    # Generar el mapa semántico (reutilizado mientras el esquema no cambie)
+    semantic_map = mapa_semantico(pool_key(db_config), schema)
+    # Índice invertido para resolver tablas (se mantiene sincronizado mediante la caché de esquemas)
+    semantic_index = get_semantic_index(get_schema_cache().make_key(db_config, db_agent.main_tables,
+                                                                    db_agent.include_sample_data))
+    if not len(semantic_index):
+        semantic_index.update(semantic_map)
+
+    return {
+        "get_connection": get_connection,
+        "db_name": db_name,
+        "schema": schema,
+        "semantic_map": semantic_map,
+        "semantic_index": semantic_index,
+        "rollups": get_rollups(pool_key(db_config), get_connection),
+        "cost_guard": get_cost_guard(pool_key(db_config), get_connection),
+    }
+
+
+def interpretar_por_reglas(prompt, db_config, contexto):
+    """
+    Intenta la interpretación determinista por reglas (sin LLM).
+
+    :return: Estructura de consulta, o None si la confianza de las reglas no es suficiente.
+    """
+    try:
+        value_dictionary = get_value_dictionary(pool_key(db_config), contexto["get_connection"],
+                                                contexto["db_name"], contexto["schema"])
+    except Exception as e:
+        logger.warning("No se pudo cargar el diccionario de valores: %s", e)
+        value_dictionary = {}
+    intent_parser = RuleBasedIntentParser(contexto["schema"], contexto["semantic_map"], value_dictionary,
+                                          index=contexto["semantic_index"])
+    return intent_parser.interpretar(prompt)
+
+
+def crear_agente_llm(openai_api_key, rate_limiter=None):
+    """
+    Crea el UserQueryAgent con la caché de respuestas del proceso y el recorte de esquema.
+
+    LLM_TIMEOUT_S fija el tiempo máximo de cada llamada, LLM_MAX_RETRIES los reintentos ante errores
+    transitorios y LLM_BACKOFF_S la espera inicial entre reintentos.
+
+    :param rate_limiter: (Opcional) Limitador de las llamadas al LLM (ver batch.RateLimiter).
+    """
+    return UserQueryAgent(llm_api_key=openai_api_key, model="gpt-3.5-turbo", temperature=0.0,
+                          cache=get_llm_cache(), pruner=SchemaPruner(top_k=5, max_tokens=3000),
+                          rate_limiter=rate_limiter,
+                          timeout=float(os.environ.get("LLM_TIMEOUT_S", "20")),
+                          max_retries=int(os.environ.get("LLM_MAX_RETRIES", "2")),
+                          backoff=float(os.environ.get("LLM_BACKOFF_S", "0.5")))
+
+
+def crear_formateador():
+    """
+    Crea el ResponseFormatter con el presupuesto de filas, bytes y ancho de columna de la respuesta.
+    """
+    return ResponseFormatter(max_rows=RESPUESTA_MAX_FILAS, max_bytes=RESPUESTA_MAX_BYTES,
+                             max_col_width=RESPUESTA_MAX_ANCHO_COLUMNA)
+
+
+def sql_ejecutada(decision, sql, sql_params):
+    """
+    SQL que se muestra al usuario: la sentencia ajustada por el control de costo si se ajustó.
+    """
+    if decision and decision["decision"] == "ajustar":
+        return SQLGenerationAgent.renderizar_sql(decision["sql"], sql_params)
+    return sql
+
+
+def respuesta_con_control_de_costo(decision, formatted_response):
+    """
+    Agrega a la respuesta la decisión del control de costo (ver cost_guard.CostGuard) si no fue "permitir".
+    """
+    if not decision or decision["decision"] == "permitir":
+        return formatted_response
+    if decision["decision"] == "rechazar":
+        return f"La consulta no se ejecutó por su costo estimado: {decision['motivo']}."
+    return f"{formatted_response}\n\n(Consulta ajustada por su costo estimado: {', '.join(decision['ajustes'])}.)"
+
+
+def respuesta_con_plazo(deadline, formatted_response):
+    """
+    Agrega a la respuesta las etapas que se omitieron o cancelaron por el plazo de la solicitud (ver deadline.py).
+    """
+    if not deadline.degradations:
+        return formatted_response
+    etapas = "; ".join(f"{d['etapa']}: {d['motivo']}" for d in deadline.degradations)
+    if deadline.timeout is None:
+        # Sin plazo de la solicitud (REQUEST_TIMEOUT_S=0): degradación por el tiempo máximo de una llamada.
+        return f"{formatted_response}\n\n(Respuesta parcial por tiempo límite: {etapas}.)"
+    return f"{formatted_response}\n\n(Respuesta parcial por el tiempo límite de {deadline.timeout:g} s: {etapas}.)"
+
+
+def respuesta_por_plazo(error):
+    """
+    Respuesta degradada cuando una etapa sin resultado parcial (esquema, conexión) no termina a tiempo.
+    """
+    return {
+        "estructura_consulta": {},
+        "sql": None,
+        "resultados": None,
+        "formatted_response": "No se pudo completar la consulta dentro del tiempo límite. Intenta de nuevo "
+                              "o con una consulta más específica.",
+        "analysis_result": None,
+        "error": str(error)
+    }
+
+
+def analizar_resultados(resultados, estructura_consulta=None, contexto=None, db_config=None, freq='D', serie=False):
+    """
+    (Opcional) Análisis estadístico si la consulta incluye columnas de fechas.
+
+    Si se conocen la estructura de la consulta y el contexto (esquema y conexión), la agregación se hace en
+    el servidor sobre la tabla completa con los mismos filtros (DataAnalysisAgent.aggregate_in_sql), en vez
+    de agrupar en pandas las filas ya limitadas por el LIMIT de la consulta. Los conteos sobre tablas con
+    columna de tiempo se acompañan de la serie de conteos por intervalo cuando la cubren los agregados
+    materializados, o con GROUP BY en el servidor si el usuario pidió una serie temporal.
+
+    :param serie: Si es True (ver frecuencia_de_serie), la serie de conteos se calcula aunque los agregados
+                  no la cubran.
+
+    :return: Diccionario con 'agg_data' (y 'fuente': "rollup", "sql" o "pandas") o None si no aplica.
+    """
+    analysis_result = None
+    table = (estructura_consulta or {}).get("tabla")
+    if (contexto is not None and table in contexto["schema"]
+            and (estructura_consulta.get("accion") or "").lower() == "contar" and resultados):
+        # Conteo sobre una tabla con columna de tiempo: serie de conteos (desde los agregados si aplican).
+        time_column = next((c for c in TIME_COLUMNS if c in contexto["schema"][table]["columns"]), None)
+        if time_column:
+            analysis_agent = DataAnalysisAgent(time_unit='ms', rollups=contexto.get("rollups"),
+                                               cost_guard=contexto.get("cost_guard"))
+            filtros = estructura_consulta.get("filtros", {})
+            where_clause, params = SQLGenerationAgent().construir_filtros(table, filtros, contexto["schema"])
+            agg_df = analysis_agent.count_by_time(
+                contexto["get_connection"], table, time_column, freq=freq, filters=filtros,
+                where_clause=where_clause, params=params, result_cache=get_result_cache(),
+                cache_namespace=pool_key(db_config) if db_config else None, rollup_only=not serie)
+            if agg_df is not None:
+                agg_df = agg_df.rename(columns={time_column: "timestamp"})
+                fuente = "rollup" if analysis_agent.last_rollup_hit else "sql"
+                return {"agg_data": agg_df.to_dict(orient="list"), "fuente": fuente}
+        return None
+
+    if resultados and resultados.get("columns") and resultados.get("data"):
+        if "timestamp" in resultados["columns"]:
+            numeric_cols = [col for col in resultados["columns"] if col != "timestamp"]
+            if numeric_cols:
+                analysis_agent = DataAnalysisAgent(
+                    time_unit='ms', cost_guard=contexto.get("cost_guard") if contexto is not None else None)
+                table = (estructura_consulta or {}).get("tabla")
+                if contexto is not None and table in contexto["schema"]:
+                    columns = contexto["schema"][table]["columns"]
+                    analysis_column = columna_de_analisis(columns, numeric_cols)
+                    where_clause, params = SQLGenerationAgent().construir_filtros(
+                        table, estructura_consulta.get("filtros", {}), contexto["schema"])
+                    agg_df = analysis_agent.aggregate_in_sql(
+                        contexto["get_connection"], table, "timestamp", analysis_column, freq=freq,
+                        where_clause=where_clause, params=params, result_cache=get_result_cache(),
+                        cache_namespace=pool_key(db_config) if db_config else None)
+                    if agg_df is not None:
+                        return {"agg_data": agg_df.to_dict(orient="list"), "fuente": "sql"}
+                # Sin contexto (o si la agregación en el servidor falla): agrupar las filas obtenidas.
+                # Sin copia de los datos si el resultado es columnar
+                from columnar import as_dataframe
+                df = as_dataframe(resultados)
+                analysis_column = numeric_cols[0]
+                df_converted = analysis_agent.convert_epoch_to_datetime(df, "timestamp")
+                agg_df = analysis_agent.aggregate_by_time(df_converted, "timestamp", analysis_column, freq=freq)
+                analysis_result = {"agg_data": agg_df.to_dict(orient="list"), "fuente": "pandas"}
+    return analysis_result
+
+
+def columna_de_analisis(columns, candidatas):
+    """
+    Elige la columna a analizar: la primera columna numérica que no sea clave primaria; si no hay ninguna,
+    la primera columna candidata (el comportamiento original).
+    """
+    for col in candidatas:
+        info = columns.get(col, {})
+        if str(info.get("type", "")).lower() in NUMERIC_TYPES and info.get("key") != "PRI":
+            return col
+    return candidatas[0]
+
+
+def process_query(prompt, db_config, openai_api_key, bypass_cache=False, columnar=False, timeout=None):
     """
     Orquesta la ejecución completa:
       - Si el usuario pregunta "qué puedes hacer", retorna una descripción de las funcionalidades.
@@ -48,129 +415,109 @@ def process_query(prompt, db_config, openai_api_key):
           • Interpretar la consulta en lenguaje natural.
           • Generar la consulta SQL.
           • Ejecutarla y, de ser necesario, realizar análisis adicional.
+
+    Cada etapa se mide con un span (ver tracing.py) y el resumen de tiempos se incluye en la clave 'trace'.
+    La decisión del control de costo previo a la ejecución (ver cost_guard.py) se incluye en 'cost_guard'.
+    Existe una variante asíncrona en async_pipeline.process_query_async.
+
+    :param bypass_cache: Si es True, la interpretación se pide siempre al LLM sin consultar la caché.
+    :param columnar: Si es True, 'resultados' es un ColumnarResult (arreglos tipados por columna) en lugar
+                     del diccionario con la lista de tuplas.
+    :param timeout: Plazo de la solicitud en segundos (por defecto, REQUEST_TIMEOUT_S). Las llamadas al LLM se
+                    acotan a lo que queda del plazo, la sentencia SQL en curso se cancela en el servidor al
+                    vencer y el análisis se omite si ya no hay tiempo; la respuesta indica lo que se omitió y
+                    'deadline' resume el plazo.
     """
+    tracer = Tracer("process_query")
+    with deadline_scope(timeout if timeout is not None else request_timeout()) as deadline:
+        try:
+            result = _process_query(prompt, db_config, openai_api_key, bypass_cache, columnar)
+        except TimeoutError as e:
+            # Conexión o esquema sin terminar a tiempo: respuesta degradada en lugar de propagar el error.
+            if not deadline.expired():
+                raise
+            degrade("solicitud", str(e))
+            result = respuesta_por_plazo(e)
+        finally:
+            summary = tracer.finish()
+    result["formatted_response"] = respuesta_con_plazo(deadline, result["formatted_response"])
+    result["trace"] = summary
+    result["deadline"] = deadline.report()
+    return result
+
+
+def _process_query(prompt, db_config, openai_api_key, bypass_cache, columnar):
     # Si el usuario pregunta qué puede hacer, se devuelve un mensaje de funcionalidades.
-    if "que puedes hacer" in prompt.lower() or "qué puedes hacer" in prompt.lower():
-        return {
-            "estructura_consulta": {},
-            "sql": "",
-            "resultados": {},
-            "formatted_response": ("Puedo ayudarte a contar, listar y comparar datos de la base de datos. "
-                                   "Por ejemplo, puedo buscar objetos por número de placa, comparar la cantidad de "
-                                   "carros de diferentes colores, analizar series temporales y mucho más. ¿En qué te puedo ayudar?"),
-            "analysis_result": None
-        }
+    if es_consulta_de_capacidades(prompt):
+        return respuesta_capacidades()
     
     # Si el prompt menciona "placa", utilizar consulta personalizada
     if "placa" in prompt.lower():
-        # Extraer el valor de la placa (se asume que se escribe de forma similar a: placa: ABQ874 o 'ABQ874')
-        match = re.search(r"placa\s*(?:[:=]\s*|['\"])([A-Z0-9]+)", prompt, re.IGNORECASE)
-        plate_value = match.group(1) if match else ""
-        
-        # Generar un query personalizado (ejemplo basado en tu consulta de referencia)
-        sql_custom = f"""
-SELECT 
-    o.id AS object_id, 
-    o.img_id,
-    c.id AS cls, 
-    c.category AS tipo, 
-    m.camera_id AS camara,
-    v.epoch AS fecha,
-    m.location AS ubication,
-    o.accuracy AS object_accuracy,
-    d1.description AS plate, 
-    d1.accuracy AS plate_accuracy,
-    d2.description AS color,
-    d2.accuracy AS color_accuracy
-FROM object o
-JOIN categories c ON c.id = o.category_id
-JOIN videos v ON v.id = o.video_id
-JOIN cameras m ON m.id = v.camera_id
-JOIN detections d1 ON d1.object_id = o.id AND d1.attribute_id = 1 AND d1.status = 1 AND d1.description = '{plate_value}'
-JOIN detections d2 ON d2.object_id = o.id AND d2.attribute_id = 2 AND d2.status = 1 AND d2.description = 'yellow'
-WHERE (FROM_UNIXTIME(o.epoch / 1000 - 3600 * 5) BETWEEN '2025-02-02' AND '2025-02-05')
-ORDER BY o.id DESC;
-        """
-        def get_connection():
-            return mysql.connector.connect(
-                host=db_config.get("host", "localhost"),
-                user=db_config.get("user", ""),
-                password=db_config.get("password", ""),
-                database=db_config.get("database", ""),
-                port=db_config.get("port", 3306)
-            )
-        query_executor = QueryExecutor(get_connection)
-        result_custom = query_executor.ejecutar_sql(sql_custom)
-        # Formatear la respuesta
-        if result_custom and result_custom.get("data"):
-            formatted_response = f"Resultados para la placa {plate_value}: se encontraron {result_custom['data'][0][0]} registros."
-        else:
-            formatted_response = f"No se encontraron resultados para la placa {plate_value}."
-        return {
-            "estructura_consulta": {"custom": True},
-            "sql": sql_custom,
-            "resultados": result_custom,
-            "formatted_response": formatted_response,
-            "analysis_result": None
-        }
+        with span("consulta_placa"):
+            return procesar_consulta_placa(prompt, db_config, columnar)
     
     # Flujo normal
-    def get_connection():
-        return mysql.connector.connect(
-            host=db_config.get("host", "localhost"),
-            user=db_config.get("user", ""),
-            password=db_config.get("password", ""),
-            database=db_config.get("database", ""),
-            port=db_config.get("port", 3306)
-        )
-    
-    db_name = db_config.get("database", "")
-    # Extraer el esquema
-    db_agent = DBSchemaAgent(get_connection, db_name, main_tables=None, include_sample_data=False)
-    schema = db_agent.get_schema_dict()
+    with span("esquema"):
+        contexto = preparar_contexto(db_config)
+    schema = contexto["schema"]
+    semantic_map = contexto["semantic_map"]
 
-    # Generar el mapa semántico
-    semantic_agent = SemanticMappingAgent(custom_rules=None)
-    semantic_map = semantic_agent.generate_map(schema)
+    # Intentar primero la interpretación determinista por reglas (sin LLM) para consultas simples
+    with span("interpretar_reglas"):
+        estructura_consulta = interpretar_por_reglas(prompt, db_config, contexto)
+    interpretacion = "reglas"
 
-    # Interpretar la consulta en lenguaje natural (usando OpenAI)
-    user_query_agent = UserQueryAgent(llm_api_key=openai_api_key, model="gpt-3.5-turbo", temperature=0.0)
-    estructura_consulta = user_query_agent.interpretar_consulta(prompt, schema, semantic_map)
+    # Interpretar la consulta en lenguaje natural (usando OpenAI) si las reglas no son concluyentes
+    user_query_agent = crear_agente_llm(openai_api_key)
+    if estructura_consulta is None:
+        interpretacion = "llm"
+        with span("interpretar_consulta"):
+            estructura_consulta = user_query_agent.interpretar_consulta(prompt, schema, semantic_map,
+                                                                       bypass_cache=bypass_cache)
     if not estructura_consulta.get("tabla"):
-        inferred_table = infer_table_from_query(prompt, semantic_map)
+        inferred_table = infer_table_from_query(prompt, semantic_map, contexto["semantic_index"])
         estructura_consulta["tabla"] = inferred_table
 
     # Generar la consulta SQL
-    sql_generator = SQLGenerationAgent(limit=25)
-    sql = sql_generator.generar_sql(estructura_consulta, schema)
+    with span("generar_sql"):
+        sql_generator = SQLGenerationAgent(limit=25, rollups=contexto["rollups"])
+        sql_template, sql_params = sql_generator.generar_sql_parametrizada(estructura_consulta, schema)
+        sql = sql_generator.renderizar_sql(sql_template, sql_params) if sql_template else None
 
     # Ejecutar la consulta SQL
-    query_executor = QueryExecutor(get_connection)
-    resultados = query_executor.ejecutar_sql(sql)
+    with span("ejecutar_sql"):
+        query_executor = QueryExecutor(contexto["get_connection"], result_cache=get_result_cache(),
+                                       cache_namespace=pool_key(db_config), columnar=columnar,
+                                       cost_guard=contexto["cost_guard"])
+        resultados = query_executor.ejecutar_sql(sql_template, params=sql_params) if sql_template else None
+    decision = query_executor.last_cost_decision
+    sql = sql_ejecutada(decision, sql, sql_params)
 
     # Formatear la respuesta en lenguaje natural
-    response_formatter = ResponseFormatter()
-    formatted_response = response_formatter.formatear_respuesta(resultados, estructura_consulta)
+    with span("formatear_respuesta"):
+        response_formatter = crear_formateador()
+        formatted_response = respuesta_con_control_de_costo(
+            decision, response_formatter.formatear_respuesta(resultados, estructura_consulta))
 
     # (Opcional) Análisis estadístico si la consulta incluye columnas de fechas
     analysis_result = None
-    if resultados and resultados.get("columns") and resultados.get("data"):
-        if "timestamp" in resultados["columns"]:
-            df = pd.DataFrame(resultados["data"], columns=resultados["columns"])
-            numeric_cols = [col for col in resultados["columns"] if col != "timestamp"]
-            if numeric_cols:
-                analysis_column = numeric_cols[0]
-                analysis_agent = DataAnalysisAgent(time_unit='ms')
-                df_converted = analysis_agent.convert_epoch_to_datetime(df.copy(), "timestamp")
-                agg_df = analysis_agent.aggregate_by_time(df_converted, "timestamp", analysis_column, freq='D')
-                analysis_result = {"agg_data": agg_df.to_dict(orient="list")}
+    if expired():
+        degrade("analisis", "análisis omitido")
+    else:
+        with span("analisis"):
+            freq = frecuencia_de_serie(prompt)
+            analysis_result = analizar_resultados(resultados, estructura_consulta, contexto, db_config,
+                                                  freq=freq or 'D', serie=freq is not None)
 
     return {
         "estructura_consulta": estructura_consulta,
         "sql": sql,
         "resultados": resultados,
         "formatted_response": formatted_response,
-        "analysis_result": analysis_result
+        "analysis_result": analysis_result,
+        "prompt_report": user_query_agent.last_prompt_report,
+        "interpretacion": interpretacion,
+        "cost_guard": decision
     }
 
 
@@ -0,0 +1,173 @@
+# modules/async_pipeline.py
+
+import asyncio
+import logging
+
+from connection_pool import pool_key
+from result_cache import get_result_cache
+from app import (
+    es_consulta_de_capacidades,
+    respuesta_capacidades,
+    procesar_consulta_placa,
+    preparar_contexto,
+    interpretar_por_reglas,
+    crear_agente_llm,
+    crear_formateador,
+    infer_table_from_query,
+    analizar_resultados,
+    frecuencia_de_serie,
+    sql_ejecutada,
+    respuesta_con_control_de_costo,
+    respuesta_con_plazo,
+    respuesta_por_plazo,
+)
+from sql_generator import SQLGenerationAgent
+from query_executor import QueryExecutor
+from tracing import Tracer, span
+from deadline import deadline_scope, degrade, expired, request_timeout
+
+logger = logging.getLogger(__name__)
+
+
+async def process_query_async(prompt, db_config, openai_api_key, bypass_cache=False, especular_llm=False,
+                              columnar=False, timeout=None):
+    """
+    Variante asíncrona de app.process_query, pensada para que un único proceso atienda muchas sesiones de chat.
+
+    Las etapas que usan el conector MySQL (síncrono) se ejecutan en hilos con asyncio.to_thread y comparten
+    el pool de conexiones; la llamada al LLM usa la API asíncrona de OpenAI. Las etapas independientes se solapan:
+      - Con 'especular_llm=True', la llamada al LLM se lanza en paralelo con la interpretación por reglas
+        (que puede necesitar cargar el diccionario de valores) y se cancela si las reglas son concluyentes.
+      - El formateo de la respuesta y el análisis estadístico se ejecutan concurrentemente.
+
+    :param bypass_cache: Si es True, la interpretación se pide siempre al LLM sin consultar la caché.
+    :param especular_llm: Si es True, lanza la llamada al LLM sin esperar el resultado de las reglas.
+    :param columnar: Si es True, 'resultados' es un ColumnarResult.
+    :param timeout: Plazo de la solicitud en segundos (por defecto, REQUEST_TIMEOUT_S), como en process_query.
+    :return: El mismo diccionario que process_query (incluidas las claves 'trace' y 'deadline').
+    """
+    tracer = Tracer("process_query_async")
+    with deadline_scope(timeout if timeout is not None else request_timeout()) as deadline:
+        try:
+            result = await _process_query_async(prompt, db_config, openai_api_key, bypass_cache, especular_llm,
+                                                columnar)
+        except TimeoutError as e:
+            if not deadline.expired():
+                raise
+            degrade("solicitud", str(e))
+            result = respuesta_por_plazo(e)
+        finally:
+            summary = tracer.finish()
+    result["formatted_response"] = respuesta_con_plazo(deadline, result["formatted_response"])
+    result["trace"] = summary
+    result["deadline"] = deadline.report()
+    return result
+
+
+async def _process_query_async(prompt, db_config, openai_api_key, bypass_cache, especular_llm, columnar):
+    if es_consulta_de_capacidades(prompt):
+        return respuesta_capacidades()
+
+    if "placa" in prompt.lower():
+        with span("consulta_placa"):
+            return await asyncio.to_thread(procesar_consulta_placa, prompt, db_config, columnar)
+
+    with span("esquema"):
+        contexto = await asyncio.to_thread(preparar_contexto, db_config)
+    schema = contexto["schema"]
+    semantic_map = contexto["semantic_map"]
+
+    user_query_agent = crear_agente_llm(openai_api_key)
+    reglas_task = asyncio.create_task(_traced_to_thread("interpretar_reglas", interpretar_por_reglas,
+                                                        prompt, db_config, contexto))
+    llm_task = None
+    if especular_llm:
+        llm_task = asyncio.create_task(_interpretar_llm(user_query_agent, prompt, schema, semantic_map, bypass_cache))
+
+    estructura_consulta = await reglas_task
+    interpretacion = "reglas"
+    if estructura_consulta is not None:
+        if llm_task is not None:
+            llm_task.cancel()
+    else:
+        interpretacion = "llm"
+        if llm_task is None:
+            llm_task = asyncio.create_task(
+                _interpretar_llm(user_query_agent, prompt, schema, semantic_map, bypass_cache)
+            )
+        estructura_consulta = await llm_task
+
+    if not estructura_consulta.get("tabla"):
+        estructura_consulta["tabla"] = infer_table_from_query(prompt, semantic_map, contexto["semantic_index"])
+
+    with span("generar_sql"):
+        sql_generator = SQLGenerationAgent(limit=25, rollups=contexto["rollups"])
+        sql_template, sql_params = sql_generator.generar_sql_parametrizada(estructura_consulta, schema)
+        sql = sql_generator.renderizar_sql(sql_template, sql_params) if sql_template else None
+
+    query_executor = QueryExecutor(contexto["get_connection"], result_cache=get_result_cache(),
+                                   cache_namespace=pool_key(db_config), columnar=columnar,
+                                   cost_guard=contexto["cost_guard"])
+    resultados = None
+    if sql_template:
+        resultados = await _traced_to_thread("ejecutar_sql", query_executor.ejecutar_sql, sql_template, sql_params)
+    decision = query_executor.last_cost_decision
+    sql = sql_ejecutada(decision, sql, sql_params)
+
+    # El formateo y el análisis son independientes entre sí (el análisis se omite si ya venció el plazo).
+    response_formatter = crear_formateador()
+    if expired():
+        degrade("analisis", "análisis omitido")
+        formatted_response = await _traced_to_thread("formatear_respuesta", response_formatter.formatear_respuesta,
+                                                     resultados, estructura_consulta)
+        analysis_result = None
+    else:
+        freq = frecuencia_de_serie(prompt)
+        formatted_response, analysis_result = await asyncio.gather(
+            _traced_to_thread("formatear_respuesta", response_formatter.formatear_respuesta,
+                              resultados, estructura_consulta),
+            _traced_to_thread("analisis", analizar_resultados, resultados, estructura_consulta, contexto, db_config,
+                              freq or 'D', freq is not None),
+        )
+
+    return {
+        "estructura_consulta": estructura_consulta,
+        "sql": sql,
+        "resultados": resultados,
+        "formatted_response": respuesta_con_control_de_costo(decision, formatted_response),
+        "analysis_result": analysis_result,
+        "prompt_report": user_query_agent.last_prompt_report,
+        "interpretacion": interpretacion,
+        "cost_guard": decision
+    }
+
+
+async def _traced_to_thread(name, func, *args):
+    """
+    Ejecuta 'func' en un hilo dentro de un span (el contexto de la traza se copia al hilo).
+    """
+    with span(name):
+        return await asyncio.to_thread(func, *args)
+
+
+async def _interpretar_llm(user_query_agent, prompt, schema, semantic_map, bypass_cache):
+    with span("interpretar_consulta"):
+        return await user_query_agent.interpretar_consulta_async(prompt, schema, semantic_map,
+                                                                 bypass_cache=bypass_cache)
+
+
+async def process_queries_async(requests, max_concurrency=16):
+    """
+    Atiende varias peticiones concurrentemente con un límite de concurrencia.
+
+    :param requests: Lista de tuplas (prompt, db_config, openai_api_key).
+    :param max_concurrency: Número máximo de peticiones en curso simultáneamente.
+    :return: Lista de resultados en el mismo orden que 'requests'.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(prompt, db_config, openai_api_key):
+        async with semaphore:
+            return await process_query_async(prompt, db_config, openai_api_key)
+
+    return await asyncio.gather(*(run(*request) for request in requests))
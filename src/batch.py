@@ -0,0 +1,271 @@
+# modules/batch.py
+
+import contextvars
+import copy
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from connection_pool import get_pool, pool_key
+from result_cache import get_result_cache
+from llm_cache import normalizar_consulta
+from app import (
+    es_consulta_de_capacidades,
+    respuesta_capacidades,
+    procesar_consulta_placa,
+    preparar_contexto,
+    interpretar_por_reglas,
+    crear_agente_llm,
+    crear_formateador,
+    infer_table_from_query,
+    analizar_resultados,
+    frecuencia_de_serie,
+    sql_ejecutada,
+    respuesta_con_control_de_costo,
+)
+from sql_generator import SQLGenerationAgent
+from query_executor import QueryExecutor
+from tracing import Tracer, span
+from deadline import deadline_scope, degrade, expired
+
+
+class RateLimiter:
+    """
+    Limitador de tasa (cubeta de fichas) compartido entre hilos: permite ráfagas de hasta 'burst' llamadas
+    y, en promedio, 'rate' llamadas por segundo.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: Llamadas por segundo permitidas en promedio.
+        :param burst: Número máximo de llamadas seguidas sin esperar.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Espera hasta que haya una ficha disponible y la consume.
+
+        :return: Segundos esperados.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class BatchQueryRunner:
+    """
+    Responde una lista de consultas en lenguaje natural en una sola llamada (p. ej. reportes nocturnos),
+    compartiendo el trabajo común en lugar de repetir process_query por cada una:
+      - El esquema, el mapa semántico y el índice semántico se preparan una sola vez.
+      - Las consultas iguales tras normalizarlas (ver llm_cache.normalizar_consulta) se interpretan una vez.
+      - Las que las reglas no resuelven se envían al LLM como llamadas concurrentes (hasta 'llm_concurrency')
+        limitadas por un RateLimiter (las respuestas de la caché del LLM no consumen fichas).
+      - Las sentencias SQL distintas se ejecutan una vez cada una en un grupo acotado de hilos
+        ('max_workers', sin superar el tamaño del pool de conexiones); el formateo y el análisis se hacen
+        en el mismo hilo.
+    Los resultados se retornan en el orden de las consultas, con el mismo formato que process_query.
+    Con 'timeout', todo el lote comparte un plazo (ver deadline.py): las llamadas al LLM se acotan a lo que
+    queda, las sentencias en curso se cancelan al vencer y el análisis se omite si ya no hay tiempo.
+    """
+
+    def __init__(self, db_config, openai_api_key, max_workers=4, llm_concurrency=4, llm_rate=3.0, llm_burst=4,
+                 bypass_cache=False, columnar=False, timeout=None):
+        """
+        :param db_config: Configuración de la base de datos.
+        :param openai_api_key: Clave de la API de OpenAI.
+        :param max_workers: Hilos para ejecutar las sentencias SQL (acotado por el tamaño del pool).
+        :param llm_concurrency: Llamadas simultáneas al LLM como máximo.
+        :param llm_rate: Llamadas por segundo al LLM en promedio.
+        :param llm_burst: Llamadas al LLM permitidas en ráfaga.
+        :param bypass_cache: Si es True, la interpretación se pide siempre al LLM sin consultar la caché.
+        :param columnar: Si es True, 'resultados' es un ColumnarResult.
+        :param timeout: (Opcional) Plazo de todo el lote en segundos.
+        """
+        self.db_config = db_config
+        self.openai_api_key = openai_api_key
+        self.max_workers = max(1, min(max_workers, get_pool(db_config).pool_size))
+        self.llm_concurrency = max(1, llm_concurrency)
+        self.rate_limiter = RateLimiter(llm_rate, llm_burst)
+        self.bypass_cache = bypass_cache
+        self.columnar = columnar
+        self.timeout = timeout
+        self.last_trace = None
+        self.last_deadline = None
+        self.stats = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def run(self, prompts):
+        """
+        Procesa las consultas y retorna una lista de resultados en el mismo orden.
+
+        Cada resultado tiene las claves de process_query y además 'prompt'; si una consulta falla, el resto
+        continúa y su resultado incluye 'error'. El resumen de tiempos del lote queda en 'last_trace' y el del
+        plazo (etapas omitidas o canceladas) en 'last_deadline'.
+        """
+        tracer = Tracer("process_batch")
+        with deadline_scope(self.timeout) as deadline:
+            try:
+                results = self._run(list(prompts))
+            finally:
+                self.last_trace = tracer.finish()
+                self.last_deadline = deadline.report()
+        return results
+
+    def _run(self, prompts):
+        self.stats = {"prompts": len(prompts), "interpretaciones": 0, "llm": 0, "sql": 0}
+        results = [None] * len(prompts)
+        plate_jobs = []
+        pending = {}  # consulta normalizada -> índices de las consultas
+        for i, prompt in enumerate(prompts):
+            if es_consulta_de_capacidades(prompt):
+                results[i] = respuesta_capacidades()
+            elif "placa" in prompt.lower():
+                plate_jobs.append(i)
+            else:
+                pending.setdefault(normalizar_consulta(prompt), []).append(i)
+
+        contexto = None
+        estructuras = {}
+        if pending:
+            with span("esquema"):
+                contexto = preparar_contexto(self.db_config)
+            estructuras = self._interpretar(prompts, pending, contexto)
+
+        # Agrupar las consultas por sentencia SQL: cada sentencia distinta se ejecuta una sola vez.
+        sql_generator = SQLGenerationAgent(limit=25, rollups=contexto["rollups"] if contexto else None)
+        sql_jobs = {}
+        for key, indices in pending.items():
+            estructura_consulta, interpretacion = estructuras[key]
+            if not estructura_consulta.get("tabla"):
+                estructura_consulta["tabla"] = infer_table_from_query(prompts[indices[0]], contexto["semantic_map"],
+                                                                      contexto["semantic_index"])
+            sql_template, sql_params = sql_generator.generar_sql_parametrizada(estructura_consulta, contexto["schema"])
+            freq = frecuencia_de_serie(prompts[indices[0]])
+            job_key = (sql_template, json.dumps(sql_params, default=str),
+                       json.dumps(estructura_consulta, sort_keys=True, default=str), freq)
+            sql_jobs.setdefault(job_key, []).append((indices, estructura_consulta, interpretacion,
+                                                     sql_template, sql_params, freq))
+
+        with span("ejecutar_sql", sentencias=len(sql_jobs), placas=len(plate_jobs)):
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                plate_futures = [(i, self._submit(executor, procesar_consulta_placa, prompts[i], self.db_config,
+                                                  self.columnar)) for i in plate_jobs]
+                sql_futures = [(jobs, self._submit(executor, self._responder, jobs[0], contexto))
+                               for jobs in sql_jobs.values()]
+                for i, future in plate_futures:
+                    results[i] = self._resultado(future)
+                for jobs, future in sql_futures:
+                    result = self._resultado(future)
+                    for indices, estructura_consulta, interpretacion, _, _, _ in jobs:
+                        for i in indices:
+                            results[i] = dict(result, estructura_consulta=copy.deepcopy(estructura_consulta),
+                                              interpretacion=interpretacion)
+        self.stats["sql"] = len(sql_jobs) + len(plate_jobs)
+
+        for prompt, result in zip(prompts, results):
+            result["prompt"] = prompt
+        return results
+
+    def _interpretar(self, prompts, pending, contexto):
+        """
+        Interpreta una vez cada consulta distinta: primero por reglas y, si no son concluyentes, con el LLM.
+
+        :return: Diccionario {consulta normalizada: (estructura_consulta, 'reglas' o 'llm')}.
+        """
+        estructuras = {}
+        llm_keys = []
+        with span("interpretar_reglas", consultas=len(pending)):
+            for key, indices in pending.items():
+                estructura_consulta = interpretar_por_reglas(prompts[indices[0]], self.db_config, contexto)
+                if estructura_consulta is None:
+                    llm_keys.append(key)
+                else:
+                    estructuras[key] = (estructura_consulta, "reglas")
+        self.stats["interpretaciones"] = len(pending)
+        self.stats["llm"] = len(llm_keys)
+
+        if llm_keys:
+            def interpretar_llm(prompt):
+                # Un agente por llamada: 'last_prompt_report' es estado de cada agente.
+                return crear_agente_llm(self.openai_api_key, self.rate_limiter).interpretar_consulta(
+                    prompt, contexto["schema"], contexto["semantic_map"], bypass_cache=self.bypass_cache)
+
+            with span("interpretar_consulta", llamadas=len(llm_keys)):
+                with ThreadPoolExecutor(max_workers=min(self.llm_concurrency, len(llm_keys))) as executor:
+                    futures = [(key, self._submit(executor, interpretar_llm, prompts[pending[key][0]]))
+                               for key in llm_keys]
+                    for key, future in futures:
+                        try:
+                            estructuras[key] = (future.result(), "llm")
+                        except Exception as e:
+                            self.logger.error("Error al interpretar '%s': %s", prompts[pending[key][0]], e)
+                            estructuras[key] = ({}, "llm")
+        return estructuras
+
+    def _responder(self, job, contexto):
+        """
+        Ejecuta la sentencia de un grupo de consultas, formatea la respuesta y realiza el análisis.
+        """
+        _, estructura_consulta, _, sql_template, sql_params, freq = job
+        sql = SQLGenerationAgent.renderizar_sql(sql_template, sql_params) if sql_template else None
+        query_executor = QueryExecutor(contexto["get_connection"], result_cache=get_result_cache(),
+                                       cache_namespace=pool_key(self.db_config), columnar=self.columnar,
+                                       cost_guard=contexto["cost_guard"])
+        resultados = query_executor.ejecutar_sql(sql_template, params=sql_params) if sql_template else None
+        decision = query_executor.last_cost_decision
+        return {
+            "sql": sql_ejecutada(decision, sql, sql_params),
+            "resultados": resultados,
+            "formatted_response": respuesta_con_control_de_costo(
+                decision, crear_formateador().formatear_respuesta(resultados, estructura_consulta)),
+            "analysis_result": self._analizar(resultados, estructura_consulta, contexto, freq),
+            "prompt_report": None,
+            "cost_guard": decision,
+        }
+
+    def _analizar(self, resultados, estructura_consulta, contexto, freq=None):
+        if expired():
+            degrade("analisis", "análisis omitido")
+            return None
+        return analizar_resultados(resultados, estructura_consulta, contexto, self.db_config,
+                                   freq=freq or 'D', serie=freq is not None)
+
+    @staticmethod
+    def _submit(executor, func, *args):
+        # Cada tarea se ejecuta con una copia del contexto para que sus spans cuelguen de la traza del lote.
+        return executor.submit(contextvars.copy_context().run, func, *args)
+
+    def _resultado(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            self.logger.error("Error al procesar una consulta del lote: %s", e)
+            return {"sql": None, "resultados": None, "analysis_result": None, "error": str(e),
+                    "formatted_response": "No se encontraron resultados o se produjo un error en la consulta."}
+
+
+def process_batch(prompts, db_config, openai_api_key, **kwargs):
+    """
+    Responde varias consultas en una sola llamada (ver BatchQueryRunner).
+
+    :param prompts: Lista de consultas en lenguaje natural.
+    :param kwargs: Parámetros adicionales de BatchQueryRunner (max_workers, llm_rate, columnar, etc.).
+    :return: Lista de resultados en el orden de 'prompts'.
+    """
+    return BatchQueryRunner(db_config, openai_api_key, **kwargs).run(prompts)
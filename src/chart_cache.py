@@ -0,0 +1,214 @@
+# modules/chart_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# NumPy y pandas se importan dentro de las funciones: este módulo se importa desde el frontend y no debe
+# cargarlos hasta que haya un gráfico que dibujar.
+
+
+def lttb(x, y, n_out):
+    """
+    Reduce una serie a 'n_out' puntos con Largest-Triangle-Three-Buckets, que conserva la forma visual
+    (picos y valles) eligiendo en cada intervalo el punto que forma el triángulo de mayor área con el punto
+    elegido en el intervalo anterior y el promedio del siguiente.
+
+    :param x: Arreglo de abscisas numéricas y crecientes (p. ej. epoch o datetime64 convertido a enteros).
+    :param y: Arreglo de valores (los NaN se tratan como 0 al calcular las áreas).
+    :param n_out: Número de puntos de salida (>= 3).
+    :return: Arreglo de índices de los puntos elegidos (incluye el primero y el último).
+    """
+    import numpy as np
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    xf = np.asarray(x, dtype=np.float64)
+    yf = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    # Límites de los n_out - 2 intervalos interiores (el primer y el último punto se conservan siempre).
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Promedios de cada intervalo, calculados de una vez con sumas acumuladas.
+    csx = np.concatenate(([0.0], np.cumsum(xf)))
+    csy = np.concatenate(([0.0], np.cumsum(yf)))
+    counts = np.maximum(edges[1:] - edges[:-1], 1)
+    avg_x = (csx[edges[1:]] - csx[edges[:-1]]) / counts
+    avg_y = (csy[edges[1:]] - csy[edges[:-1]]) / counts
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Promedio del intervalo siguiente (para el último, el punto final).
+        cx, cy = (avg_x[i + 1], avg_y[i + 1]) if i + 1 < len(avg_x) else (xf[-1], yf[-1])
+        areas = np.abs((xf[a] - cx) * (yf[start:end] - yf[a]) - (xf[a] - xf[start:end]) * (cy - yf[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_downsample(x, y, n_out):
+    """
+    Reduce una serie a lo sumo a 'n_out' puntos conservando el mínimo y el máximo de cada intervalo
+    (completamente vectorizado; más rápido que LTTB y exacto para los extremos).
+
+    :return: Arreglo ordenado de índices de los puntos elegidos (incluye el primero y el último).
+    """
+    import numpy as np
+    n = len(x)
+    buckets = max((n_out - 2) // 2, 1)
+    if n_out >= n:
+        return np.arange(n)
+    # Intervalos de igual tamaño; el relleno final (NaN) nunca se elige como mínimo ni como máximo.
+    size = -(-n // buckets)
+    yf = np.full(buckets * size, np.nan)
+    yf[:n] = np.asarray(y, dtype=np.float64)
+    blocks = yf.reshape(buckets, size)
+    nan = np.isnan(blocks)
+    offsets = np.arange(buckets) * size
+    chosen = np.concatenate((offsets + np.argmin(np.where(nan, np.inf, blocks), axis=1),
+                             offsets + np.argmax(np.where(nan, -np.inf, blocks), axis=1), [0, n - 1]))
+    return np.unique(np.minimum(chosen, n - 1))
+
+
+DOWNSAMPLERS = {"lttb": lttb, "minmax": minmax_downsample}
+
+
+def downsample(x, y, max_points, method="lttb"):
+    """
+    Reduce la serie (x, y) a lo sumo a 'max_points' puntos con el método indicado ('lttb' o 'minmax').
+
+    :return: Tupla (x, y) reducida (la original si no supera 'max_points').
+    """
+    if max_points is None or len(x) <= max_points:
+        return x, y
+    import numpy as np
+    x_arr = np.asarray(x)
+    x_num = x_arr.astype("datetime64[ns]").astype(np.int64) if np.issubdtype(x_arr.dtype, np.datetime64) else x_arr
+    indices = DOWNSAMPLERS[method](x_num, np.asarray(y), max_points)
+    return x_arr[indices], np.asarray(y)[indices]
+
+
+def chart_key(agg_data, **options):
+    """
+    Huella de los datos agrupados (diccionario columna -> lista, o DataFrame) y de las opciones del gráfico;
+    el mismo gráfico con los mismos datos tiene siempre la misma clave. Los valores se resumen con el hash
+    vectorizado de pandas en lugar de serializarlos uno a uno.
+    """
+    import pandas as pd
+    df = agg_data if isinstance(agg_data, pd.DataFrame) else pd.DataFrame(agg_data)
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes)), options],
+                             sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ChartCache:
+    """
+    Caché en disco de gráficos ya renderizados (bytes PNG o SVG), indexados por 'chart_key'.
+
+    Cada gráfico es un archivo en 'cache_dir'; al leerlo se actualiza su fecha de modificación y, al
+    superar 'max_bytes', se eliminan los menos usados recientemente (LRU por fecha de modificación).
+    """
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024):
+        """
+        :param cache_dir: Directorio de los archivos (se crea si no existe).
+        :param max_bytes: Tamaño máximo total de los gráficos guardados.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def get(self, key, fmt="png"):
+        """
+        Retorna los bytes del gráfico, o None si no está en la caché.
+        """
+        path = self._path(key, fmt)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return data
+
+    def set(self, key, data, fmt="png"):
+        """
+        Guarda el gráfico (escritura atómica) y aplica el límite de tamaño.
+        """
+        path = self._path(key, fmt)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.warning("No se pudo guardar el gráfico en la caché: %s", e)
+            return
+        with self._lock:
+            self._stats["stores"] += 1
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+                self._stats["evictions"] += 1
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+# Caché compartida por el proceso. CHART_CACHE_DIR fija el directorio (por defecto, 'charts' dentro del
+# directorio privado del usuario, ver history_store.private_dir) y CHART_CACHE_MAX_MB su tamaño máximo.
+# No se usa el directorio temporal compartido: otro usuario local podría colocar o reemplazar los gráficos
+# de nombre predecible.
+_chart_cache = None
+_chart_cache_lock = threading.Lock()
+
+
+def get_chart_cache():
+    """
+    Retorna la caché de gráficos compartida por el proceso.
+    """
+    global _chart_cache
+    with _chart_cache_lock:
+        if _chart_cache is None:
+            cache_dir = os.environ.get("CHART_CACHE_DIR")
+            if not cache_dir:
+                from history_store import private_dir
+                cache_dir = private_dir(os.path.join("nlsql", "charts"))
+            _chart_cache = ChartCache(
+                cache_dir,
+                max_bytes=int(os.environ.get("CHART_CACHE_MAX_MB", "64")) * 1024 * 1024,
+            )
+        return _chart_cache
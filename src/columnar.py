@@ -0,0 +1,216 @@
+# modules/columnar.py
+
+import datetime
+import decimal
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+# Códigos de tipo de mysql.connector (FieldType) agrupados por el tipo de arreglo que se usa para guardarlos.
+INT_TYPE_CODES = {1, 2, 3, 8, 9, 13, 16}            # TINY, SHORT, LONG, LONGLONG, INT24, YEAR, BIT
+FLOAT_TYPE_CODES = {4, 5}                           # FLOAT, DOUBLE
+DATETIME_TYPE_CODES = {7, 12}                       # TIMESTAMP, DATETIME
+DATE_TYPE_CODES = {10, 14}                          # DATE, NEWDATE
+# DECIMAL/NEWDECIMAL, cadenas, JSON, BLOB, TIME, etc. se guardan como objetos para no perder precisión.
+
+
+def _kind_from_type_code(type_code):
+    if type_code in INT_TYPE_CODES:
+        return "int"
+    if type_code in FLOAT_TYPE_CODES:
+        return "float"
+    if type_code in DATETIME_TYPE_CODES:
+        return "datetime"
+    if type_code in DATE_TYPE_CODES:
+        return "date"
+    return "object"
+
+
+def _kind_from_values(values):
+    """
+    Infiere el tipo de una columna a partir de su primer valor no nulo (para cursores sin códigos de tipo).
+    """
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, (bool, int)) and not isinstance(value, decimal.Decimal):
+            return "int"
+        if isinstance(value, float):
+            return "float"
+        if isinstance(value, datetime.datetime):
+            return "datetime"
+        if isinstance(value, datetime.date):
+            return "date"
+        return "object"
+    return "object"
+
+
+def _build_array(values, kind):
+    """
+    Construye el arreglo tipado de una columna y su máscara de nulos (None si no hay nulos).
+    """
+    n = len(values)
+    nulls = np.fromiter((v is None for v in values), dtype=bool, count=n) if n else np.zeros(0, dtype=bool)
+    mask = nulls if nulls.any() else None
+    try:
+        if kind == "int":
+            # Los nulos se guardan como 0 y se marcan en la máscara (en pandas se exponen como 'Int64').
+            return np.fromiter((0 if v is None else v for v in values), dtype=np.int64, count=n), mask
+        if kind == "float":
+            return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=n), mask
+        if kind == "datetime":
+            return np.array(values, dtype="datetime64[us]"), mask
+        if kind == "date":
+            return np.array(values, dtype="datetime64[D]"), mask
+    except (TypeError, ValueError, OverflowError):
+        # Valores que no encajan en el tipo declarado: se guardan como objetos.
+        pass
+    array = np.empty(n, dtype=object)
+    array[:] = values
+    return array, None
+
+
+class _RowView(Sequence):
+    """
+    Vista de filas (tuplas) de un ColumnarResult, compatible con la lista 'data' de QueryExecutor.
+
+    Las filas se reconstruyen al acceder a ellas (con valores de Python y None para los nulos); no se
+    guarda una copia permanente.
+    """
+
+    def __init__(self, result):
+        self._result = result
+
+    def __len__(self):
+        return self._result.num_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(*self._result.to_pylists(index)))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("índice de fila fuera de rango")
+        return tuple(column[0] for column in self._result.to_pylists(slice(index, index + 1)))
+
+    def __iter__(self):
+        return zip(*self._result.to_pylists())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+
+class ColumnarResult(Mapping):
+    """
+    Resultado de una consulta en formato columnar: un arreglo NumPy tipado por columna (int64, float64,
+    datetime64 u object según el tipo informado por el cursor) y una máscara de nulos por columna.
+
+    Ocupa bastante menos memoria que la lista de tuplas y se convierte a pandas sin copiar los arreglos
+    (ver 'to_pandas'). Se comporta como el diccionario {"columns": [...], "data": [...]} que retorna
+    QueryExecutor.ejecutar_sql ('data' es una vista de filas), por lo que el código existente lo acepta.
+
+    Los arreglos son de solo lectura: el mismo objeto puede compartirse entre la caché de resultados,
+    el historial de la interfaz y el análisis.
+    """
+
+    def __init__(self, columns, arrays, masks=None):
+        """
+        :param columns: Nombres de las columnas.
+        :param arrays: Lista de arreglos NumPy, uno por columna y con la misma longitud.
+        :param masks: (Opcional) Lista de máscaras booleanas de nulos (None si la columna no tiene nulos).
+        """
+        self.columns = list(columns)
+        self.arrays = list(arrays)
+        self.masks = list(masks) if masks is not None else [None] * len(self.arrays)
+        for array in self.arrays + [m for m in self.masks if m is not None]:
+            array.flags.writeable = False
+        self.num_rows = len(self.arrays[0]) if self.arrays else 0
+
+    @classmethod
+    def from_rows(cls, description, rows):
+        """
+        Construye el resultado a partir de 'cursor.description' y las filas obtenidas con 'fetchall'.
+        """
+        columns = [desc[0] for desc in description] if description else []
+        column_values = list(zip(*rows)) if rows else [()] * len(columns)
+        arrays = []
+        masks = []
+        for i, values in enumerate(column_values):
+            type_code = description[i][1] if len(description[i]) > 1 else None
+            kind = _kind_from_type_code(type_code) if type_code is not None else _kind_from_values(values)
+            array, mask = _build_array(list(values), kind)
+            arrays.append(array)
+            masks.append(mask)
+        return cls(columns, arrays, masks)
+
+    # Interfaz de diccionario {"columns": [...], "data": [...]}.
+    def __getitem__(self, key):
+        if key == "columns":
+            return self.columns
+        if key == "data":
+            return _RowView(self)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("columns", "data"))
+
+    def __len__(self):
+        return 2
+
+    @property
+    def nbytes(self):
+        """
+        Memoria aproximada ocupada por los arreglos (incluye los objetos de las columnas 'object').
+        """
+        total = 0
+        for array, mask in zip(self.arrays, self.masks):
+            total += array.nbytes + (mask.nbytes if mask is not None else 0)
+            if array.dtype == object:
+                total += sum(value.__sizeof__() for value in array if value is not None)
+        return total
+
+    def column(self, name):
+        """
+        Retorna el arreglo (de solo lectura) de la columna 'name'.
+        """
+        return self.arrays[self.columns.index(name)]
+
+    def to_pylists(self, index=slice(None)):
+        """
+        Convierte las columnas (o un rango de filas) a listas de valores de Python, con None para los nulos.
+        """
+        lists = []
+        for array, mask in zip(self.arrays, self.masks):
+            values = array[index].tolist()
+            if mask is not None:
+                values = [None if null else value for null, value in zip(mask[index].tolist(), values)]
+            lists.append(values)
+        return lists
+
+    def to_pandas(self):
+        """
+        Retorna un DataFrame que comparte los arreglos del resultado (sin copiarlos).
+
+        Cada llamada crea un DataFrame nuevo: reemplazar columnas en él no afecta a este resultado.
+        """
+        import pandas as pd
+        data = {}
+        for i, (array, mask) in enumerate(zip(self.arrays, self.masks)):
+            if mask is not None and array.dtype == np.int64:
+                # Entero con nulos: arreglo nullable de pandas sobre los mismos datos y máscara.
+                array = pd.arrays.IntegerArray(array, mask)
+            data[i] = array
+        df = pd.DataFrame(data, copy=False)
+        df.columns = self.columns
+        return df
+
+
+def as_dataframe(resultados):
+    """
+    Retorna los resultados como DataFrame: sin copia si son un ColumnarResult y construyéndolo a partir de
+    la lista de tuplas en caso contrario.
+    """
+    if isinstance(resultados, ColumnarResult):
+        return resultados.to_pandas()
+    import pandas as pd
+    return pd.DataFrame(resultados["data"], columns=resultados["columns"])
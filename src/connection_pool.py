@@ -0,0 +1,350 @@
+# modules/connection_pool.py
+
+import logging
+import threading
+import time
+from collections import deque
+
+from deadline import remaining as deadline_remaining
+
+# Funciones que se llaman con la conexión física cuando pierde su sesión (reconexión durante el ping o
+# cierre por el pool), p. ej. para olvidar las sentencias preparadas en ella (ver query_executor).
+_session_listeners = []
+
+
+def on_session_reset(callback):
+    """
+    Registra 'callback(raw_conn)', que se llama cuando el pool reconecta o cierra una conexión física.
+    """
+    _session_listeners.append(callback)
+
+
+class PooledConnection:
+    """
+    Envoltorio ligero sobre una conexión real a la base de datos.
+
+    Delega todos los atributos a la conexión subyacente, pero 'close()' no cierra la
+    conexión: la devuelve al pool para que pueda ser reutilizada por otro agente.
+    """
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._raw_conn = raw_conn
+        self._returned = False
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    @property
+    def raw_connection(self):
+        return self._raw_conn
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def close(self):
+        """
+        Devuelve la conexión al pool en lugar de cerrarla.
+        """
+        if self._returned:
+            return
+        self._returned = True
+        self._pool._release(self)
+
+    def __getattr__(self, name):
+        return getattr(self._raw_conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones MySQL compartido por QueryExecutor y DBSchemaAgent.
+
+    Evita el handshake TCP + autenticación en cada sentencia reutilizando conexiones abiertas.
+    Características:
+      - Tamaño máximo configurable (las peticiones esperan si el pool está agotado).
+      - Verificación de salud al prestar una conexión (ping con reconexión opcional).
+      - Expulsión de conexiones inactivas durante más de 'max_idle' segundos.
+      - Métricas básicas de uso (ver 'get_metrics').
+
+    El método 'get_connection' es compatible con el callable que ya aceptan los agentes:
+        pool = ConnectionPool(db_config)
+        executor = QueryExecutor(pool.get_connection)
+    """
+
+    def __init__(self, db_config, pool_size=5, max_idle=300, borrow_timeout=10, ping_on_borrow=True,
+                 connect_func=None):
+        """
+        :param db_config: Diccionario con host, port, user, password y database.
+        :param pool_size: Número máximo de conexiones abiertas simultáneamente.
+        :param max_idle: Segundos que una conexión puede permanecer inactiva antes de ser cerrada.
+        :param borrow_timeout: Segundos máximos de espera cuando el pool está agotado.
+        :param ping_on_borrow: Si es True, verifica la conexión (ping) antes de prestarla.
+        :param connect_func: (Opcional) Función que crea una conexión nueva. Por defecto usa mysql.connector.
+        """
+        self.db_config = dict(db_config)
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.borrow_timeout = borrow_timeout
+        self.ping_on_borrow = ping_on_borrow
+        self.connect_func = connect_func or self._default_connect
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._metrics = {
+            "created": 0,
+            "borrowed": 0,
+            "released": 0,
+            "reused": 0,
+            "evicted_idle": 0,
+            "failed_health_checks": 0,
+            "wait_count": 0,
+            "wait_time": 0.0,
+        }
+
+    def _default_connect(self):
+        import mysql.connector
+        return mysql.connector.connect(
+            host=self.db_config.get("host", "localhost"),
+            user=self.db_config.get("user", ""),
+            password=self.db_config.get("password", ""),
+            database=self.db_config.get("database", ""),
+            port=self.db_config.get("port", 3306)
+        )
+
+    def _is_healthy(self, raw_conn):
+        """
+        Verifica que la conexión siga viva. Intenta reconectar una vez si el driver lo permite.
+        """
+        try:
+            if hasattr(raw_conn, "ping"):
+                session = getattr(raw_conn, "connection_id", None)
+                raw_conn.ping(reconnect=True, attempts=1, delay=0)
+                if getattr(raw_conn, "connection_id", None) != session:
+                    # Reconectó: la sesión es nueva y el servidor ya no conoce sus sentencias preparadas.
+                    self._session_reset(raw_conn)
+            elif hasattr(raw_conn, "is_connected"):
+                return raw_conn.is_connected()
+            return True
+        except Exception as e:
+            self.logger.warning("Conexión del pool no saludable, se descartará: %s", e)
+            return False
+
+    def _session_reset(self, raw_conn):
+        for callback in list(_session_listeners):
+            try:
+                callback(raw_conn)
+            except Exception as e:
+                self.logger.debug("Error al notificar el reinicio de la sesión: %s", e)
+
+    def _close_raw(self, raw_conn):
+        self._session_reset(raw_conn)
+        try:
+            raw_conn.close()
+        except Exception as e:
+            self.logger.debug("Error al cerrar la conexión: %s", e)
+
+    def _evict_idle_locked(self):
+        """
+        Retira las conexiones que llevan más de 'max_idle' segundos sin usarse.
+        Debe llamarse con el lock adquirido; el llamador las cierra después de liberarlo.
+
+        :return: Lista de conexiones físicas a cerrar.
+        """
+        if not self.max_idle:
+            return []
+        now = time.monotonic()
+        kept = deque()
+        evicted = []
+        while self._idle:
+            pooled = self._idle.popleft()
+            if now - pooled.last_used > self.max_idle:
+                evicted.append(pooled.raw_connection)
+                self._metrics["evicted_idle"] += 1
+            else:
+                kept.append(pooled)
+        self._idle = kept
+        return evicted
+
+    def _reserve(self, deadline):
+        """
+        Reserva un puesto del pool esperando (hasta 'deadline') si está agotado.
+
+        :return: La conexión inactiva reservada, o None si hay que crear una nueva.
+        """
+        evicted = []
+        try:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("El pool de conexiones está cerrado.")
+                evicted = self._evict_idle_locked()
+                waited = False
+                wait_start = time.monotonic()
+                while not self._idle and self._in_use >= self.pool_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("No hay conexiones disponibles en el pool (tamaño %d)." % self.pool_size)
+                    if not waited:
+                        waited = True
+                        self._metrics["wait_count"] += 1
+                    self._cond.wait(remaining)
+                if waited:
+                    self._metrics["wait_time"] += time.monotonic() - wait_start
+                self._in_use += 1
+                return self._idle.pop() if self._idle else None
+        finally:
+            for raw_conn in evicted:
+                self._close_raw(raw_conn)
+
+    def _unreserve(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def get_connection(self):
+        """
+        Presta una conexión del pool (o crea una nueva si hay capacidad disponible).
+        La conexión se devuelve al pool al llamar a 'close()'. La espera con el pool agotado no supera el plazo
+        de la solicitud en curso (ver deadline.py).
+        """
+        left = deadline_remaining()
+        deadline = time.monotonic() + (self.borrow_timeout if left is None else min(self.borrow_timeout, left))
+        while True:
+            pooled = self._reserve(deadline)
+            if pooled is None:
+                break
+            # El ping (y la posible reconexión) se hace fuera del lock: un servidor lento o caído no bloquea a
+            # los demás hilos que piden o devuelven conexiones.
+            if self.ping_on_borrow and not self._is_healthy(pooled.raw_connection):
+                self._close_raw(pooled.raw_connection)
+                with self._cond:
+                    self._metrics["failed_health_checks"] += 1
+                self._unreserve()
+                continue
+            with self._cond:
+                self._metrics["borrowed"] += 1
+                self._metrics["reused"] += 1
+            return self._wrap(pooled.raw_connection, pooled.created_at)
+
+        # Crear la conexión fuera del lock para no bloquear al resto de hilos durante el handshake.
+        try:
+            raw_conn = self.connect_func()
+        except Exception:
+            self._unreserve()
+            raise
+        with self._cond:
+            self._metrics["created"] += 1
+            self._metrics["borrowed"] += 1
+        return self._wrap(raw_conn)
+
+    def open_side_connection(self):
+        """
+        Abre una conexión nueva fuera del límite del pool (p. ej. para cancelar con KILL QUERY una sentencia de
+        una conexión del pool cuando el pool está agotado). El llamador debe cerrarla.
+        """
+        return self.connect_func()
+
+    def _wrap(self, raw_conn, created_at=None):
+        pooled = PooledConnection(self, raw_conn)
+        if created_at is not None:
+            pooled.created_at = created_at
+        return pooled
+
+    def _release(self, pooled):
+        raw_conn = pooled.raw_connection
+        # Descartar resultados pendientes y transacciones abiertas antes de reutilizar la conexión.
+        try:
+            if getattr(raw_conn, "unread_result", False) and hasattr(raw_conn, "consume_results"):
+                raw_conn.consume_results()
+            if getattr(raw_conn, "in_transaction", False):
+                raw_conn.rollback()
+        except Exception as e:
+            self.logger.warning("No se pudo limpiar la conexión al devolverla al pool: %s", e)
+            self._close_raw(raw_conn)
+            raw_conn = None
+
+        with self._cond:
+            self._in_use -= 1
+            self._metrics["released"] += 1
+            if raw_conn is not None:
+                if self._closed:
+                    self._close_raw(raw_conn)
+                else:
+                    pooled.last_used = time.monotonic()
+                    self._idle.append(pooled)
+            self._cond.notify()
+
+    def get_metrics(self):
+        """
+        Retorna un diccionario con las métricas actuales del pool.
+        """
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics["pool_size"] = self.pool_size
+            metrics["in_use"] = self._in_use
+            metrics["idle"] = len(self._idle)
+        return metrics
+
+    def close_all(self):
+        """
+        Cierra todas las conexiones inactivas y marca el pool como cerrado.
+        Las conexiones en uso se cerrarán al ser devueltas.
+        """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._close_raw(self._idle.pop().raw_connection)
+            self._cond.notify_all()
+
+
+# Registro de pools a nivel de proceso, uno por configuración de base de datos.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_key(db_config):
+    """
+    Clave que identifica una configuración de base de datos (host, puerto, usuario y esquema).
+    """
+    return (
+        db_config.get("host", "localhost"),
+        int(db_config.get("port", 3306) or 3306),
+        db_config.get("user", ""),
+        db_config.get("database", ""),
+    )
+
+
+def get_pool(db_config, **pool_kwargs):
+    """
+    Retorna el pool compartido para 'db_config', creándolo si aún no existe.
+    Los parámetros adicionales solo se aplican al crear el pool.
+    """
+    key = pool_key(db_config)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.db_config.get("password", "") != db_config.get("password", ""):
+            # Las credenciales cambiaron: descartar el pool anterior.
+            pool.close_all()
+            pool = None
+        if pool is None:
+            pool = ConnectionPool(db_config, **pool_kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    """
+    Cierra todos los pools registrados en el proceso.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
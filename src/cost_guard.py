@@ -0,0 +1,343 @@
+# modules/cost_guard.py
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from result_cache import normalizar_sql
+from tracing import record
+
+# Tablas (y su alias) de FROM / JOIN, para asociar las filas del plan de SQLite a las tablas consultadas.
+TABLE_ALIAS_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN)\s+`?([A-Za-z0-9_$]+)`?(?:\s+(?:AS\s+)?`?(?!(?:WHERE|JOIN|ON|LEFT|RIGHT|INNER|CROSS|"
+    r"GROUP|ORDER|LIMIT|USING|STRAIGHT_JOIN)\b)([A-Za-z0-9_$]+)`?)?",
+    re.IGNORECASE
+)
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+# Sentencias que no pueden cortar el recorrido al alcanzar el LIMIT (agregan, ordenan o eliminan duplicados).
+NO_SHORT_CIRCUIT_PATTERN = re.compile(
+    r"\b(?:COUNT|SUM|AVG|MIN|MAX|GROUP_CONCAT)\s*\(|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bDISTINCT\b|\bUNION\b",
+    re.IGNORECASE
+)
+AGGREGATE_PATTERN = re.compile(r"\b(?:COUNT|SUM|AVG|MIN|MAX|GROUP_CONCAT)\s*\(|\bGROUP\s+BY\b", re.IGNORECASE)
+SELECT_PATTERN = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+# Sentencias de una sola tabla sin alias (las que produce SQLGenerationAgent), a las que se puede agregar
+# una ventana de tiempo: SELECT ... FROM tabla [WHERE condición] [LIMIT n].
+SIMPLE_SELECT_PATTERN = re.compile(
+    r"^(?P<head>\s*SELECT\s+.+?\s+FROM\s+`?(?P<table>[A-Za-z0-9_$]+)`?)(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?P<tail>\s+LIMIT\s+\d+)?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL
+)
+NOT_SIMPLE_PATTERN = re.compile(r"\bJOIN\b|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bUNION\b|\(\s*SELECT\b",
+                                re.IGNORECASE)
+
+
+class CostGuard:
+    """
+    Control de costo previo a la ejecución: obtiene el plan de la sentencia con EXPLAIN (cacheado por forma de
+    consulta, es decir, por la plantilla sin parámetros), estima las filas examinadas y decide:
+
+      - "permitir": la sentencia se ejecuta tal cual.
+      - "ajustar": se ejecuta con un LIMIT más estricto (sentencias que retornan filas) y/o con el hint
+        MAX_EXECUTION_TIME, que hace que el servidor la aborte si supera el tiempo máximo.
+      - "rechazar": la estimación supera 'reject_rows' incluso después de ajustar el LIMIT y, si la tabla tiene
+        la columna de tiempo 'time_column' (epoch en milisegundos), de acotarla a las últimas 'time_window_ms'
+        (ventana que se informa en los ajustes, porque cambia la respuesta); no se ejecuta.
+
+    La estimación sigue la regla clásica de MySQL (producto de la columna 'rows' de las tablas de cada SELECT);
+    si la sentencia puede cortar el recorrido al alcanzar su LIMIT (sin agregados, ORDER BY ni DISTINCT), se
+    acota a LIMIT / 'filtered'. Con el plan de SQLite (sin estimaciones) un SCAN cuenta las filas de la tabla
+    según information_schema y un SEARCH por índice cuenta una fila. Si el plan no se puede obtener, la
+    sentencia se permite.
+    """
+
+    def __init__(self, get_connection, hint_rows=100000, limit_rows=1000000, reject_rows=50000000,
+                 max_execution_ms=10000, limit=20, plan_ttl=300, max_plans=256, time_column="epoch",
+                 time_window_ms=7 * 24 * 3600 * 1000):
+        """
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param hint_rows: Filas estimadas a partir de las cuales se agrega el hint MAX_EXECUTION_TIME.
+        :param limit_rows: Filas estimadas a partir de las cuales las sentencias que retornan filas se acotan a 'limit'.
+        :param reject_rows: Filas estimadas (tras el ajuste del LIMIT) a partir de las cuales se rechaza la sentencia.
+        :param max_execution_ms: Tiempo máximo de ejecución del hint, en milisegundos.
+        :param limit: LIMIT que se impone a las sentencias costosas que retornan filas.
+        :param plan_ttl: Segundos de validez de un plan cacheado (las estadísticas de las tablas cambian).
+        :param max_plans: Número máximo de planes cacheados (LRU).
+        :param time_column: Columna de tiempo (epoch en milisegundos) usada para acotar las sentencias que se
+                            rechazarían; None para no acotarlas.
+        :param time_window_ms: Ventana de tiempo reciente a la que se acotan, en milisegundos.
+        """
+        self.get_connection = get_connection
+        self.hint_rows = hint_rows
+        self.limit_rows = limit_rows
+        self.reject_rows = reject_rows
+        self.max_execution_ms = max_execution_ms
+        self.limit = limit
+        self.plan_ttl = plan_ttl
+        self.max_plans = max_plans
+        self.time_column = time_column
+        self.time_window_ms = time_window_ms
+        self._plans = OrderedDict()  # plantilla normalizada -> (resumen del plan, expira_en)
+        self._table_rows = None  # (filas por tabla, expira_en)
+        self._time_tables = None  # (tablas con 'time_column', expira_en)
+        self._lock = threading.Lock()
+        self._stats = {"plan_hits": 0, "plan_misses": 0, "permitir": 0, "ajustar": 0, "rechazar": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def evaluar(self, sql, params=None):
+        """
+        Evalúa una sentencia antes de ejecutarla.
+
+        :param sql: Sentencia (o plantilla con marcadores '%s').
+        :param params: (Opcional) Parámetros de la plantilla (solo se usan para obtener el plan la primera vez).
+        :return: Diccionario con "decision" ("permitir", "ajustar" o "rechazar"), "filas_estimadas" (None si no
+                 hay plan), "recorridos_completos", "ajustes" (lista de textos), "motivo" y "sql" (la sentencia
+                 a ejecutar, con los ajustes aplicados).
+        """
+        decision = {"decision": "permitir", "filas_estimadas": None, "recorridos_completos": [], "ajustes": [],
+                    "motivo": "", "sql": sql}
+        if not sql or not SELECT_PATTERN.match(sql):
+            decision["motivo"] = "sentencia no evaluada"
+            return decision
+        plan = self._plan(sql, params)
+        if plan is None:
+            decision["motivo"] = "plan no disponible"
+            return self._registrar(decision)
+
+        decision["recorridos_completos"] = plan["recorridos_completos"]
+        returns_rows = not AGGREGATE_PATTERN.search(sql)
+        match = LIMIT_PATTERN.search(sql)
+        current_limit = int(match.group(1)) if match else None
+        estimated = self._estimar(sql, plan, current_limit)
+
+        if estimated > self.limit_rows and returns_rows and (current_limit is None or current_limit > self.limit):
+            # Acotar las filas retornadas (y, si la sentencia puede cortar el recorrido, las examinadas).
+            sql = LIMIT_PATTERN.sub(f"LIMIT {self.limit};", sql) if match else f"{sql.rstrip().rstrip(';')} LIMIT {self.limit};"
+            decision["ajustes"].append(f"LIMIT {self.limit}")
+            estimated = self._estimar(sql, plan, self.limit)
+        decision["filas_estimadas"] = estimated
+
+        if estimated > self.reject_rows:
+            # Antes de rechazar, intentar acotar la sentencia a la ventana de tiempo reciente.
+            shaped = self._acotar_ventana(sql)
+            shaped_plan = self._plan(shaped, params) if shaped else None
+            if shaped_plan is not None:
+                shaped_limit = LIMIT_PATTERN.search(shaped)
+                shaped_estimated = self._estimar(shaped, shaped_plan,
+                                                 int(shaped_limit.group(1)) if shaped_limit else None)
+                if shaped_estimated <= self.reject_rows:
+                    sql = shaped
+                    estimated = shaped_estimated
+                    decision["filas_estimadas"] = estimated
+                    decision["recorridos_completos"] = shaped_plan["recorridos_completos"]
+                    decision["ajustes"].append(
+                        f"solo las últimas {self.time_window_ms / 3600000:g} h ({self.time_column})")
+
+        if estimated > self.reject_rows:
+            decision.update(decision="rechazar", sql=None, motivo=(
+                f"la consulta examinaría unas {estimated} filas (máximo {self.reject_rows}); "
+                "agrega filtros más específicos"))
+            return self._registrar(decision)
+        if estimated > self.hint_rows and "MAX_EXECUTION_TIME" not in sql.upper():
+            sql = SELECT_PATTERN.sub(f"SELECT /*+ MAX_EXECUTION_TIME({self.max_execution_ms}) */", sql, count=1)
+            decision["ajustes"].append(f"MAX_EXECUTION_TIME({self.max_execution_ms})")
+        if decision["ajustes"]:
+            decision.update(decision="ajustar", sql=sql,
+                            motivo=f"unas {estimated} filas examinadas estimadas (umbral {self.hint_rows})")
+        return self._registrar(decision)
+
+    def _acotar_ventana(self, sql):
+        """
+        Agrega a una sentencia simple de una tabla con 'time_column' el predicado de la ventana reciente. El
+        límite se redondea a la hora para que la plantilla (y su plan cacheado) se reutilice durante esa hora.
+
+        :return: Sentencia acotada, o None si no se puede acotar.
+        """
+        if not self.time_column or not self.time_window_ms or NOT_SIMPLE_PATTERN.search(sql):
+            return None
+        match = SIMPLE_SELECT_PATTERN.match(sql)
+        if not match or match.group("table").lower() not in self._tablas_con_tiempo():
+            return None
+        since = (int(time.time() * 1000) - self.time_window_ms) // 3600000 * 3600000
+        where = f" WHERE `{self.time_column}` >= {since}"
+        if match.group("where"):
+            where += f" AND ({match.group('where')})"
+        return f"{match.group('head')}{where}{match.group('tail') or ''};"
+
+    def _tablas_con_tiempo(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._time_tables is not None and self._time_tables[1] > now:
+                return self._time_tables[0]
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT table_name FROM information_schema.columns "
+                "WHERE table_schema = DATABASE() AND column_name = %s;",
+                (self.time_column,)
+            )
+            tables = {row[0].lower() for row in cursor.fetchall()}
+        except Exception as e:
+            self.logger.warning("No se pudieron leer las tablas con la columna %s: %s", self.time_column, e)
+            tables = set()
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        with self._lock:
+            self._time_tables = (tables, now + self.plan_ttl)
+        return tables
+
+    def _registrar(self, decision):
+        with self._lock:
+            self._stats[decision["decision"]] += 1
+        record("cost_guard", decision["decision"])
+        if decision["filas_estimadas"] is not None:
+            record("estimated_rows", decision["filas_estimadas"])
+        if decision["decision"] != "permitir":
+            self.logger.info("Control de costo: %s (%s)", decision["decision"], decision["motivo"])
+        return decision
+
+    def _estimar(self, sql, plan, limit):
+        estimated = plan["filas"]
+        if limit is not None and plan["una_tabla"] and not NO_SHORT_CIRCUIT_PATTERN.search(sql):
+            # Sin agregados ni ordenamiento el servidor se detiene al reunir 'limit' filas que cumplan el filtro.
+            estimated = min(estimated, int(limit * 100 / max(plan["filtrado"], 0.01)))
+        return estimated
+
+    def _plan(self, sql, params):
+        """
+        Resumen del plan de la sentencia ({"filas", "filtrado", "una_tabla", "recorridos_completos"}),
+        cacheado por plantilla, o None si no se pudo obtener.
+        """
+        key = normalizar_sql(sql)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._plans.get(key)
+            if entry is not None and entry[1] > now:
+                self._plans.move_to_end(key)
+                self._stats["plan_hits"] += 1
+                record("plan_cache_hit", True)
+                return entry[0]
+            self._stats["plan_misses"] += 1
+        record("plan_cache_hit", False)
+
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("EXPLAIN " + sql.rstrip().rstrip(";"), tuple(params) if params is not None else ())
+            data = cursor.fetchall()
+            columns = [desc[0].lower() for desc in cursor.description] if cursor.description else []
+            plan = self._resumir([dict(zip(columns, row)) for row in data], sql, cursor)
+        except Exception as e:
+            self.logger.warning("No se pudo obtener el plan de la consulta: %s", e)
+            return None
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+        with self._lock:
+            self._plans[key] = (plan, now + self.plan_ttl)
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _resumir(self, rows, sql, cursor):
+        if rows and "rows" in rows[0]:
+            # Formato de MySQL/MariaDB: una fila por tabla, agrupadas por el id del SELECT.
+            per_select = OrderedDict()
+            scans = []
+            for row in rows:
+                per_select[row.get("id")] = per_select.get(row.get("id"), 1) * max(int(row.get("rows") or 1), 1)
+                if str(row.get("type") or "").upper() == "ALL":
+                    scans.append(row.get("table"))
+            return {"filas": sum(per_select.values()), "filtrado": float(rows[0].get("filtered") or 100),
+                    "una_tabla": len(rows) == 1, "recorridos_completos": scans}
+
+        # Formato de 'EXPLAIN QUERY PLAN' de SQLite (columna 'detail'), usado por el sustituto de los benchmarks.
+        aliases = {}
+        for table, alias in TABLE_ALIAS_PATTERN.findall(sql):
+            aliases[table.lower()] = table.lower()
+            if alias:
+                aliases[alias.lower()] = table.lower()
+        table_rows = self._filas_por_tabla(cursor)
+        estimated = 1
+        scans = []
+        accessed = 0
+        for row in rows:
+            words = str(row.get("detail", "")).split()
+            if len(words) < 2 or words[0] not in ("SCAN", "SEARCH"):
+                continue
+            accessed += 1
+            table = aliases.get(words[1].lower(), words[1].lower())
+            if words[0] == "SCAN":
+                estimated *= max(table_rows.get(table, 1), 1)
+                if "INDEX" not in " ".join(words).upper():
+                    scans.append(table)
+        return {"filas": estimated, "filtrado": 100.0, "una_tabla": accessed <= 1, "recorridos_completos": scans}
+
+    def _filas_por_tabla(self, cursor):
+        now = time.monotonic()
+        with self._lock:
+            if self._table_rows is not None and self._table_rows[1] > now:
+                return self._table_rows[0]
+        cursor.execute("SELECT table_name, table_rows FROM information_schema.tables WHERE table_schema = DATABASE();")
+        rows = {name.lower(): int(count or 0) for name, count in cursor.fetchall()}
+        with self._lock:
+            self._table_rows = (rows, now + self.plan_ttl)
+        return rows
+
+    def invalidate(self):
+        with self._lock:
+            self._plans.clear()
+            self._table_rows = None
+            self._time_tables = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, plans=len(self._plans))
+
+
+# Controles compartidos por el proceso, uno por base de datos (clave: pool_key(db_config)). Se desactivan con
+# COST_GUARD_ENABLED=0; COST_GUARD_HINT_ROWS, COST_GUARD_LIMIT_ROWS, COST_GUARD_REJECT_ROWS,
+# COST_GUARD_MAX_EXECUTION_MS y COST_GUARD_LIMIT fijan los umbrales y COST_GUARD_TIME_WINDOW_H la ventana de
+# tiempo a la que se acotan las sentencias que se rechazarían (0 para no acotarlas).
+_cost_guards = {}
+_cost_guards_lock = threading.Lock()
+
+
+def cost_guard_enabled():
+    return os.environ.get("COST_GUARD_ENABLED", "1").lower() not in ("0", "false", "no")
+
+
+def get_cost_guard(db_key, get_connection):
+    """
+    Retorna el CostGuard de la base de datos identificada por 'db_key' (o None si está desactivado).
+    """
+    if not cost_guard_enabled():
+        return None
+    with _cost_guards_lock:
+        guard = _cost_guards.get(db_key)
+        if guard is None:
+            guard = CostGuard(
+                get_connection,
+                hint_rows=int(os.environ.get("COST_GUARD_HINT_ROWS", "100000")),
+                limit_rows=int(os.environ.get("COST_GUARD_LIMIT_ROWS", "1000000")),
+                reject_rows=int(os.environ.get("COST_GUARD_REJECT_ROWS", "50000000")),
+                max_execution_ms=int(os.environ.get("COST_GUARD_MAX_EXECUTION_MS", "10000")),
+                limit=int(os.environ.get("COST_GUARD_LIMIT", "20")),
+                time_window_ms=int(os.environ.get("COST_GUARD_TIME_WINDOW_H", "168")) * 3600 * 1000,
+            )
+            _cost_guards[db_key] = guard
+    return guard
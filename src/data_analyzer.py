@@ -1,19 +1,56 @@
 # modules/data_analyzer.py
 
-import pandas as pd
-import matplotlib.pyplot as plt
+import os
+import re
+
+from query_executor import QueryExecutor
+
+# pandas y matplotlib se importan dentro de los métodos que los usan: importar este módulo (y app.py) no
+# los carga, y solo pagan su importación las consultas que llegan al análisis o al gráfico.
+
+# Duración en milisegundos de las unidades de frecuencia admitidas para agregar en SQL (anchos fijos).
+FREQ_UNITS_MS = {
+    "ms": 1, "s": 1000, "min": 60 * 1000, "t": 60 * 1000, "h": 3600 * 1000,
+    "d": 24 * 3600 * 1000, "w": 7 * 24 * 3600 * 1000,
+}
+TIME_UNITS_MS = {"ms": 1, "s": 1000, "us": 0.001, "ns": 0.000001}
+# Puntos máximos por serie en los gráficos renderizados y número de puntos hasta el que se dibujan marcadores.
+CHART_MAX_POINTS = int(os.environ.get("CHART_MAX_POINTS", "1000"))
+MARKER_MAX_POINTS = 60
+
+
+def freq_to_ms(freq):
+    """
+    Convierte una frecuencia al estilo de pandas ('D', '15min', '2h', 'W') en milisegundos.
+    Las frecuencias de calendario ('M', 'Y') no tienen un ancho fijo y no se admiten.
+    """
+    match = re.fullmatch(r"\s*(\d*)\s*([A-Za-z]+)\s*", str(freq))
+    unit = match.group(2).lower() if match else None
+    if unit not in FREQ_UNITS_MS:
+        raise ValueError(f"Frecuencia no soportada para la agregación en SQL: {freq}")
+    return int(match.group(1) or 1) * FREQ_UNITS_MS[unit]
 
 class DataAnalysisAgent:
     """
     Agente encargado de convertir timestamps en formato unixtime a formato datetime
     y de realizar análisis estadístico sobre los datos para generar gráficos comparativos.
+
+    La agregación temporal puede hacerse en pandas ('aggregate_by_time', sobre filas ya obtenidas) o en el
+    servidor ('aggregate_in_sql'), que agrupa con GROUP BY FLOOR(epoch / intervalo) sobre la tabla completa
+    y solo transfiere la serie agrupada.
     """
 
-    def __init__(self, time_unit='s'):
+    def __init__(self, time_unit='s', rollups=None, cost_guard=None):
         """
         :param time_unit: Unidad de los timestamps epoch ('s' para segundos, 'ms' para milisegundos, etc.).
+        :param rollups: (Opcional) RollupManager; las series de conteos elegibles se leen de sus agregados.
+        :param cost_guard: (Opcional) CostGuard que evalúa cada agregación antes de ejecutarla.
         """
         self.time_unit = time_unit
+        self.rollups = rollups
+        self.cost_guard = cost_guard
+        self.last_rollup_hit = False
+        self.last_cost_decision = None
 
     def convert_epoch_to_datetime(self, df, time_column):
         """
@@ -23,6 +60,7 @@ class DataAnalysisAgent:
         :param time_column: Nombre de la columna con los timestamps.
         :return: DataFrame con la columna convertida a datetime.
         """
+        import pandas as pd
         df[time_column] = pd.to_datetime(df[time_column], unit=self.time_unit)
         return df
 
@@ -37,7 +75,9 @@ class DataAnalysisAgent:
         :param freq: Frecuencia de agrupación ('D' para diario, 'M' para mensual, etc.).
         :return: DataFrame con las estadísticas agrupadas.
         """
-        df = df.copy()
+        import pandas as pd
+        # Copia superficial: set_index no modifica los datos, por lo que los arreglos se comparten con 'df'.
+        df = df.copy(deep=False)
         # Asegurarse de que la columna de tiempo esté en formato datetime
         if not pd.api.types.is_datetime64_any_dtype(df[time_column]):
             df[time_column] = pd.to_datetime(df[time_column], unit=self.time_unit)
@@ -47,7 +87,126 @@ class DataAnalysisAgent:
         agg_df.reset_index(inplace=True)
         return agg_df
 
-    def plot_aggregated_data(self, agg_df, time_column, value_columns, title="Análisis Comparativo", ylabel="Valores"):
+    def build_time_aggregation_sql(self, table, time_column, value_column, freq='D', where_clause="",
+                                   params=None, percentiles=None):
+        """
+        Genera la consulta de agregación temporal que se ejecuta en el servidor.
+
+        :param table: Tabla a agregar.
+        :param time_column: Columna con el timestamp epoch (en la unidad 'time_unit' del agente).
+        :param value_column: Columna numérica a analizar.
+        :param freq: Frecuencia de agrupación de ancho fijo ('D', 'h', '15min', 'W', ...).
+        :param where_clause: (Opcional) Cláusula " WHERE ..." con marcadores '%s'
+                             (ver SQLGenerationAgent.construir_filtros).
+        :param params: (Opcional) Parámetros de 'where_clause'.
+        :param percentiles: (Opcional) Percentiles a calcular, por ejemplo (0.5, 0.95). Se calculan por rango
+                            más cercano con funciones de ventana (MySQL 8 / MariaDB 10.2 o superior).
+        :return: Tupla (plantilla_sql, parametros). Columnas: timestamp (inicio del intervalo, en la unidad
+                 de 'time_column'), mean, sum, count y p50, p95, ... si se piden percentiles.
+        """
+        bucket = freq_to_ms(freq) / TIME_UNITS_MS.get(self.time_unit, 1)
+        if bucket < 1 or bucket != int(bucket):
+            raise ValueError(f"La frecuencia {freq} no es un múltiplo entero de la unidad '{self.time_unit}'.")
+        # El intervalo es un entero validado: va como literal para que SELECT y GROUP BY usen la misma expresión.
+        bucket = int(bucket)
+        params = list(params or [])
+        t, v = f"`{time_column}`", f"`{value_column}`"
+
+        if not percentiles:
+            sql = (
+                f"SELECT FLOOR({t} / {bucket}) * {bucket} AS `timestamp`, AVG({v}) AS `mean`, SUM({v}) AS `sum`, "
+                f"COUNT({v}) AS `count` FROM `{table}`{where_clause} "
+                f"GROUP BY FLOOR({t} / {bucket}) ORDER BY FLOOR({t} / {bucket})"
+            )
+            return sql, params
+
+        percentile_columns = "".join(
+            f", MIN(CASE WHEN rn >= {float(p)} * cnt THEN v END) AS `p{int(round(float(p) * 100))}`"
+            for p in percentiles
+        )
+        not_null = f"{v} IS NOT NULL"
+        where_clause = f"{where_clause} AND {not_null}" if where_clause else f" WHERE {not_null}"
+        sql = (
+            f"SELECT bucket * {bucket} AS `timestamp`, AVG(v) AS `mean`, SUM(v) AS `sum`, COUNT(v) AS `count`"
+            f"{percentile_columns} FROM ("
+            f"SELECT FLOOR({t} / {bucket}) AS bucket, {v} AS v, "
+            f"ROW_NUMBER() OVER (PARTITION BY FLOOR({t} / {bucket}) ORDER BY {v}) AS rn, "
+            f"COUNT(*) OVER (PARTITION BY FLOOR({t} / {bucket})) AS cnt "
+            f"FROM `{table}`{where_clause}) AS serie GROUP BY bucket ORDER BY bucket"
+        )
+        return sql, params
+
+    def aggregate_in_sql(self, get_connection, table, time_column, value_column, freq='D', where_clause="",
+                         params=None, percentiles=None, result_cache=None, cache_namespace=None):
+        """
+        Agrega la serie temporal en el servidor y retorna solo los intervalos con datos.
+
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param result_cache: (Opcional) ResultCache compartida; 'cache_namespace' identifica la conexión.
+        :return: DataFrame con el mismo formato que 'aggregate_by_time' (columna de tiempo en datetime y
+                 columnas mean, sum, count y percentiles), o None si la consulta falla.
+        """
+        sql, params = self.build_time_aggregation_sql(table, time_column, value_column, freq, where_clause,
+                                                      params, percentiles)
+        executor = QueryExecutor(get_connection, result_cache=result_cache, cache_namespace=cache_namespace,
+                                 cost_guard=self.cost_guard)
+        resultados = executor.ejecutar_sql(sql, params=params)
+        self.last_cost_decision = executor.last_cost_decision
+        if resultados is None:
+            return None
+        import pandas as pd
+        agg_df = pd.DataFrame(resultados["data"], columns=resultados["columns"])
+        for col in agg_df.columns:
+            if col != "timestamp":
+                agg_df[col] = pd.to_numeric(agg_df[col])
+        agg_df["timestamp"] = pd.to_datetime(pd.to_numeric(agg_df["timestamp"]), unit=self.time_unit)
+        return agg_df.rename(columns={"timestamp": time_column})
+
+    def count_by_time(self, get_connection, table, time_column, freq='D', filters=None, where_clause="",
+                      params=None, result_cache=None, cache_namespace=None, rollup_only=False):
+        """
+        Serie de conteos de filas por intervalo de tiempo. Si hay agregados materializados que la cubren
+        (ver RollupManager.count_series_query) se leen de ellos; si no, se agrupa en el servidor con
+        GROUP BY FLOOR(epoch / intervalo).
+
+        :param filters: (Opcional) Filtros de la estructura de consulta (para decidir si los agregados aplican).
+        :param where_clause: (Opcional) Cláusula " WHERE ..." equivalente a 'filters', para la consulta directa.
+        :param params: (Opcional) Parámetros de 'where_clause'.
+        :param rollup_only: Si es True, solo se responde desde los agregados (sin recorrer la tabla).
+        :return: DataFrame con la columna de tiempo (datetime) y 'count', o None si la consulta falla (o si
+                 'rollup_only' y los agregados no la cubren).
+        """
+        bucket_ms = freq_to_ms(freq)
+        sql = None
+        self.last_rollup_hit = False
+        if self.rollups is not None and self.time_unit == "ms":
+            sql, params_rollup = self.rollups.count_series_query(table, time_column, bucket_ms, filters)
+            if sql is not None:
+                params = params_rollup
+                self.last_rollup_hit = True
+        if sql is None and rollup_only:
+            return None
+        if sql is None:
+            bucket = int(bucket_ms / TIME_UNITS_MS.get(self.time_unit, 1))
+            t = f"`{time_column}`"
+            sql = (
+                f"SELECT FLOOR({t} / {bucket}) * {bucket} AS `timestamp`, COUNT(*) AS `count` "
+                f"FROM `{table}`{where_clause} GROUP BY FLOOR({t} / {bucket}) ORDER BY FLOOR({t} / {bucket})"
+            )
+        executor = QueryExecutor(get_connection, result_cache=result_cache, cache_namespace=cache_namespace,
+                                 cost_guard=self.cost_guard)
+        resultados = executor.ejecutar_sql(sql, params=list(params or []))
+        self.last_cost_decision = executor.last_cost_decision
+        if resultados is None:
+            return None
+        import pandas as pd
+        agg_df = pd.DataFrame(resultados["data"], columns=resultados["columns"])
+        agg_df["count"] = pd.to_numeric(agg_df["count"])
+        agg_df["timestamp"] = pd.to_datetime(pd.to_numeric(agg_df["timestamp"]), unit=self.time_unit)
+        return agg_df.rename(columns={"timestamp": time_column})
+
+    def plot_aggregated_data(self, agg_df, time_column, value_columns, title="Análisis Comparativo", ylabel="Valores",
+                             max_points=None, downsample_method="lttb"):
         """
         Genera un gráfico comparativo a partir de los datos agrupados.
         
@@ -56,16 +215,55 @@ class DataAnalysisAgent:
         :param value_columns: Lista de nombres de columnas que se desean graficar.
         :param title: Título del gráfico.
         :param ylabel: Etiqueta para el eje Y.
+        :param max_points: (Opcional) Puntos máximos por serie; las más largas se reducen conservando su forma.
+        :param downsample_method: Método de reducción ('lttb' o 'minmax', ver chart_cache).
         :return: Objeto figura de matplotlib.
         """
+        import matplotlib.pyplot as plt
+        from chart_cache import downsample
         fig, ax = plt.subplots(figsize=(10, 6))
         for col in value_columns:
-            ax.plot(agg_df[time_column], agg_df[col], marker='o', label=col)
+            x, y = downsample(agg_df[time_column].to_numpy(), agg_df[col].to_numpy(), max_points, downsample_method)
+            # Los marcadores solo ayudan con pocos puntos; con series largas solo añaden coste de dibujo.
+            ax.plot(x, y, marker='o' if len(x) <= MARKER_MAX_POINTS else None, label=col)
         ax.set_title(title)
         ax.set_xlabel("Fecha")
         ax.set_ylabel(ylabel)
         ax.legend()
         ax.grid(True)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
+        fig.autofmt_xdate(rotation=45)
+        fig.tight_layout()
         return fig
+
+    def render_chart(self, agg_df, time_column, value_columns, title="Análisis Comparativo", ylabel="Valores",
+                     fmt="png", max_points=CHART_MAX_POINTS, downsample_method="lttb", cache=None):
+        """
+        Renderiza el gráfico de 'plot_aggregated_data' como bytes (PNG o SVG), reutilizando la caché de
+        gráficos si ya se dibujó con los mismos datos y opciones.
+
+        :param cache: (Opcional) ChartCache; la clave es la huella de los datos y las opciones (chart_key).
+        :return: Tupla (bytes del gráfico, clave).
+        """
+        from chart_cache import chart_key
+        columns = [time_column] + list(value_columns)
+        key = chart_key(agg_df[columns], title=title, ylabel=ylabel, fmt=fmt, max_points=max_points,
+                        method=downsample_method)
+        if cache is not None:
+            data = cache.get(key, fmt)
+            if data is not None:
+                return data, key
+
+        import io
+        import matplotlib.pyplot as plt
+        fig = self.plot_aggregated_data(agg_df, time_column, value_columns, title, ylabel, max_points,
+                                        downsample_method)
+        buffer = io.BytesIO()
+        try:
+            fig.savefig(buffer, format=fmt)
+        finally:
+            # La figura no se conserva: solo los bytes, que es lo que se envía al navegador.
+            plt.close(fig)
+        data = buffer.getvalue()
+        if cache is not None:
+            cache.set(key, data, fmt)
+        return data, key
@@ -1,6 +1,7 @@
 # modules/db_schema.py
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 class DBSchemaAgent:
     """
@@ -10,19 +11,27 @@ class DBSchemaAgent:
       - Columnas de cada tabla (nombre, tipo y si es clave primaria)
       - Relaciones entre tablas (llaves foráneas)
       - Datos de muestra (opcional)
+
+    En modo masivo ('bulk=True', por defecto) las columnas y las llaves foráneas de todas las tablas se
+    obtienen con una sola consulta cada una y se agrupan en el cliente, en lugar de 2-3 consultas por tabla.
     """
 
-    def __init__(self, get_connection, db_name, main_tables=None, include_sample_data=True):
+    def __init__(self, get_connection, db_name, main_tables=None, include_sample_data=True, bulk=True,
+                 sample_workers=4):
         """
         :param get_connection: Función que retorna una conexión a la base de datos.
         :param db_name: Nombre del esquema (base de datos) a utilizar.
         :param main_tables: Lista de nombres de tablas principales a procesar. Si se especifica, solo estas tablas se incluirán.
         :param include_sample_data: Si es True, extrae las 2 primeras filas de cada tabla.
+        :param bulk: Si es True, extrae columnas y relaciones de todas las tablas en consultas únicas.
+        :param sample_workers: Número de conexiones concurrentes usadas para los datos de muestra en modo masivo.
         """
         self.get_connection = get_connection
         self.db_name = db_name
         self.main_tables = main_tables  # Ejemplo: ["tabla1", "tabla2", ...]
         self.include_sample_data = include_sample_data
+        self.bulk = bulk
+        self.sample_workers = sample_workers
         self.cached_schema = None  # Cache para evitar múltiples lecturas
         self.logger = logging.getLogger(self.__class__.__name__)
 
@@ -68,6 +77,11 @@ class DBSchemaAgent:
             cursor.execute(query, params)
             tables = cursor.fetchall()
 
+            if self.bulk:
+                schema_dict = self._extract_bulk(cursor, [table_name for (table_name,) in tables])
+                self.cached_schema = schema_dict
+                return schema_dict
+
             for (table_name,) in tables:
                 # Consultar las columnas de la tabla, ordenadas por posición.
                 cursor.execute("""
@@ -127,6 +141,131 @@ class DBSchemaAgent:
             cursor.close()
             conn.close()
 
+    def _extract_bulk(self, cursor, table_names):
+        """
+        Extrae columnas y relaciones de todas las tablas con una consulta cada una y agrupa los resultados
+        por tabla. Produce la misma estructura que la extracción tabla por tabla.
+
+        :param cursor: Cursor abierto sobre la conexión de extracción.
+        :param table_names: Lista de tablas a incluir (en el orden en que se retornaron).
+        :return: Diccionario del esquema.
+        """
+        schema_dict = {
+            table_name: {"columns": {}, "relations": [], "sample_data": []}
+            for table_name in table_names
+        }
+        if not table_names:
+            return schema_dict
+
+        table_filter = ""
+        params = [self.db_name]
+        if self.main_tables:
+            table_filter = " AND table_name IN (%s)" % ','.join(['%s'] * len(table_names))
+            params += list(table_names)
+
+        cursor.execute(f"""
+            SELECT table_name, column_name, data_type, column_key
+            FROM information_schema.columns
+            WHERE table_schema = %s{table_filter}
+            ORDER BY table_name, ordinal_position;
+        """, params)
+        for table_name, column_name, data_type, column_key in cursor.fetchall():
+            if table_name in schema_dict:
+                schema_dict[table_name]["columns"][column_name] = {
+                    "type": data_type,
+                    "key": column_key
+                }
+
+        cursor.execute(f"""
+            SELECT table_name, column_name, referenced_table_name, referenced_column_name
+            FROM information_schema.key_column_usage
+            WHERE table_schema = %s{table_filter}
+              AND referenced_table_name IS NOT NULL;
+        """, params)
+        for table_name, column_name, ref_table, ref_column in cursor.fetchall():
+            if table_name in schema_dict:
+                schema_dict[table_name]["relations"].append({
+                    "column": column_name,
+                    "referenced_table": ref_table,
+                    "referenced_column": ref_column
+                })
+
+        if self.include_sample_data:
+            samples = self._fetch_samples_concurrently(table_names)
+            for table_name, sample_data in samples.items():
+                schema_dict[table_name]["sample_data"] = sample_data
+
+        return schema_dict
+
+    def _fetch_sample(self, table_name):
+        """
+        Obtiene las dos primeras filas de una tabla usando una conexión propia.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT * FROM `{table_name}` LIMIT 2;")
+            sample_rows = cursor.fetchall()
+            columns_names = [desc[0] for desc in cursor.description] if cursor.description else []
+            return [dict(zip(columns_names, row)) for row in sample_rows]
+        except Exception as e:
+            self.logger.error("Error al obtener datos de muestra para la tabla %s: %s", table_name, e)
+            return []
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _fetch_samples_concurrently(self, table_names):
+        """
+        Obtiene los datos de muestra de varias tablas en paralelo (una conexión por hilo, idealmente
+        prestada por el pool de conexiones).
+
+        :return: Diccionario {tabla: lista de filas de muestra}.
+        """
+        workers = max(1, min(self.sample_workers, len(table_names)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(self._fetch_sample, table_names)
+            return dict(zip(table_names, results))
+
+    def get_schema_fingerprint(self):
+        """
+        Calcula una huella barata del esquema para detectar si ha cambiado, sin recorrer tabla por tabla.
+        Combina el número de tablas, la fecha de creación más reciente (cambia con ALTER TABLE) y un
+        checksum de las columnas. Si se incluyen datos de muestra, también considera UPDATE_TIME.
+
+        :return: Cadena con la huella del esquema.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            table_filter = ""
+            params = [self.db_name]
+            if self.main_tables:
+                table_filter = " AND table_name IN (%s)" % ','.join(['%s'] * len(self.main_tables))
+                params += list(self.main_tables)
+
+            cursor.execute(f"""
+                SELECT COUNT(*), MAX(create_time), MAX(update_time)
+                FROM information_schema.tables
+                WHERE table_schema = %s{table_filter};
+            """, params)
+            table_count, max_create, max_update = cursor.fetchone()
+
+            cursor.execute(f"""
+                SELECT COUNT(*), SUM(CRC32(CONCAT_WS(':', table_name, column_name, data_type, column_key)))
+                FROM information_schema.columns
+                WHERE table_schema = %s{table_filter};
+            """, params)
+            column_count, column_checksum = cursor.fetchone()
+
+            parts = [table_count, max_create, column_count, column_checksum]
+            if self.include_sample_data:
+                parts.append(max_update)
+            return "|".join(str(part) for part in parts)
+        finally:
+            cursor.close()
+            conn.close()
+
     def get_schema_text(self):
         """
         Retorna el esquema en un formato legible por humanos.
@@ -0,0 +1,310 @@
+# modules/deadline.py
+
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import record, record_add
+
+logger = logging.getLogger(__name__)
+
+# Plazo de la solicitud en curso (se propaga, como el span activo, a los hilos lanzados con asyncio.to_thread o
+# con contextvars.copy_context).
+_current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    El plazo de la solicitud venció antes de (o durante) la etapa indicada.
+    """
+
+    def __init__(self, stage):
+        super().__init__(f"Plazo de la solicitud vencido en la etapa '{stage}'.")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Plazo de una solicitud: instante límite (reloj monotónico) compartido por todas sus etapas, más el registro
+    de las etapas que se omitieron, se cancelaron o se acortaron por falta de tiempo ('degradations').
+    """
+
+    def __init__(self, timeout):
+        """
+        :param timeout: Segundos disponibles para la solicitud (None para no limitarla).
+        """
+        self.timeout = timeout
+        self.started_at = time.monotonic()
+        self.expires_at = None if timeout is None else self.started_at + timeout
+        self.degradations = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """
+        Segundos restantes (0 si venció), o None si la solicitud no tiene plazo.
+        """
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def degrade(self, stage, reason):
+        with self._lock:
+            self.degradations.append({"etapa": stage, "motivo": reason})
+        record("degraded", reason)
+        logger.warning("Etapa '%s' degradada: %s", stage, reason)
+
+    def report(self):
+        with self._lock:
+            degradations = list(self.degradations)
+        return {
+            "timeout_s": self.timeout,
+            "elapsed_ms": round((time.monotonic() - self.started_at) * 1000, 3),
+            "expired": self.expired(),
+            "degradations": degradations,
+        }
+
+
+@contextmanager
+def deadline_scope(timeout):
+    """
+    Establece el plazo de la solicitud para el bloque (y para los hilos y tareas que copien su contexto).
+    Si ya hay un plazo activo más corto, se conserva ese.
+
+    :return: El Deadline activo dentro del bloque.
+    """
+    outer = _current_deadline.get()
+    deadline = Deadline(timeout)
+    if outer is not None and outer.expires_at is not None and (
+            deadline.expires_at is None or outer.expires_at < deadline.expires_at):
+        deadline = outer
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+def remaining():
+    """
+    Segundos restantes del plazo activo, o None si no hay plazo.
+    """
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def expired():
+    deadline = _current_deadline.get()
+    return deadline is not None and deadline.expired()
+
+
+def degrade(stage, reason):
+    """
+    Registra en el plazo activo que una etapa se omitió o se cortó (no hace nada si no hay plazo).
+    """
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.degrade(stage, reason)
+
+
+def call_timeout(timeout):
+    """
+    Tiempo máximo de una llamada: 'timeout' acotado a lo que queda del plazo activo (None si no hay límite).
+    """
+    left = remaining()
+    if timeout is None:
+        return left
+    return timeout if left is None else min(timeout, left)
+
+
+def _backoff(attempt, backoff, max_backoff):
+    # Espera exponencial con variación aleatoria para que los reintentos concurrentes no coincidan.
+    return min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def retry_call(func, stage, timeout=None, retries=0, backoff=0.5, max_backoff=8.0, retry_on=(Exception,)):
+    """
+    Llama a 'func(tiempo_maximo)' con reintentos acotados y espera exponencial, sin superar el plazo activo.
+
+    :param func: Función que recibe el tiempo máximo de la llamada en segundos (o None).
+    :param stage: Nombre de la etapa (para los errores y la traza).
+    :param timeout: Tiempo máximo de cada intento (se acota a lo que queda del plazo).
+    :param retries: Reintentos adicionales tras el primer intento.
+    :param retry_on: Excepciones que justifican un reintento; el resto se propaga de inmediato.
+    :raises DeadlineExceeded: Si el plazo vence antes de un intento o no deja tiempo para esperar el siguiente.
+    """
+    for attempt in range(retries + 1):
+        limit = call_timeout(timeout)
+        if limit is not None and limit <= 0:
+            raise DeadlineExceeded(stage)
+        try:
+            return func(limit)
+        except retry_on as e:
+            wait = _backoff(attempt, backoff, max_backoff)
+            left = remaining()
+            if attempt == retries or (left is not None and wait >= left):
+                raise
+            logger.warning("Reintento %d de '%s' en %.2f s: %s", attempt + 1, stage, wait, e)
+            record_add("retries", 1)
+            time.sleep(wait)
+
+
+async def retry_call_async(func, stage, timeout=None, retries=0, backoff=0.5, max_backoff=8.0, retry_on=(Exception,)):
+    """
+    Variante asíncrona de 'retry_call': 'func(tiempo_maximo)' retorna un awaitable, que además se cancela con
+    asyncio.wait_for si supera el tiempo máximo.
+    """
+    # asyncio solo lo usa el pipeline asíncrono: no se importa con app.py (ver startup_benchmark.py).
+    import asyncio
+    for attempt in range(retries + 1):
+        limit = call_timeout(timeout)
+        if limit is not None and limit <= 0:
+            raise DeadlineExceeded(stage)
+        try:
+            return await asyncio.wait_for(func(limit), limit)
+        except (asyncio.TimeoutError, *retry_on) as e:
+            wait = _backoff(attempt, backoff, max_backoff)
+            left = remaining()
+            if attempt == retries or (left is not None and wait >= left):
+                raise
+            logger.warning("Reintento %d de '%s' en %.2f s: %s", attempt + 1, stage, wait, e)
+            record_add("retries", 1)
+            await asyncio.sleep(wait)
+
+
+class _Watchdog:
+    """
+    Hilo único que ejecuta las cancelaciones programadas al vencer su plazo (montículo ordenado por instante),
+    para no crear un temporizador por sentencia.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._cancelled = set()
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, at, callback):
+        """
+        Programa 'callback()' para el instante monotónico 'at'.
+
+        :return: Identificador para 'cancel'.
+        """
+        with self._cond:
+            handle = next(self._counter)
+            heapq.heappush(self._heap, (at, handle, callback))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deadline-watchdog", daemon=True)
+                self._thread.start()
+            if self._heap[0][1] == handle:
+                self._cond.notify()
+            return handle
+
+    def cancel(self, handle):
+        with self._cond:
+            self._cancelled.add(handle)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    if self._heap and self._heap[0][1] in self._cancelled:
+                        self._cancelled.discard(heapq.heappop(self._heap)[1])
+                        continue
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, handle, callback = heapq.heappop(self._heap)
+                if handle in self._cancelled:
+                    self._cancelled.discard(handle)
+                    continue
+            # La cancelación abre una conexión: se ejecuta fuera del hilo para no retrasar las siguientes.
+            threading.Thread(target=callback, name="deadline-cancel", daemon=True).start()
+
+
+_watchdog = _Watchdog()
+
+
+class QueryWatch:
+    """
+    Vigila una sentencia en curso y, si el plazo vence antes de que termine, ejecuta 'KILL QUERY <id>' en una
+    conexión aparte. El lock garantiza que el KILL no alcance a una sentencia posterior de la misma conexión:
+    'finish' espera a que termine un KILL en curso antes de devolver la conexión.
+    """
+
+    def __init__(self, conn, connection_id, open_side_connection):
+        self.conn = conn
+        self.connection_id = connection_id
+        self.open_side_connection = open_side_connection
+        self.fired = False
+        self._done = False
+        self._lock = threading.Lock()
+        self._handle = None
+
+    def _kill(self):
+        with self._lock:
+            if self._done:
+                return
+            self.fired = True
+            side = None
+            try:
+                side = self.open_side_connection()
+                cursor = side.cursor()
+                try:
+                    cursor.execute(f"KILL QUERY {int(self.connection_id)}")
+                finally:
+                    cursor.close()
+                logger.warning("Sentencia de la conexión %s cancelada al vencer el plazo.", self.connection_id)
+            except Exception as e:
+                logger.error("No se pudo cancelar la sentencia de la conexión %s: %s", self.connection_id, e)
+            finally:
+                if side is not None:
+                    try:
+                        side.close()
+                    except Exception as e:
+                        logger.debug("Error al cerrar la conexión de cancelación: %s", e)
+
+    def finish(self):
+        if self._handle is not None:
+            _watchdog.cancel(self._handle)
+        with self._lock:
+            self._done = True
+
+
+@contextmanager
+def cancel_on_deadline(conn, open_side_connection):
+    """
+    Cancela en el servidor (KILL QUERY desde 'open_side_connection()') la sentencia que se ejecute en 'conn'
+    dentro del bloque si el plazo activo vence antes de que termine. Sin plazo, o si la conexión no expone su
+    'connection_id', no hace nada.
+
+    :return: QueryWatch ('fired' indica si se lanzó la cancelación), o None.
+    """
+    deadline = _current_deadline.get()
+    connection_id = getattr(conn, "connection_id", None)
+    if deadline is None or deadline.expires_at is None or connection_id is None:
+        yield None
+        return
+    watch = QueryWatch(conn, connection_id, open_side_connection)
+    watch._handle = _watchdog.schedule(deadline.expires_at, watch._kill)
+    try:
+        yield watch
+    finally:
+        watch.finish()
+
+
+# Plazo por defecto de cada solicitud (REQUEST_TIMEOUT_S; 0 o vacío para no limitarla).
+def request_timeout():
+    value = float(os.environ.get("REQUEST_TIMEOUT_S", "60") or 0)
+    return value if value > 0 else None
@@ -1,9 +1,60 @@
 # frontend.py
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
 from app import process_query  # Importamos la función del backend
+from chart_cache import chart_key, get_chart_cache
+from connection_pool import get_pool
 from data_analyzer import DataAnalysisAgent
+from history_store import ChatHistory, get_history_store, history_in_memory
+from warmup import start_warmup
+
+# pandas, NumPy y matplotlib no se importan aquí: cada ejecución del script solo los carga cuando hay
+# resultados o análisis que mostrar, y el precalentamiento los importa en segundo plano.
+# Precalentar las bases de datos de WARMUP_DATABASES (una sola vez por proceso).
+start_warmup()
+
+
+
+@st.cache_resource
+def recursos_compartidos():
+    """
+    Recursos compartidos por todas las sesiones y ejecuciones del script: el almacén del historial
+    archivado y el agente de análisis.
+    """
+    return {"history_store": get_history_store(), "analysis_agent": DataAnalysisAgent(time_unit='ms')}
+
+
+@st.cache_resource
+def pool_de_conexiones(host, port, user, password, database):
+    """
+    Pool de conexiones de la base de datos, compartido entre sesiones (el esquema y el mapa semántico
+    se comparten a través de la caché de esquemas del proceso).
+    """
+    return get_pool({"host": host, "port": port, "user": user, "password": password, "database": database})
+
+
+ANALISIS_COLUMNAS = ("mean", "sum", "count")
+
+
+@st.cache_resource(max_entries=64)
+def analisis_renderizado(data_key, _agg_data):
+    """
+    DataFrame y gráfico (bytes PNG) del análisis de un mensaje. 'data_key' es la huella de los datos
+    (chart_key), de modo que el gráfico solo se vuelve a dibujar cuando cambian los datos; entre procesos
+    se reutiliza a través de la caché de gráficos en disco.
+    """
+    import pandas as pd
+    agg_df = pd.DataFrame(_agg_data)
+    # Notar que el agente usa 'ms' ya que la DB almacena milisegundos
+    png, _ = recursos_compartidos()["analysis_agent"].render_chart(
+        agg_df,
+        time_column="timestamp",
+        value_columns=[c for c in ANALISIS_COLUMNAS if c in agg_df.columns],
+        title="Análisis Comparativo",
+        ylabel="Valores",
+        cache=get_chart_cache()
+    )
+    return agg_df, png
+
 
 # Configuración de la página
 st.set_page_config(
@@ -53,6 +104,10 @@ db_config = {
     "host": db_host,
     "port": int(db_port) if db_port and db_port.isdigit() else 3306
 }
+# Con las credenciales completas, preparar conexión, esquema y mapa semántico antes de la primera consulta.
+if all([db_name, db_user, db_password, db_host]):
+    pool_de_conexiones(**db_config)
+    start_warmup([db_config])
 
 # frontend.py
 
@@ -61,13 +116,16 @@ db_config = {
 st.title("🤖 MySQL-Chat Bot")
 st.markdown("### Tu asistente inteligente para consultas y análisis de base de datos")
 
-# Historial de mensajes (para el chat)
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Historial de mensajes (para el chat): solo los últimos mensajes conservan sus datos en memoria; los
+# anteriores se archivan en disco y se recuperan al pedir mostrarlos.
+if "history" not in st.session_state:
+    st.session_state.history = ChatHistory(recursos_compartidos()["history_store"],
+                                           max_in_memory=history_in_memory())
+history = st.session_state.history
 
 # Mostrar historial de mensajes
 st.markdown("## Historial de Conversación")
-for message in st.session_state.messages:
+for message in history:
     with st.container():
         if message["role"] == "user":
             st.markdown(f"<div class='chat-container'><div class='chat-header'>Usuario:</div>{message['content']}</div>", unsafe_allow_html=True)
@@ -82,24 +140,21 @@ for message in st.session_state.messages:
                     if "sql_query" in content:
                         st.markdown("**Consulta SQL generada:**")
                         st.code(content["sql_query"], language="sql")
-                    if "data" in content and content["data"]:
-                        df = pd.DataFrame(content["data"], columns=content.get("columns", []))
-                        st.dataframe(df)
+                    if content.get("archivado"):
+                        if not st.checkbox("Mostrar resultados", key=f"mostrar_{history.session_id}_{message['id']}"):
+                            content = {}
+                        else:
+                            content = history.payload(message)
+                    if content.get("resultados") and content["resultados"]["data"]:
+                        from columnar import as_dataframe
+                        # El resultado columnar se muestra sin reconstruir la tabla desde tuplas
+                        st.dataframe(as_dataframe(content["resultados"]))
                     if "analysis" in content:
                         st.markdown("### Análisis Estadístico")
-                        agg_data = content["analysis"]
-                        agg_df = pd.DataFrame(agg_data)
+                        agg_df, png = analisis_renderizado(content.get("analysis_key") or chart_key(content["analysis"]),
+                                                           content["analysis"])
                         st.dataframe(agg_df)
-                        # Generar gráfico comparativo usando DataAnalysisAgent
-                        analysis_agent = DataAnalysisAgent(time_unit='ms')  # Notar que el agente usa 'ms' ya que la DB almacena milisegundos
-                        fig = analysis_agent.plot_aggregated_data(
-                            agg_df, 
-                            time_column="timestamp", 
-                            value_columns=["mean", "sum", "count"],
-                            title="Análisis Comparativo",
-                            ylabel="Valores"
-                        )
-                        st.pyplot(fig)
+                        st.image(png)
                 else:
                     st.markdown(content)
                 st.markdown("</div>", unsafe_allow_html=True)
@@ -128,19 +183,21 @@ if st.button("Enviar Consulta"):
                 "port": int(st.session_state.get("db_port")) if st.session_state.get("db_port") and st.session_state.get("db_port").isdigit() else 3306
             }
             openai_api_key = st.session_state.get("openai_api_key")
-            result = process_query(user_input, db_config, openai_api_key)
+            result = process_query(user_input, db_config, openai_api_key, columnar=True)
         
         # Construir el contenido de la respuesta
         assistant_content = {
             "sql_query": result["sql"],
-            "data": result["resultados"]["data"] if result["resultados"] and "data" in result["resultados"] else [],
-            "columns": result["resultados"]["columns"] if result["resultados"] and "columns" in result["resultados"] else [],
+            # Se guarda el ColumnarResult tal cual: ocupa menos memoria en session_state que la lista de tuplas
+            "resultados": result["resultados"],
             "message": result["formatted_response"]
         }
         if result.get("analysis_result"):
             agg_data = result["analysis_result"]["agg_data"]
             assistant_content["analysis"] = agg_data
+            # La huella de los datos se queda en memoria aunque el análisis se archive (no está en PAYLOAD_KEYS).
+            assistant_content["analysis_key"] = chart_key(agg_data)
         
-        st.session_state.messages.append({"role": "assistant", "content": assistant_content})
+        history.append("assistant", assistant_content)
         if hasattr(st, "experimental_rerun"):
             st.experimental_rerun()
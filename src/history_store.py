@@ -0,0 +1,312 @@
+# modules/history_store.py
+
+import base64
+import datetime
+import decimal
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+# Claves del contenido de un mensaje que pueden ser grandes (resultado de la consulta y datos del análisis)
+# y se archivan en disco; el texto de la respuesta y la SQL se quedan siempre en memoria.
+PAYLOAD_KEYS = ("resultados", "analysis")
+# Marca de tipo de los valores que JSON no representa directamente (ver _codificar / _decodificar).
+TYPE_TAG = "__tipo__"
+
+
+def _codificar(value):
+    """
+    'default' de json.dumps: representa con una marca de tipo los valores de los resultados y del análisis
+    que JSON no admite. Solo se generan datos, nunca objetos con código (a diferencia de pickle).
+    """
+    if hasattr(value, "to_pylists") and hasattr(value, "columns"):
+        # ColumnarResult: columnas como listas de valores de Python.
+        return {TYPE_TAG: "columnar", "columns": list(value.columns), "data": value.to_pylists()}
+    if hasattr(value, "to_pydatetime"):
+        # Timestamp de pandas (NaT se guarda como nulo).
+        value = value.to_pydatetime()
+        if value != value:
+            return None
+    if isinstance(value, datetime.datetime):
+        return {TYPE_TAG: "datetime", "v": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {TYPE_TAG: "date", "v": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {TYPE_TAG: "time", "v": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {TYPE_TAG: "timedelta", "v": value.total_seconds()}
+    if isinstance(value, decimal.Decimal):
+        return {TYPE_TAG: "decimal", "v": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {TYPE_TAG: "bytes", "v": base64.b64encode(bytes(value)).decode("ascii")}
+    if hasattr(value, "item"):
+        # Escalares de NumPy (int64, float64, datetime64, ...).
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Tipo no serializable en el historial: {type(value).__name__}")
+
+
+def _decodificar(obj):
+    """
+    'object_hook' de json.loads: reconstruye los valores marcados por _codificar.
+    """
+    tag = obj.get(TYPE_TAG)
+    if tag is None:
+        if set(obj) == {"columns", "data"} and isinstance(obj["data"], list):
+            # Resultado {"columns": [...], "data": [...]} de QueryExecutor: las filas son tuplas.
+            obj["data"] = [tuple(row) for row in obj["data"]]
+        return obj
+    if tag == "columnar":
+        from columnar import ColumnarResult
+        rows = list(zip(*obj["data"])) if obj["data"] else []
+        return ColumnarResult.from_rows([(column,) for column in obj["columns"]], rows)
+    if tag == "datetime":
+        return datetime.datetime.fromisoformat(obj["v"])
+    if tag == "date":
+        return datetime.date.fromisoformat(obj["v"])
+    if tag == "time":
+        return datetime.time.fromisoformat(obj["v"])
+    if tag == "timedelta":
+        return datetime.timedelta(seconds=obj["v"])
+    if tag == "decimal":
+        return decimal.Decimal(obj["v"])
+    if tag == "bytes":
+        return base64.b64decode(obj["v"])
+    raise ValueError(f"Tipo desconocido en el historial archivado: {tag}")
+
+
+def private_dir(name):
+    """
+    Directorio privado del usuario para datos de la aplicación ('$XDG_CACHE_HOME/<name>' o '~/.cache/<name>'),
+    creado con permisos 0700. Falla si existe y pertenece a otro usuario.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, name)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"El directorio {path} pertenece a otro usuario.")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+class HistoryStore:
+    """
+    Almacén en SQLite de los datos archivados del historial de chat (resultados y análisis de los mensajes
+    antiguos), serializados en JSON (con marcas de tipo para fechas, decimales, bytes y resultados
+    columnares) y comprimidos con zlib. Un mismo archivo se comparte entre sesiones; cada entrada se
+    identifica por (session_id, message_id). Las entradas caducadas se eliminan al crear el almacén y
+    después, como mucho, cada 'purge_interval' segundos al archivar.
+    """
+
+    def __init__(self, db_path, max_age=7 * 24 * 3600, purge_interval=3600):
+        """
+        :param db_path: Ruta del archivo SQLite (se crea con permisos 0600).
+        :param max_age: Segundos tras los cuales 'purge' elimina las entradas (None para conservarlas).
+        :param purge_interval: Segundos mínimos entre depuraciones automáticas al archivar.
+        """
+        self.db_path = db_path
+        self.max_age = max_age
+        self.purge_interval = purge_interval
+        self.last_purge = 0.0
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_db(self):
+        if not os.path.exists(self.db_path):
+            # Crear el archivo solo legible por el usuario antes de que SQLite lo abra.
+            os.close(os.open(self.db_path, os.O_CREAT | os.O_WRONLY, 0o600))
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_payloads ("
+                " session_id TEXT NOT NULL,"
+                " message_id INTEGER NOT NULL,"
+                " payload BLOB NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (session_id, message_id))"
+            )
+
+    def save(self, session_id, message_id, payload):
+        """
+        Guarda los datos de un mensaje.
+
+        :return: Tamaño comprimido en bytes, o None si no se pudo escribir.
+        """
+        self._purge_if_due()
+        blob = zlib.compress(json.dumps(payload, default=_codificar).encode("utf-8"), 1)
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chat_payloads (session_id, message_id, payload, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (session_id, message_id, blob, time.time())
+                )
+        except sqlite3.Error as e:
+            self.logger.warning("Error al archivar el mensaje %s: %s", message_id, e)
+            return None
+        return len(blob)
+
+    def load(self, session_id, message_id):
+        """
+        Retorna los datos archivados de un mensaje, o None si no existen.
+        """
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT payload FROM chat_payloads WHERE session_id = ? AND message_id = ?",
+                    (session_id, message_id)
+                ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.warning("Error al leer el mensaje archivado %s: %s", message_id, e)
+            return None
+        if not row:
+            return None
+        try:
+            return json.loads(zlib.decompress(row[0]).decode("utf-8"), object_hook=_decodificar)
+        except (zlib.error, UnicodeDecodeError, ValueError) as e:
+            # Entradas de un formato anterior o dañadas: se tratan como inexistentes.
+            self.logger.warning("No se pudo leer el mensaje archivado %s: %s", message_id, e)
+            return None
+
+    def delete_session(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chat_payloads WHERE session_id = ?", (session_id,))
+
+    def purge(self):
+        """
+        Elimina las entradas con más de 'max_age' segundos.
+
+        :return: Número de entradas eliminadas.
+        """
+        if self.max_age is None:
+            return 0
+        self.last_purge = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM chat_payloads WHERE created_at < ?", (time.time() - self.max_age,))
+            return cursor.rowcount
+
+    def _purge_if_due(self):
+        if self.max_age is None or time.time() - self.last_purge < self.purge_interval:
+            return
+        try:
+            self.purge()
+        except sqlite3.Error as e:
+            self.logger.warning("No se pudo depurar el historial archivado: %s", e)
+
+
+class ChatHistory:
+    """
+    Historial de chat de una sesión con memoria acotada.
+
+    Los mensajes (rol, texto de la respuesta, SQL) se conservan siempre, pero solo los últimos
+    'max_in_memory' mensajes con datos guardan en memoria su resultado y su análisis (ver PAYLOAD_KEYS);
+    los de los mensajes anteriores se archivan en un HistoryStore y se marcan con 'archivado'. 'payload'
+    los recupera bajo demanda, con un LRU pequeño para no leerlos de disco en cada ejecución del script.
+    """
+
+    def __init__(self, store, session_id=None, max_in_memory=10, rehydrated_entries=4):
+        """
+        :param store: HistoryStore donde se archivan los datos de los mensajes antiguos.
+        :param session_id: Identificador de la sesión (por defecto, uno aleatorio).
+        :param max_in_memory: Mensajes recientes que conservan sus datos en memoria.
+        :param rehydrated_entries: Mensajes archivados recuperados que se mantienen en memoria.
+        """
+        self.store = store
+        self.session_id = session_id or uuid.uuid4().hex
+        self.max_in_memory = max_in_memory
+        self.rehydrated_entries = rehydrated_entries
+        self.messages = []
+        self._next_id = 0
+        self._rehydrated = OrderedDict()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def append(self, role, content):
+        """
+        Agrega un mensaje y archiva los datos de los mensajes que quedan fuera de la ventana en memoria.
+
+        :return: El mensaje agregado ({"id", "role", "content"}).
+        """
+        message = {"id": self._next_id, "role": role, "content": content}
+        self._next_id += 1
+        self.messages.append(message)
+        self._spill()
+        return message
+
+    def _spill(self):
+        with_payload = [m for m in self.messages if isinstance(m["content"], dict)
+                        and any(key in m["content"] for key in PAYLOAD_KEYS)]
+        for message in with_payload[:max(len(with_payload) - self.max_in_memory, 0)]:
+            content = message["content"]
+            payload = {key: content[key] for key in PAYLOAD_KEYS if key in content}
+            if self.store.save(self.session_id, message["id"], payload) is None:
+                # Si no se pudo escribir, los datos se quedan en memoria.
+                continue
+            for key in payload:
+                del content[key]
+            content["archivado"] = list(payload)
+
+    def payload(self, message):
+        """
+        Retorna el contenido completo de un mensaje, recuperando del almacén los datos archivados.
+        """
+        content = message["content"]
+        if not isinstance(content, dict) or not content.get("archivado"):
+            return content
+        payload = self._rehydrated.get(message["id"])
+        if payload is None:
+            payload = self.store.load(self.session_id, message["id"]) or {}
+            self._rehydrated[message["id"]] = payload
+            while len(self._rehydrated) > self.rehydrated_entries:
+                self._rehydrated.popitem(last=False)
+        else:
+            self._rehydrated.move_to_end(message["id"])
+        return dict(content, **payload)
+
+    def clear(self):
+        """
+        Vacía el historial y elimina sus datos archivados.
+        """
+        self.store.delete_session(self.session_id)
+        self.messages = []
+        self._rehydrated.clear()
+
+
+# Almacén compartido por el proceso. CHAT_HISTORY_DB fija la ruta del archivo SQLite (por defecto, en el
+# directorio privado del usuario, ver private_dir) y CHAT_HISTORY_IN_MEMORY los mensajes que conservan sus
+# datos en memoria.
+_history_store = None
+_history_store_lock = threading.Lock()
+
+
+def history_in_memory():
+    return int(os.environ.get("CHAT_HISTORY_IN_MEMORY", "10"))
+
+
+def get_history_store():
+    """
+    Retorna el almacén del historial compartido por el proceso (eliminando las entradas caducadas al crearlo).
+    """
+    global _history_store
+    with _history_store_lock:
+        if _history_store is None:
+            db_path = os.environ.get("CHAT_HISTORY_DB") or os.path.join(private_dir("nlsql"), "chat_history.sqlite")
+            _history_store = HistoryStore(db_path)
+            _history_store._purge_if_due()
+        return _history_store
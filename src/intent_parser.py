@@ -0,0 +1,262 @@
+# modules/intent_parser.py
+
+import logging
+import threading
+import time
+
+from llm_cache import normalizar_consulta
+from schema_pruning import SchemaPruner, tokenize, stem
+from semantic_index import SYNONYMS
+
+# Palabras clave que determinan la acción de la consulta.
+ACTION_KEYWORDS = {
+    "contar": ["cuantos", "cuantas", "cuanto", "cantidad", "numero de", "total de", "contar", "cuenta",
+               "how many", "count"],
+    "promedio": ["promedio", "media", "average", "mean"],
+    "listar": ["listar", "lista", "muestrame", "muestra", "mostrar", "cuales", "ver", "dame", "list", "show"],
+}
+
+# Sinónimos de valores categóricos frecuentes (español -> valores almacenados en inglés).
+VALUE_SYNONYMS = {
+    "rojo": "red", "roja": "red", "azul": "blue", "verde": "green", "amarillo": "yellow",
+    "amarilla": "yellow", "negro": "black", "negra": "black", "blanco": "white", "blanca": "white",
+    "gris": "gray", "plateado": "silver", "naranja": "orange", "cafe": "brown", "marron": "brown",
+    "carro": "car", "auto": "car", "moto": "motorcycle", "motocicleta": "motorcycle", "camion": "truck",
+    "bus": "bus", "bicicleta": "bicycle", "persona": "person",
+}
+
+NUMERIC_TYPES = {"int", "bigint", "smallint", "mediumint", "tinyint", "decimal", "float", "double"}
+CATEGORICAL_TYPES = {"varchar", "char", "enum"}
+
+
+class RuleBasedIntentParser:
+    """
+    Intérprete determinista de consultas simples ('contar', 'listar', 'promedio') que evita la llamada al LLM.
+
+    Produce la misma estructura que UserQueryAgent.interpretar_consulta ('accion', 'tabla', 'filtros' y,
+    para promedios, 'columna') junto con una confianza entre 0 y 1. Si la confianza es menor que
+    'threshold', el llamador debe recurrir al LLM.
+
+    Utiliza:
+      - Palabras clave para la acción.
+      - El mapa semántico (nombres humanizados) para la tabla.
+      - Un diccionario de valores conocidos de columnas categóricas para los filtros, por ejemplo:
+            {"detections": {"description": {"red": "red", "yellow": "yellow"}}}
+        (la llave interna es el valor normalizado y el valor es el literal almacenado en la base de datos).
+    """
+
+    def __init__(self, schema, semantic_map, value_dictionary=None, threshold=0.75, index=None):
+        """
+        :param schema: Esquema de la base de datos (DBSchemaAgent.get_schema_dict).
+        :param semantic_map: Mapa semántico (SemanticMappingAgent.generate_map).
+        :param value_dictionary: (Opcional) Valores conocidos de columnas categóricas por tabla.
+        :param threshold: Confianza mínima para aceptar la interpretación sin LLM.
+        :param index: (Opcional) SemanticIndex para resolver la tabla; si no se indica, se puntúan todas las tablas.
+        """
+        self.schema = schema
+        self.semantic_map = semantic_map
+        self.value_dictionary = value_dictionary or {}
+        self.threshold = threshold
+        self.index = index
+        self.ranker = SchemaPruner()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _detect_action(self, texto):
+        for accion, keywords in ACTION_KEYWORDS.items():
+            for keyword in keywords:
+                if f" {keyword} " in f" {texto} ":
+                    return accion
+        return None
+
+    def _resolve_table(self, consulta):
+        """
+        Retorna (tabla, confianza) a partir de la puntuación de relevancia de las tablas.
+        """
+        if self.index is not None:
+            ranked = [(t, score) for t, score in self.index.search_tables(consulta, limit=2) if t in self.schema]
+        else:
+            ranked = self.ranker.rank_tables(consulta, self.schema, self.semantic_map)
+        if not ranked or ranked[0][1] <= 0:
+            return None, 0.0
+        top_table, top_score = ranked[0]
+        second_score = ranked[1][1] if len(ranked) > 1 else 0.0
+        # Confianza según el margen respecto a la segunda tabla candidata.
+        return top_table, 0.5 + 0.5 * (top_score - second_score) / top_score
+
+    def _extract_filters(self, tokens, table):
+        """
+        Busca en la consulta valores conocidos de columnas categóricas de la tabla.
+        """
+        filtros = {}
+        matched_tokens = set()
+        for column, values in self.value_dictionary.get(table, {}).items():
+            for token in tokens:
+                candidates = [token, stem(token), VALUE_SYNONYMS.get(token), VALUE_SYNONYMS.get(stem(token))]
+                for candidate in candidates:
+                    if candidate and candidate in values and column not in filtros:
+                        filtros[column] = values[candidate]
+                        matched_tokens.add(token)
+        return filtros, matched_tokens
+
+    def _resolve_numeric_column(self, tokens, table):
+        token_stems = {stem(t) for t in tokens}
+        columns = self.schema.get(table, {}).get("columns", {})
+        human_columns = self.semantic_map.get(table, {}).get("columns", {})
+        for column, info in columns.items():
+            if str(info.get("type", "")).lower() not in NUMERIC_TYPES or info.get("key") == "PRI":
+                continue
+            column_stems = {stem(t) for t in tokenize(column) + tokenize(human_columns.get(column, ""))}
+            if column_stems and column_stems <= token_stems:
+                return column
+        return None
+
+    def _known_stems(self, table):
+        """
+        Raíces que se consideran explicadas por la tabla: su nombre técnico y humanizado, sus columnas, los
+        sinónimos de todas ellas (los mismos que usa SemanticIndex) y los valores conocidos de sus columnas
+        categóricas junto con sus sinónimos en español (VALUE_SYNONYMS).
+        """
+        names = [table, self.semantic_map.get(table, {}).get("human_name", "")]
+        names.extend(self.schema.get(table, {}).get("columns", {}))
+        known_stems = {stem(t) for name in names for t in tokenize(name)}
+        for known_stem in list(known_stems):
+            known_stems.update(SYNONYMS.get(known_stem, ()))
+
+        known_values = set()
+        for values in self.value_dictionary.get(table, {}).values():
+            known_values.update(values)
+        known_stems.update(stem(t) for value in known_values for t in tokenize(value))
+        known_stems.update(stem(word) for word, value in VALUE_SYNONYMS.items() if value in known_values)
+        return known_stems
+
+    def parse(self, consulta):
+        """
+        Interpreta la consulta.
+
+        :return: Tupla (estructura_consulta, confianza). La estructura está vacía si no se reconoce la acción
+                 o la tabla.
+        """
+        texto = normalizar_consulta(consulta)
+        accion = self._detect_action(texto)
+        if accion is None:
+            return {}, 0.0
+
+        tabla, table_confidence = self._resolve_table(consulta)
+        if tabla is None:
+            return {}, 0.0
+
+        tokens = tokenize(consulta)
+        filtros, matched_tokens = self._extract_filters(tokens, tabla)
+        estructura = {"accion": accion, "tabla": tabla, "filtros": filtros}
+
+        confidence = table_confidence
+        if accion == "promedio":
+            columna = self._resolve_numeric_column(tokens, tabla)
+            if columna is None:
+                return estructura, 0.0
+            estructura["columna"] = columna
+
+        # Penalizar tokens que no se explican por la acción, la tabla, sus columnas o los filtros:
+        # probablemente contienen condiciones que estas reglas no saben interpretar.
+        explained = set(matched_tokens)
+        known_stems = self._known_stems(tabla)
+        for keyword_list in ACTION_KEYWORDS.values():
+            for keyword in keyword_list:
+                explained.update(keyword.split())
+        unexplained = [t for t in tokens if t not in explained and stem(t) not in known_stems]
+        confidence *= 0.85 ** len(unexplained)
+
+        return estructura, round(confidence, 3)
+
+    def interpretar(self, consulta):
+        """
+        Retorna la estructura de consulta si la confianza supera el umbral; en caso contrario, None.
+        """
+        estructura, confidence = self.parse(consulta)
+        if estructura and confidence >= self.threshold:
+            self.logger.info("Consulta interpretada por reglas (confianza %.2f): %s", confidence, estructura)
+            return estructura
+        self.logger.debug("Confianza insuficiente (%.2f) para interpretar por reglas.", confidence)
+        return None
+
+
+def load_value_dictionary(get_connection, db_name, schema, max_distinct=50, sample_rows=100000):
+    """
+    Construye el diccionario de valores conocidos de las columnas categóricas (varchar/char/enum), con un
+    costo acotado en tablas de cualquier tamaño:
+      - Columnas que encabezan un índice (column_key MUL): SELECT DISTINCT ... LIMIT, resuelto recorriendo el
+        índice y que se detiene al superar 'max_distinct' valores.
+      - Resto de columnas: el mismo DISTINCT sobre las primeras 'sample_rows' filas, para no recorrer la tabla.
+
+    :param get_connection: Función que retorna una conexión a la base de datos.
+    :param db_name: Nombre del esquema.
+    :param schema: Esquema de la base de datos.
+    :param max_distinct: Columnas con más valores distintos se consideran no categóricas y se omiten.
+    :param sample_rows: Filas leídas como máximo para las columnas sin índice.
+    :return: Diccionario {tabla: {columna: {valor_normalizado: valor}}}.
+    """
+    logger = logging.getLogger("load_value_dictionary")
+    value_dictionary = {}
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        for table, details in schema.items():
+            for column, info in details.get("columns", {}).items():
+                if str(info.get("type", "")).lower() not in CATEGORICAL_TYPES or info.get("key") in ("PRI", "UNI"):
+                    continue
+                if info.get("key") == "MUL":
+                    sql = f"SELECT DISTINCT `{column}` FROM `{table}` WHERE `{column}` IS NOT NULL LIMIT %s;"
+                    params = (max_distinct + 1,)
+                else:
+                    sql = (f"SELECT DISTINCT `{column}` FROM (SELECT `{column}` FROM `{table}` "
+                           f"WHERE `{column}` IS NOT NULL LIMIT %s) AS muestra LIMIT %s;")
+                    params = (sample_rows, max_distinct + 1)
+                try:
+                    cursor.execute(sql, params)
+                    values = [row[0] for row in cursor.fetchall()]
+                except Exception as e:
+                    logger.warning("No se pudieron leer los valores de %s.%s: %s", table, column, e)
+                    continue
+                if 0 < len(values) <= max_distinct:
+                    value_dictionary.setdefault(table, {})[column] = {
+                        normalizar_consulta(str(v)): v for v in values if normalizar_consulta(str(v))
+                    }
+    finally:
+        cursor.close()
+        conn.close()
+    return value_dictionary
+
+
+# Diccionarios de valores cacheados por base de datos: {clave: (timestamp, diccionario)}, con un cerrojo de
+# carga por base de datos para que solo una hebra recorra las columnas.
+_value_dictionaries = {}
+_value_dictionaries_lock = threading.Lock()
+_value_dictionary_loads = {}
+
+
+def get_value_dictionary(db_key, get_connection, db_name, schema, ttl=3600):
+    """
+    Retorna el diccionario de valores de la base de datos identificada por 'db_key', recargándolo tras 'ttl' segundos.
+
+    La primera carga se hace una sola vez: las hebras concurrentes esperan a la que la construye (normalmente
+    el precalentamiento). Al expirar, una hebra lo recarga y las demás siguen usando el anterior.
+    """
+    with _value_dictionaries_lock:
+        cached = _value_dictionaries.get(db_key)
+        if cached is not None and time.time() - cached[0] < ttl:
+            return cached[1]
+        load_lock = _value_dictionary_loads.setdefault(db_key, threading.Lock())
+    if not load_lock.acquire(blocking=cached is None):
+        # Otra hebra ya lo está recargando; se responde con el diccionario anterior.
+        return cached[1]
+    try:
+        with _value_dictionaries_lock:
+            current = _value_dictionaries.get(db_key)
+        if current is not None and time.time() - current[0] < ttl:
+            return current[1]
+        value_dictionary = load_value_dictionary(get_connection, db_name, schema)
+        with _value_dictionaries_lock:
+            _value_dictionaries[db_key] = (time.time(), value_dictionary)
+        return value_dictionary
+    finally:
+        load_lock.release()
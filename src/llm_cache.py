@@ -0,0 +1,222 @@
+# modules/llm_cache.py
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalizar_consulta(consulta):
+    """
+    Normaliza una consulta en lenguaje natural para usarla como clave de caché:
+    minúsculas, sin acentos, sin signos de puntuación y con espacios colapsados.
+        "¿Cuántos carros  rojos hay?" -> "cuantos carros rojos hay"
+    """
+    texto = unicodedata.normalize("NFKD", consulta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+# Huellas ya calculadas, por identidad del esquema y del mapa semántico: la caché de esquemas entrega el mismo
+# objeto entre solicitudes mientras el esquema no cambie, así que la huella se calcula una vez por versión.
+# Cada entrada conserva los objetos para que sus id no se reutilicen mientras exista.
+_fingerprints = OrderedDict()
+_fingerprints_lock = threading.Lock()
+FINGERPRINTS_MAX = 32
+
+
+def _fingerprint_entry(schema, semantic_map):
+    entry = _fingerprints.get((id(schema), id(semantic_map)))
+    if entry is not None and entry[0] is schema and entry[1] is semantic_map:
+        return entry
+    return None
+
+
+def fingerprint_is_cached(schema, semantic_map=None):
+    """
+    Indica si la huella de este esquema y mapa semántico ya está calculada (schema_fingerprint no costará nada).
+    """
+    with _fingerprints_lock:
+        return _fingerprint_entry(schema, semantic_map) is not None
+
+
+def schema_fingerprint(schema, semantic_map=None):
+    """
+    Calcula una huella estable del esquema (y del mapa semántico) para invalidar las respuestas
+    cacheadas cuando el contexto enviado al LLM cambia. Se memoriza por identidad de los objetos, que se
+    tratan como inmutables (un esquema que cambia es un objeto nuevo).
+    """
+    key = (id(schema), id(semantic_map))
+    with _fingerprints_lock:
+        entry = _fingerprint_entry(schema, semantic_map)
+        if entry is not None:
+            _fingerprints.move_to_end(key)
+            return entry[2]
+    payload = json.dumps([schema, semantic_map], sort_keys=True, default=str)
+    fingerprint = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    with _fingerprints_lock:
+        _fingerprints[key] = (schema, semantic_map, fingerprint)
+        while len(_fingerprints) > FINGERPRINTS_MAX:
+            _fingerprints.popitem(last=False)
+    return fingerprint
+
+
+class LLMResponseCache:
+    """
+    Caché de respuestas del LLM para UserQueryAgent.interpretar_consulta.
+
+    Las entradas se indexan por la consulta normalizada, la huella del esquema y el modelo usado,
+    y almacenan la 'estructura_consulta' ya decodificada. Consta de dos niveles:
+      - Un LRU en memoria con tamaño máximo 'max_entries'.
+      - (Opcional) Un nivel persistente en SQLite ('db_path'), compartido entre reinicios.
+    Las entradas expiran tras 'ttl' segundos. Las estadísticas de aciertos y fallos se obtienen con 'stats'.
+    """
+
+    def __init__(self, max_entries=1024, ttl=24 * 3600, db_path=None):
+        """
+        :param max_entries: Número máximo de entradas en el LRU en memoria.
+        :param ttl: Segundos de validez de cada entrada (None para no expirar).
+        :param db_path: (Opcional) Ruta del archivo SQLite para el nivel persistente.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if db_path:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+
+    def make_key(self, consulta, fingerprint, model=""):
+        raw = f"{model}\x00{fingerprint}\x00{normalizar_consulta(consulta)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def get(self, key):
+        """
+        Retorna una copia de la estructura cacheada para 'key', o None si no existe o expiró.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return copy.deepcopy(value)
+                del self._memory[key]
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                self.logger.warning("Error al leer la caché persistente del LLM: %s", e)
+                row = None
+            if row is not None and not self._expired(row[1]):
+                value = json.loads(row[0])
+                with self._lock:
+                    self._store_memory(key, value, row[1])
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                return copy.deepcopy(value)
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def _store_memory(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def set(self, key, value):
+        """
+        Guarda la estructura 'value' bajo 'key' en ambos niveles.
+        """
+        created_at = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store_memory(key, value, created_at)
+            self._stats["stores"] += 1
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value, default=str), created_at)
+                    )
+            except sqlite3.Error as e:
+                self.logger.warning("Error al escribir la caché persistente del LLM: %s", e)
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def clear(self):
+        """
+        Vacía ambos niveles de la caché.
+        """
+        with self._lock:
+            self._memory.clear()
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        """
+        Retorna los contadores de aciertos, fallos y el tamaño actual del LRU.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._memory)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
+
+
+# Caché compartida por el proceso. El nivel persistente se activa con LLM_CACHE_DB.
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Retorna la caché de respuestas del LLM compartida por el proceso.
+    """
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache(
+                max_entries=int(os.environ.get("LLM_CACHE_SIZE", "1024")),
+                ttl=int(os.environ.get("LLM_CACHE_TTL", str(24 * 3600))),
+                db_path=os.environ.get("LLM_CACHE_DB") or None,
+            )
+        return _llm_cache
@@ -0,0 +1,280 @@
+# modules/plate_index.py
+
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+
+from plate_search import PLATE_ATTRIBUTE_ID
+
+# Alfabeto de las placas normalizadas, usado para generar las variantes a distancia de edición 1.
+PLATE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def normalizar_placa(text):
+    """
+    Normaliza una placa: mayúsculas y solo caracteres alfanuméricos ("abq-874" -> "ABQ874").
+    """
+    return re.sub(r"[^A-Z0-9]", "", str(text or "").upper())
+
+
+def edit_distance_1(plate):
+    """
+    Variantes a distancia de edición 1 de una placa (sustitución, eliminación e inserción de un carácter),
+    que cubren los errores típicos del OCR.
+    """
+    variants = set()
+    for i in range(len(plate) + 1):
+        if i < len(plate):
+            variants.add(plate[:i] + plate[i + 1:])
+            for ch in PLATE_ALPHABET:
+                if ch != plate[i]:
+                    variants.add(plate[:i] + ch + plate[i + 1:])
+        for ch in PLATE_ALPHABET:
+            variants.add(plate[:i] + ch + plate[i:])
+    variants.discard(plate)
+    return variants
+
+
+class PlateIndex:
+    """
+    Índice residente placa -> objetos, cargado desde 'detections' (attribute_id = 1) y actualizado de forma
+    incremental consultando solo las detecciones con id mayor que la última cargada (marca de agua).
+
+    Para ser compacto en memoria las detecciones se guardan en arreglos tipados paralelos (una posición por
+    detección) en lugar de diccionarios anidados:
+      - object_ids, epochs, camera_ids: datos de cada detección.
+      - next_rows: enlace a la detección anterior de la misma placa (-1 al final de la cadena).
+      - heads: última detección de cada placa, indexado por el número de placa.
+    Solo las placas distintas se guardan como cadenas (un diccionario placa -> número y una lista ordenada
+    para las búsquedas por prefijo).
+
+    Las búsquedas aproximadas generan en el momento las variantes a distancia de edición 1 de la placa
+    consultada, sin índices adicionales.
+
+    La carga inicial y las actualizaciones se hacen en una hebra de fondo ('start_polling'); las búsquedas solo
+    leen el estado actual. El índice acelera la búsqueda pero no decide que una placa no existe: 'loaded' es
+    False hasta la primera carga completa (mientras tanto se busca en SQL), y las placas detectadas después de
+    la última actualización no aparecen hasta la siguiente.
+    """
+
+    def __init__(self, get_connection, refresh_interval=30, batch_size=50000):
+        """
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param refresh_interval: Segundos mínimos entre consultas de nuevas detecciones.
+        :param batch_size: Detecciones leídas por consulta durante la carga.
+        """
+        self.get_connection = get_connection
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.high_water_mark = 0
+        self.last_refresh = 0.0
+        self.loaded = False
+        self.object_ids = array("q")
+        self.epochs = array("q")
+        self.camera_ids = array("i")
+        self.next_rows = array("i")
+        self.heads = array("i")
+        self._plate_numbers = {}
+        self._plates = []
+        self._sorted_plates = []
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._poller = None
+        self._stop = threading.Event()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def __len__(self):
+        return len(self.object_ids)
+
+    def _add(self, plate, object_id, epoch, camera_id, new_plates):
+        number = self._plate_numbers.get(plate)
+        if number is None:
+            number = len(self._plates)
+            self._plate_numbers[plate] = number
+            self._plates.append(plate)
+            self.heads.append(-1)
+            new_plates.append(plate)
+        self.object_ids.append(int(object_id))
+        self.epochs.append(int(epoch or 0))
+        self.camera_ids.append(int(camera_id or 0))
+        self.next_rows.append(self.heads[number])
+        self.heads[number] = len(self.object_ids) - 1
+
+    def refresh(self, force=False):
+        """
+        Carga las detecciones de placa nuevas (id mayor que la marca de agua).
+
+        :param force: Si es True, consulta aunque no haya pasado 'refresh_interval'.
+        :return: Número de detecciones nuevas incorporadas.
+        """
+        if not force and time.time() - self.last_refresh < self.refresh_interval:
+            return 0
+        if not self._refresh_lock.acquire(blocking=force):
+            # Otra hebra ya está actualizando; se responde con los datos actuales.
+            return 0
+        added = 0
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            try:
+                while True:
+                    cursor.execute(
+                        "SELECT d.id, d.description, d.object_id, o.epoch, v.camera_id "
+                        "FROM detections d "
+                        "JOIN object o ON o.id = d.object_id "
+                        "JOIN videos v ON v.id = o.video_id "
+                        f"WHERE d.attribute_id = {PLATE_ATTRIBUTE_ID} AND d.status = 1 AND d.id > %s "
+                        "ORDER BY d.id LIMIT %s",
+                        (self.high_water_mark, self.batch_size)
+                    )
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    with self._lock:
+                        new_plates = []
+                        for detection_id, plate, object_id, epoch, camera_id in rows:
+                            plate = normalizar_placa(plate)
+                            if plate:
+                                self._add(plate, object_id, epoch, camera_id, new_plates)
+                        if new_plates:
+                            # Un solo ordenamiento por lote (Timsort fusiona el tramo nuevo con el ya ordenado).
+                            self._sorted_plates.extend(new_plates)
+                            self._sorted_plates.sort()
+                        self.high_water_mark = rows[-1][0]
+                    added += len(rows)
+                    if len(rows) < self.batch_size:
+                        break
+            finally:
+                cursor.close()
+                conn.close()
+            self.last_refresh = time.time()
+            self.loaded = True
+            if added:
+                self.logger.info("Índice de placas actualizado: %d detecciones nuevas (total %d, marca de agua %s).",
+                                 added, len(self), self.high_water_mark)
+        except Exception as e:
+            self.logger.error("Error al actualizar el índice de placas: %s", e)
+        finally:
+            self._refresh_lock.release()
+        return added
+
+    def start_polling(self, interval=None):
+        """
+        Inicia una hebra en segundo plano que carga el índice (la primera vez, de inmediato) y lo actualiza
+        cada 'interval' segundos.
+        """
+        interval = interval or self.refresh_interval
+        if self._poller is not None:
+            return
+        self._stop.clear()
+
+        def poll():
+            self.refresh(force=True)
+            while not self._stop.wait(interval):
+                self.refresh(force=True)
+
+        self._poller = threading.Thread(target=poll, name="plate-index-poller", daemon=True)
+        self._poller.start()
+
+    def stop_polling(self):
+        self._stop.set()
+        self._poller = None
+
+    def _rows_for(self, number):
+        row = self.heads[number]
+        while row != -1:
+            yield row
+            row = self.next_rows[row]
+
+    def matching_plates(self, plate, prefix=False, fuzzy=False):
+        """
+        Placas indexadas que coinciden con la consultada.
+
+        :param plate: Placa (se normaliza).
+        :param prefix: Si es True, incluye las placas que empiezan por 'plate'.
+        :param fuzzy: Si es True, incluye las placas a distancia de edición 1.
+        :return: Lista de placas indexadas (la coincidencia exacta primero, si existe).
+        """
+        plate = normalizar_placa(plate)
+        if not plate:
+            return []
+        with self._lock:
+            matches = [plate] if plate in self._plate_numbers else []
+            if prefix:
+                start = bisect.bisect_left(self._sorted_plates, plate)
+                for candidate in self._sorted_plates[start:]:
+                    if not candidate.startswith(plate):
+                        break
+                    if candidate != plate:
+                        matches.append(candidate)
+            if fuzzy:
+                matches.extend(sorted(v for v in edit_distance_1(plate) if v in self._plate_numbers))
+        return matches
+
+    def lookup(self, plate, prefix=False, fuzzy=False, epoch_min=None, epoch_max=None):
+        """
+        Busca las detecciones de una placa sin consultar la base de datos: solo lee el estado actual, que
+        actualiza la hebra de 'start_polling' (o una llamada explícita a 'refresh').
+
+        :param plate: Placa a buscar.
+        :param prefix: Incluir las placas que empiezan por 'plate'.
+        :param fuzzy: Incluir las placas a distancia de edición 1 (errores de OCR).
+        :param epoch_min: (Opcional) Límite inferior de 'epoch' en milisegundos.
+        :param epoch_max: (Opcional) Límite superior de 'epoch' en milisegundos.
+        :return: Lista de tuplas (placa, object_id, epoch, camera_id), de la más reciente a la más antigua.
+        """
+        results = []
+        with self._lock:
+            for candidate in self.matching_plates(plate, prefix=prefix, fuzzy=fuzzy):
+                for row in self._rows_for(self._plate_numbers[candidate]):
+                    epoch = self.epochs[row]
+                    if epoch_min is not None and epoch < epoch_min:
+                        continue
+                    if epoch_max is not None and epoch > epoch_max:
+                        continue
+                    results.append((candidate, self.object_ids[row], epoch, self.camera_ids[row]))
+        return results
+
+    def stats(self):
+        """
+        Métricas del índice: detecciones, placas distintas, marca de agua y memoria aproximada de los arreglos.
+        """
+        with self._lock:
+            array_bytes = sum(a.itemsize * len(a) for a in (self.object_ids, self.epochs, self.camera_ids,
+                                                            self.next_rows, self.heads))
+            return {
+                "detections": len(self.object_ids),
+                "plates": len(self._plates),
+                "high_water_mark": self.high_water_mark,
+                "array_bytes": array_bytes,
+                "last_refresh": self.last_refresh,
+            }
+
+
+# Índices compartidos por el proceso, uno por base de datos (clave: pool_key(db_config)).
+# Se activan con PLATE_INDEX_ENABLED=1; PLATE_INDEX_REFRESH fija los segundos entre actualizaciones.
+_plate_indexes = {}
+_plate_indexes_lock = threading.Lock()
+
+
+def plate_index_enabled():
+    return os.environ.get("PLATE_INDEX_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+def get_plate_index(db_key, get_connection):
+    """
+    Retorna el índice de placas de la base de datos identificada por 'db_key'. En el primer uso inicia su
+    carga y actualización en segundo plano; hasta que termine la carga inicial ('loaded') las placas se
+    buscan en SQL.
+    """
+    with _plate_indexes_lock:
+        index = _plate_indexes.get(db_key)
+        if index is None:
+            index = PlateIndex(get_connection, refresh_interval=int(os.environ.get("PLATE_INDEX_REFRESH", "30")))
+            _plate_indexes[db_key] = index
+            index.start_polling()
+    return index
@@ -0,0 +1,339 @@
+# modules/plate_search.py
+
+import datetime
+import logging
+import re
+import unicodedata
+
+from intent_parser import VALUE_SYNONYMS
+from query_executor import QueryExecutor
+from sql_generator import SQLGenerationAgent
+
+# Identificadores de atributo en 'detections'.
+PLATE_ATTRIBUTE_ID = 1
+COLOR_ATTRIBUTE_ID = 2
+
+# Desplazamiento horario (en horas) con el que se interpretan las fechas de la consulta; la consulta
+# original usaba FROM_UNIXTIME(o.epoch / 1000 - 3600 * 5).
+DEFAULT_UTC_OFFSET_HOURS = -5
+
+# Índices compuestos que necesita la búsqueda por placa: (tabla, columnas en orden).
+REQUIRED_INDEXES = [
+    ("detections", ("attribute_id", "status", "description", "object_id")),
+    ("object", ("epoch",)),
+]
+
+DATE_PATTERN = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.fromisoformat(str(value).strip())
+
+
+def epoch_bounds(desde=None, hasta=None, utc_offset_hours=DEFAULT_UTC_OFFSET_HOURS):
+    """
+    Convierte un rango de fechas locales en límites de 'epoch' en milisegundos.
+
+    Comparar 'o.epoch' directamente contra constantes (en lugar de envolver la columna en FROM_UNIXTIME)
+    permite que MySQL use un índice sobre 'object(epoch)'.
+
+    :param desde: Fecha/hora inicial (str ISO, date o datetime), o None para no acotar.
+    :param hasta: Fecha/hora final (inclusive, como en BETWEEN: una fecha sin hora equivale a las 00:00),
+                  o None para no acotar.
+    :param utc_offset_hours: Desplazamiento de la hora local respecto a UTC.
+    :return: Tupla (epoch_min_ms, epoch_max_ms); cualquiera puede ser None.
+    """
+    offset = datetime.timedelta(hours=utc_offset_hours)
+
+    def to_ms(value):
+        if value is None:
+            return None
+        utc = value - offset
+        return int(utc.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+    return (to_ms(_to_datetime(desde)), to_ms(_to_datetime(hasta)))
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def parse_plate_prompt(prompt):
+    """
+    Extrae la placa, el color y el rango de fechas de una consulta en lenguaje natural.
+
+    Ejemplo: "placa: ABQ874 amarilla entre 2025-02-02 y 2025-02-05"
+
+    :return: Diccionario con 'placa', 'prefijo' (bool), 'color', 'desde' y 'hasta' (None si no se mencionan).
+    """
+    # La placa se escribe de forma similar a: placa: ABQ874 o placa 'ABQ874'; "placa: ABQ*" busca por prefijo.
+    match = re.search(r"placa\s*(?:[:=]\s*|['\"])([A-Z0-9]+)(\*?)", prompt, re.IGNORECASE)
+    placa = match.group(1).upper() if match else ""
+    prefijo = bool(match and match.group(2))
+
+    color = None
+    for token in re.findall(r"\w+", _normalize(prompt)):
+        if token in VALUE_SYNONYMS and VALUE_SYNONYMS[token] not in ("car", "motorcycle", "truck", "bus",
+                                                                     "bicycle", "person"):
+            color = VALUE_SYNONYMS[token]
+            break
+
+    fechas = DATE_PATTERN.findall(prompt)
+    return {
+        "placa": placa,
+        "prefijo": prefijo,
+        "color": color,
+        "desde": fechas[0] if fechas else None,
+        "hasta": fechas[1] if len(fechas) > 1 else None,
+    }
+
+
+class PlateSearchService:
+    """
+    Búsqueda de objetos por número de placa con filtros indexables.
+
+    Sustituye la consulta de referencia (6 JOIN con 'FROM_UNIXTIME(o.epoch / 1000 - 3600 * 5) BETWEEN ...')
+    por una sentencia parametrizada que:
+      - Parte de la detección de la placa ('detections' por attribute_id, status, description), que es el
+        filtro más selectivo y se resuelve con el índice compuesto de REQUIRED_INDEXES.
+      - Filtra el tiempo con límites de 'epoch' en milisegundos ('o.epoch BETWEEN %s AND %s'), sin funciones
+        sobre la columna.
+      - Recibe placa, color y rango de fechas como parámetros reales.
+    """
+
+    SELECT_COLUMNS = """
+    o.id AS object_id,
+    o.img_id,
+    c.id AS cls,
+    c.category AS tipo,
+    m.camera_id AS camara,
+    v.epoch AS fecha,
+    m.location AS ubication,
+    o.accuracy AS object_accuracy,
+    p.description AS plate,
+    p.accuracy AS plate_accuracy,
+    d2.description AS color,
+    d2.accuracy AS color_accuracy"""
+
+    def __init__(self, get_connection, result_cache=None, cache_namespace=None,
+                 utc_offset_hours=DEFAULT_UTC_OFFSET_HOURS, limit=None, columnar=False, cost_guard=None):
+        """
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param result_cache: (Opcional) ResultCache compartida para los resultados.
+        :param cache_namespace: Identidad de la conexión en las claves de la caché (p. ej. pool_key(db_config)).
+        :param utc_offset_hours: Desplazamiento horario con el que se interpretan las fechas.
+        :param limit: (Opcional) Número máximo de filas a retornar.
+        :param columnar: Si es True, los resultados se retornan como ColumnarResult.
+        :param cost_guard: (Opcional) CostGuard que evalúa la sentencia antes de ejecutarla.
+        """
+        self.get_connection = get_connection
+        self.utc_offset_hours = utc_offset_hours
+        self.limit = limit
+        self.executor = QueryExecutor(get_connection, result_cache=result_cache, cache_namespace=cache_namespace,
+                                      columnar=columnar, cost_guard=cost_guard)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def build_query(self, placa, color=None, desde=None, hasta=None, object_ids=None, prefix=False):
+        """
+        Construye la sentencia parametrizada de búsqueda.
+
+        :param placa: Número de placa exacto, o None si se filtra por 'object_ids'.
+        :param color: (Opcional) Color del objeto (valor almacenado, p. ej. "yellow").
+        :param desde: (Opcional) Fecha/hora local inicial.
+        :param hasta: (Opcional) Fecha/hora local final.
+        :param object_ids: (Opcional) Identificadores de objeto ya resueltos (p. ej. por PlateIndex).
+        :param prefix: Si es True, busca las placas que empiezan por 'placa' (LIKE 'ABQ%', que sigue usando el índice).
+        :return: Tupla (plantilla_sql, parametros).
+        """
+        params = []
+        conditions = [f"p.attribute_id = {PLATE_ATTRIBUTE_ID}", "p.status = 1"]
+        if placa is not None and prefix:
+            conditions.append("p.description LIKE %s")
+            params.append(placa.replace("%", "").replace("_", "") + "%")
+        elif placa is not None:
+            conditions.append("p.description = %s")
+            params.append(placa)
+        if object_ids is not None:
+            object_ids = list(object_ids)
+            if not object_ids:
+                return None, None
+            conditions.append(f"p.object_id IN ({', '.join(['%s'] * len(object_ids))})")
+            params.extend(object_ids)
+
+        color_join = (f"JOIN detections d2 ON d2.attribute_id = {COLOR_ATTRIBUTE_ID} AND d2.status = 1"
+                      " AND d2.object_id = o.id")
+        color_params = []
+        if color:
+            color_join += " AND d2.description = %s"
+            color_params.append(color)
+
+        epoch_min, epoch_max = epoch_bounds(desde, hasta, self.utc_offset_hours)
+        if epoch_min is not None and epoch_max is not None:
+            conditions.append("o.epoch BETWEEN %s AND %s")
+            params.extend([epoch_min, epoch_max])
+        elif epoch_min is not None:
+            conditions.append("o.epoch >= %s")
+            params.append(epoch_min)
+        elif epoch_max is not None:
+            conditions.append("o.epoch <= %s")
+            params.append(epoch_max)
+
+        sql = (
+            f"SELECT{self.SELECT_COLUMNS}\n"
+            "FROM detections p\n"
+            "JOIN object o ON o.id = p.object_id\n"
+            f"{color_join}\n"
+            "JOIN categories c ON c.id = o.category_id\n"
+            "JOIN videos v ON v.id = o.video_id\n"
+            "JOIN cameras m ON m.id = v.camera_id\n"
+            f"WHERE {' AND '.join(conditions)}\n"
+            "ORDER BY o.id DESC"
+        )
+        if self.limit:
+            sql += f"\nLIMIT {int(self.limit)}"
+        # Los parámetros del JOIN de color preceden a los del WHERE.
+        return sql, color_params + params
+
+    def search(self, placa, color=None, desde=None, hasta=None, object_ids=None, prefix=False):
+        """
+        Ejecuta la búsqueda por placa.
+
+        :return: Tupla (resultados, sql_renderizada). 'resultados' tiene el formato de QueryExecutor.ejecutar_sql
+                 (None en caso de error).
+        """
+        sql, params = self.build_query(placa, color, desde, hasta, object_ids, prefix)
+        if sql is None:
+            return {"columns": [], "data": []}, None
+        resultados = self.executor.ejecutar_sql(sql, params=params)
+        decision = self.executor.last_cost_decision
+        if decision and decision["decision"] == "ajustar":
+            sql = decision["sql"]
+        return resultados, SQLGenerationAgent.renderizar_sql(sql, params)
+
+    def explain(self, placa, color=None, desde=None, hasta=None):
+        """
+        Ejecuta EXPLAIN sobre la sentencia de búsqueda para verificar el uso de índices.
+
+        :return: Diccionario {"columns": [...], "data": [...]} con el plan de ejecución, o None en caso de error.
+        """
+        sql, params = self.build_query(placa, color, desde, hasta)
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("EXPLAIN " + sql, tuple(params))
+            data = cursor.fetchall()
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            return {"columns": columns, "data": data}
+        except Exception as e:
+            self.logger.error("Error al obtener el plan de la búsqueda por placa: %s", e)
+            return None
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+
+class IndexAdvisor:
+    """
+    Verifica que existan los índices compuestos que necesita la búsqueda por placa (REQUIRED_INDEXES)
+    consultando information_schema.statistics, y genera el DDL de los que faltan.
+
+    Un índice existente cubre el requerido si sus primeras columnas coinciden, en orden, con las requeridas.
+    """
+
+    def __init__(self, get_connection, db_name, required_indexes=None):
+        """
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param db_name: Nombre de la base de datos.
+        :param required_indexes: (Opcional) Lista de (tabla, columnas); por defecto REQUIRED_INDEXES.
+        """
+        self.get_connection = get_connection
+        self.db_name = db_name
+        self.required_indexes = required_indexes or REQUIRED_INDEXES
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _existing_indexes(self):
+        """
+        :return: Diccionario {tabla: {indice: [columnas en orden]}}.
+        """
+        tables = sorted({table for table, _ in self.required_indexes})
+        placeholders = ", ".join(["%s"] * len(tables))
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT table_name, index_name, seq_in_index, column_name FROM information_schema.statistics "
+                f"WHERE table_schema = %s AND table_name IN ({placeholders}) "
+                "ORDER BY table_name, index_name, seq_in_index",
+                tuple([self.db_name] + tables)
+            )
+            indexes = {}
+            for table, index_name, _seq, column in cursor.fetchall():
+                indexes.setdefault(table, {}).setdefault(index_name, []).append(column.lower())
+            return indexes
+        finally:
+            cursor.close()
+            conn.close()
+
+    @staticmethod
+    def index_name(table, columns):
+        return f"idx_{table}_{'_'.join(columns)}"
+
+    def check(self):
+        """
+        Comprueba los índices requeridos.
+
+        :return: Lista de diccionarios con 'table', 'columns', 'present', 'index_name' (el existente que lo
+                 cubre, o el nombre sugerido) y 'ddl' (None si ya existe).
+        """
+        existing = self._existing_indexes()
+        report = []
+        for table, columns in self.required_indexes:
+            covering = None
+            for name, index_columns in existing.get(table, {}).items():
+                if tuple(index_columns[:len(columns)]) == tuple(columns):
+                    covering = name
+                    break
+            name = covering or self.index_name(table, columns)
+            report.append({
+                "table": table,
+                "columns": list(columns),
+                "present": covering is not None,
+                "index_name": name,
+                "ddl": None if covering else f"CREATE INDEX {name} ON {table} ({', '.join(columns)})",
+            })
+            if covering is None:
+                self.logger.warning("Falta el índice recomendado para la búsqueda por placa: %s(%s)",
+                                    table, ", ".join(columns))
+        return report
+
+    def create_missing(self):
+        """
+        Crea los índices requeridos que no existen.
+
+        :return: Lista de sentencias DDL ejecutadas.
+        """
+        executed = []
+        missing = [item["ddl"] for item in self.check() if item["ddl"]]
+        if not missing:
+            return executed
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            for ddl in missing:
+                self.logger.info("Creando índice: %s", ddl)
+                cursor.execute(ddl)
+                executed.append(ddl)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return executed
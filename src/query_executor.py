@@ -1,6 +1,40 @@
 # modules/query_executor.py
 
+import json
 import logging
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from connection_pool import on_session_reset
+from deadline import cancel_on_deadline, degrade, expired
+from tracing import record
+
+# Sentencias preparadas por conexión física: conexión -> OrderedDict(plantilla -> cursor preparado).
+# Las conexiones del pool se reutilizan, por lo que una misma forma de consulta solo se prepara una vez.
+_statement_caches = weakref.WeakKeyDictionary()
+_statement_caches_lock = threading.Lock()
+
+
+def _olvidar_sentencias(raw_conn):
+    """
+    Descarta las sentencias preparadas de una conexión cuya sesión se reinició (reconexión) o que se cerró.
+    """
+    with _statement_caches_lock:
+        try:
+            cache = _statement_caches.pop(raw_conn, None)
+        except TypeError:
+            cache = None
+    for cursor in (cache or {}).values():
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+on_session_reset(_olvidar_sentencias)
 
 class QueryExecutor:
     """
@@ -8,21 +42,48 @@ class QueryExecutor:
     
     Este agente utiliza una función 'get_connection' para obtener una conexión a la base de datos.
     Maneja errores y excepciones durante la ejecución y retorna los resultados en un formato estructurado.
+
+    Las consultas parametrizadas (plantilla con '%s' + parámetros) se ejecutan con cursores preparados que se
+    reutilizan por conexión, de modo que el servidor no vuelve a analizar ni planificar la misma forma de consulta.
+
+    Con un CostGuard, cada SELECT se evalúa con EXPLAIN antes de ejecutarse: puede ejecutarse ajustada (LIMIT
+    más estricto, hint MAX_EXECUTION_TIME) o no ejecutarse; la decisión queda en 'last_cost_decision'.
+
+    Dentro de una solicitud con plazo (ver deadline.py), una sentencia que sigue en curso al vencer el plazo se
+    cancela en el servidor con KILL QUERY desde una conexión aparte ('last_cancelled').
     """
     
-    def __init__(self, get_connection):
+    def __init__(self, get_connection, result_cache=None, cache_namespace=None, max_prepared_statements=32,
+                 columnar=False, cost_guard=None):
         """
         :param get_connection: Función que retorna una conexión a la base de datos.
+        :param result_cache: (Opcional) ResultCache para reutilizar resultados de sentencias SELECT repetidas.
+        :param cache_namespace: Identidad de la conexión usada en las claves de la caché (p. ej. pool_key(db_config)).
+        :param max_prepared_statements: Número máximo de sentencias preparadas que se conservan por conexión.
+        :param columnar: Si es True, 'ejecutar_sql' retorna un ColumnarResult (arreglos tipados por columna)
+                         en lugar del diccionario con la lista de tuplas.
+        :param cost_guard: (Opcional) CostGuard que evalúa cada SELECT antes de ejecutarla.
         """
         self.get_connection = get_connection
+        self.cost_guard = cost_guard
+        self.last_cost_decision = None
+        self.last_cancelled = False
+        self.max_prepared_statements = max_prepared_statements
+        self.result_cache = result_cache
+        self.cache_namespace = cache_namespace
+        self.columnar = columnar
+        self.last_cache_hit = False
         self.logger = logging.getLogger(self.__class__.__name__)
     
-    def ejecutar_sql(self, sql):
+    def ejecutar_sql(self, sql, params=None):
         """
         Ejecuta la consulta SQL proporcionada y retorna los resultados.
         
-        :param sql: Consulta SQL a ejecutar (cadena de texto).
-        :return: Un diccionario con las columnas y los datos obtenidos, o None en caso de error.
+        :param sql: Consulta SQL a ejecutar (cadena de texto). Si se indican 'params', es una plantilla con marcadores '%s'.
+        :param params: (Opcional) Parámetros de la plantilla; activa la ejecución con sentencias preparadas.
+        :return: Un diccionario con las columnas y los datos obtenidos (un ColumnarResult con la misma interfaz
+                 si el ejecutor es columnar), o None en caso de error, si el control de costo la rechaza o si
+                 se canceló por el plazo de la solicitud.
                  Ejemplo:
                  {
                     "columns": ["id", "nombre", "edad"],
@@ -32,31 +93,183 @@ class QueryExecutor:
                     ]
                  }
         """
+        self.last_cache_hit = False
+        self.last_cost_decision = None
+        self.last_cancelled = False
+        if self.cost_guard is not None:
+            self.last_cost_decision = self.cost_guard.evaluar(sql, params)
+            if self.last_cost_decision["decision"] == "rechazar":
+                self.logger.warning("Consulta rechazada por el control de costo: %s", self.last_cost_decision["motivo"])
+                return None
+            # Se ejecuta (y se cachea) la sentencia ajustada.
+            sql = self.last_cost_decision["sql"]
+        use_cache = self.result_cache is not None and self.result_cache.es_cacheable(sql)
+        cache_sql = self._clave_cache(sql, params)
+        if use_cache:
+            cached = self.result_cache.get(self.cache_namespace, cache_sql, self.get_connection)
+            if cached is not None:
+                self.logger.info("Resultado obtenido de la caché: %s", sql)
+                self.last_cache_hit = True
+                record("result_cache_hit", True)
+                record("rows", len(cached["data"]))
+                return self._adaptar_formato(cached)
+        # Instante posterior a la lectura de los marcadores de cambio: si una tabla cambia desde aquí, el
+        # resultado no se cachea.
+        started_at = time.monotonic()
+
+        if expired():
+            # Sin tiempo para ejecutarla: respuesta degradada en lugar de ocupar una conexión.
+            self.last_cancelled = True
+            degrade("ejecutar_sql", "plazo vencido antes de ejecutar la consulta")
+            return None
+
         conn = None
         cursor = None
         resultados = None
+        watch = None
         
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            self.logger.info("Ejecutando SQL: %s", sql)
-            cursor.execute(sql)
-            # Obtener todos los registros
-            data = cursor.fetchall()
+            with cancel_on_deadline(conn, self._conexion_de_cancelacion(conn)) as watch:
+                if params is not None:
+                    cursor, reutilizado = self._cursor_preparado(conn, sql)
+                    self.logger.info("Ejecutando SQL preparado: %s | parámetros: %s", sql, params)
+                    try:
+                        cursor.execute(sql, tuple(params))
+                    except Exception as e:
+                        if not reutilizado or (watch is not None and watch.fired):
+                            raise
+                        # La sesión pudo cambiar sin que el pool lo notara: se prepara de nuevo una sola vez.
+                        self.logger.warning("Sentencia preparada inválida (%s); se prepara de nuevo.", e)
+                        self._descartar_preparado(conn, sql)
+                        cursor, _ = self._cursor_preparado(conn, sql)
+                        cursor.execute(sql, tuple(params))
+                else:
+                    cursor = conn.cursor()
+                    self.logger.info("Ejecutando SQL: %s", sql)
+                    cursor.execute(sql)
+                # Obtener todos los registros
+                data = cursor.fetchall()
             # Obtener nombres de columnas si están disponibles
             columns = [desc[0] for desc in cursor.description] if cursor.description else []
             
-            resultados = {
-                "columns": columns,
-                "data": data
-            }
+            if self.columnar:
+                from columnar import ColumnarResult
+                resultados = ColumnarResult.from_rows(cursor.description, data)
+                record("bytes", resultados.nbytes)
+            else:
+                resultados = {
+                    "columns": columns,
+                    "data": data
+                }
+                record("bytes", sum(self._estimar_bytes(row) for row in data))
+            record("rows", len(data))
         except Exception as e:
             self.logger.error("Error al ejecutar la consulta SQL: %s", e)
             resultados = None
+            if watch is not None and watch.fired:
+                self.last_cancelled = True
+                record("cancelled", True)
+                degrade("ejecutar_sql", "consulta cancelada en el servidor (KILL QUERY) al vencer el plazo")
+            if params is not None and conn is not None:
+                # No reutilizar una sentencia preparada que falló.
+                self._descartar_preparado(conn, sql)
         finally:
-            if cursor:
+            # Los cursores preparados que quedan en la caché de la conexión no se cierran.
+            if cursor and (params is None or not self._esta_en_cache(conn, sql)):
                 cursor.close()
             if conn:
                 conn.close()
         
+        if use_cache:
+            record("result_cache_hit", False)
+        if use_cache and resultados is not None:
+            self.result_cache.set(self.cache_namespace, cache_sql, resultados, started_at=started_at)
         return resultados
+
+    def _conexion_de_cancelacion(self, conn):
+        """
+        Función que abre la conexión desde la que se cancela una sentencia de 'conn': una conexión fuera del
+        pool si 'conn' es del pool (que puede estar agotado), o una de 'get_connection' en otro caso.
+        """
+        pool = getattr(conn, "pool", None)
+        return pool.open_side_connection if pool is not None else self.get_connection
+
+    def _adaptar_formato(self, resultados):
+        """
+        Convierte un resultado cacheado al formato de este ejecutor (la caché es compartida por ejecutores
+        columnares y de tuplas).
+        """
+        is_dict = isinstance(resultados, dict)
+        if self.columnar and is_dict:
+            from columnar import ColumnarResult
+            return ColumnarResult.from_rows([(c, None) for c in resultados["columns"]], resultados["data"])
+        if not self.columnar and not is_dict:
+            return {"columns": list(resultados["columns"]), "data": list(resultados["data"])}
+        return resultados
+
+    @staticmethod
+    def _clave_cache(sql, params):
+        """
+        Clave de la caché de resultados: la sentencia más sus parámetros (si los hay).
+        """
+        if not params:
+            return sql
+        return f"{sql.rstrip().rstrip(';')} /* {json.dumps(list(params), default=str)} */"
+
+    def _cache_de_sentencias(self, conn):
+        raw = getattr(conn, "raw_connection", conn)
+        with _statement_caches_lock:
+            cache = _statement_caches.get(raw)
+            if cache is None:
+                cache = OrderedDict()
+                try:
+                    _statement_caches[raw] = cache
+                except TypeError:
+                    # La conexión no admite referencias débiles: no se cachean sentencias.
+                    return None
+            return cache
+
+    def _cursor_preparado(self, conn, sql):
+        """
+        Retorna un cursor preparado para la plantilla 'sql', reutilizándolo si la conexión ya la preparó.
+
+        :return: Tupla (cursor, True si se reutilizó uno ya preparado).
+        """
+        cache = self._cache_de_sentencias(conn)
+        if cache is not None and sql in cache:
+            cache.move_to_end(sql)
+            record("prepared_statement_hit", True)
+            return cache[sql], True
+
+        cursor = conn.cursor(prepared=True)
+        record("prepared_statement_hit", False)
+        if cache is not None:
+            cache[sql] = cursor
+            while len(cache) > self.max_prepared_statements:
+                _, evicted = cache.popitem(last=False)
+                try:
+                    evicted.close()
+                except Exception as e:
+                    self.logger.debug("Error al cerrar la sentencia preparada: %s", e)
+        return cursor, False
+
+    def _esta_en_cache(self, conn, sql):
+        cache = self._cache_de_sentencias(conn) if conn is not None else None
+        return cache is not None and sql in cache
+
+    def _descartar_preparado(self, conn, sql):
+        cache = self._cache_de_sentencias(conn)
+        cursor = cache.pop(sql, None) if cache is not None else None
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception as e:
+                self.logger.debug("Error al cerrar la sentencia preparada: %s", e)
+
+    @staticmethod
+    def _estimar_bytes(row):
+        """
+        Estimación aproximada del tamaño en memoria de una fila.
+        """
+        return sum(sys.getsizeof(value) for value in row)
@@ -3,6 +3,21 @@
 import json
 import logging
 
+from deadline import DeadlineExceeded, degrade, retry_call, retry_call_async
+from llm_cache import schema_fingerprint, fingerprint_is_cached
+from tracing import record, record_add
+
+# Errores transitorios de la API de OpenAI (0.x) que justifican reintentar la llamada.
+RETRYABLE_LLM_ERRORS = ("Timeout", "APIConnectionError", "RateLimitError", "ServiceUnavailableError", "TryAgain",
+                        "APIError")
+
+
+def _errores_reintentables(openai):
+    error_module = getattr(openai, "error", None)
+    errors = tuple(getattr(error_module, name) for name in RETRYABLE_LLM_ERRORS if hasattr(error_module, name))
+    return errors + (TimeoutError,)
+
+
 class UserQueryAgent:
     """
     Agente encargado de interpretar consultas en lenguaje natural y convertirlas en una estructura
@@ -13,14 +28,27 @@ class UserQueryAgent:
       - 'filtros': Un objeto (diccionario) que representa las condiciones de la consulta en pares columna-valor.
     
     Este agente utiliza un modelo de lenguaje (LLM) para analizar la consulta en el contexto del esquema
-    de la base de datos y del mapa semántico.
+    de la base de datos y del mapa semántico. Opcionalmente, una caché (LLMResponseCache) evita repetir
+    la llamada al LLM para consultas ya interpretadas con el mismo esquema, y un SchemaPruner reduce el
+    esquema incluido en el prompt a las tablas relevantes.
+
+    Cada llamada al LLM tiene un tiempo máximo ('timeout', acotado al plazo de la solicitud, ver deadline.py) y
+    se reintenta ante errores transitorios ('max_retries', con espera exponencial desde 'backoff' segundos).
     """
     
-    def __init__(self, llm_api_key=None, model="gpt-3.5-turbo", temperature=0.0):
+    def __init__(self, llm_api_key=None, model="gpt-3.5-turbo", temperature=0.0, cache=None, pruner=None,
+                 rate_limiter=None, timeout=None, max_retries=0, backoff=0.5):
         """
         :param llm_api_key: Clave API para el modelo de lenguaje (por ejemplo, OpenAI).
         :param model: Modelo de lenguaje a utilizar.
         :param temperature: Controla la aleatoriedad en la respuesta del modelo.
+        :param cache: (Opcional) LLMResponseCache para reutilizar interpretaciones previas.
+        :param pruner: (Opcional) SchemaPruner para enviar solo las tablas relevantes en formato compacto.
+        :param rate_limiter: (Opcional) Objeto con método 'acquire()' que se invoca antes de cada llamada al LLM
+                             (las respuestas obtenidas de la caché no lo consumen).
+        :param timeout: (Opcional) Segundos máximos de cada llamada al LLM.
+        :param max_retries: Reintentos de la llamada ante errores transitorios (tiempo agotado, conexión, límite de tasa).
+        :param backoff: Espera inicial entre reintentos, en segundos (se duplica en cada reintento).
         """
         if llm_api_key:
             try:
@@ -30,9 +58,16 @@ class UserQueryAgent:
                 raise ImportError("El paquete openai no está instalado. Instálalo para usar el LLM.")
         self.model = model
         self.temperature = temperature
+        self.cache = cache
+        self.pruner = pruner
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.last_prompt_report = None  # Reporte del último recorte de esquema (tokens ahorrados, tablas)
         self.logger = logging.getLogger(self.__class__.__name__)
 
-    def interpretar_consulta(self, consulta, schema, semantic_map):
+    def interpretar_consulta(self, consulta, schema, semantic_map, bypass_cache=False):
         """
         Interpreta una consulta en lenguaje natural y retorna una estructura de consulta (diccionario)
         con los campos 'accion', 'tabla' y 'filtros'.
@@ -40,11 +75,66 @@ class UserQueryAgent:
         :param consulta: Consulta en lenguaje natural.
         :param schema: Esquema de la base de datos (diccionario obtenido, por ejemplo, con DBSchemaAgent).
         :param semantic_map: Mapa semántico para traducir nombres técnicos a nombres legibles.
+        :param bypass_cache: Si es True, ignora la caché y consulta siempre al LLM (el resultado sí se guarda).
         :return: Diccionario con la estructura de consulta.
         """
+        cache_key, cached = self._buscar_en_cache(consulta, schema, semantic_map, bypass_cache)
+        if cached is not None:
+            return cached
+
+        estructura_consulta = self._interpretar_con_llm(consulta, schema, semantic_map)
+        self._guardar_en_cache(cache_key, estructura_consulta)
+        return estructura_consulta
+
+    async def interpretar_consulta_async(self, consulta, schema, semantic_map, bypass_cache=False):
+        """
+        Variante asíncrona de 'interpretar_consulta' que no bloquea el bucle de eventos durante la llamada al LLM.
+        """
+        if self.cache is not None and not fingerprint_is_cached(schema, semantic_map):
+            # Primera consulta con esta versión del esquema: la huella (json.dumps y SHA-1 del esquema
+            # completo) se calcula fuera del bucle de eventos; las siguientes la toman memorizada.
+            import asyncio
+            await asyncio.to_thread(schema_fingerprint, schema, semantic_map)
+        cache_key, cached = self._buscar_en_cache(consulta, schema, semantic_map, bypass_cache)
+        if cached is not None:
+            return cached
+
+        prompt = self._crear_prompt(consulta, schema, semantic_map)
+        respuesta_llm = await self._obtener_respuesta_llm_async(prompt)
+        estructura_consulta = self._decodificar_respuesta(respuesta_llm)
+        self._guardar_en_cache(cache_key, estructura_consulta)
+        return estructura_consulta
+
+    def _buscar_en_cache(self, consulta, schema, semantic_map, bypass_cache):
+        """
+        :return: Tupla (clave de caché, estructura cacheada o None).
+        """
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.make_key(consulta, schema_fingerprint(schema, semantic_map), self.model)
+        if bypass_cache:
+            self.cache.record_bypass()
+            return cache_key, None
+        cached = self.cache.get(cache_key)
+        record("llm_cache_hit", cached is not None)
+        if cached is not None:
+            self.logger.info("Interpretación obtenida de la caché del LLM.")
+        return cache_key, cached
+
+    def _guardar_en_cache(self, cache_key, estructura_consulta):
+        # Solo se cachean interpretaciones válidas (no los errores, que se traducen en {}).
+        if cache_key is not None and estructura_consulta:
+            self.cache.set(cache_key, estructura_consulta)
+
+    def _interpretar_con_llm(self, consulta, schema, semantic_map):
+        """
+        Construye el prompt, consulta al LLM y decodifica la respuesta JSON.
+        """
         prompt = self._crear_prompt(consulta, schema, semantic_map)
         respuesta_llm = self._obtener_respuesta_llm(prompt)
-        
+        return self._decodificar_respuesta(respuesta_llm)
+
+    def _decodificar_respuesta(self, respuesta_llm):
         try:
             estructura_consulta = json.loads(respuesta_llm)
         except json.JSONDecodeError as e:
@@ -53,6 +143,14 @@ class UserQueryAgent:
         
         return estructura_consulta
 
+    def _registrar_uso(self, response):
+        """
+        Registra en la traza activa los tokens de entrada y salida reportados por el LLM.
+        """
+        usage = response.get('usage') or {}
+        record_add("llm_tokens_in", usage.get('prompt_tokens', 0))
+        record_add("llm_tokens_out", usage.get('completion_tokens', 0))
+
     def _crear_prompt(self, consulta, schema, semantic_map):
         """
         Crea el prompt para enviar al LLM, incluyendo el esquema de la base de datos, el mapa semántico
@@ -63,14 +161,27 @@ class UserQueryAgent:
         :param semantic_map: Mapa semántico en formato diccionario.
         :return: Prompt completo en forma de cadena de texto.
         """
+        if self.pruner is not None:
+            schema_text, semantic_text, self.last_prompt_report = self.pruner.prune(consulta, schema, semantic_map)
+            record("prompt_tokens_saved", self.last_prompt_report["tokens_saved"])
+            formato = (
+                "Formato compacto: 'c' son las columnas con su tipo ('*' indica llave primaria), "
+                "'fk' las llaves foráneas (columna>tabla.columna) y 'n' el nombre legible de la tabla.\n"
+            )
+        else:
+            schema_text = json.dumps(schema, indent=2)
+            semantic_text = json.dumps(semantic_map, indent=2)
+            formato = ""
+
         prompt = (
             "Eres un asistente experto en bases de datos. Se te proporciona el esquema de la base de datos "
             "Analiza la consulta y, utilizando el esquema y el mapa semántico, identifica cuál es la tabla más relevante para responder a la pregunta, incluso si la consulta no menciona explícitamente el nombre de la tabla\n"
             "y un mapa semántico que convierte nombres técnicos a nombres legibles para humanos.\n\n"
+            f"{formato}"
             "Esquema de la base de datos (en formato JSON):\n"
-            f"{json.dumps(schema, indent=2)}\n\n"
+            f"{schema_text}\n\n"
             "Mapa semántico (en formato JSON):\n"
-            f"{json.dumps(semantic_map, indent=2)}\n\n"
+            f"{semantic_text}\n\n"
             "Interpreta la siguiente consulta en lenguaje natural y genera una estructura de consulta en formato JSON. "
             "La estructura debe incluir los siguientes campos:\n"
             "- 'accion': La acción a realizar (por ejemplo, 'contar', 'listar', 'promedio').\n"
@@ -97,16 +208,63 @@ class UserQueryAgent:
         :return: La respuesta generada por el LLM en formato de texto.
         """
         import openai
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        def llamar(timeout):
+            return openai.ChatCompletion.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=self.temperature,
+                max_tokens=150,
+                request_timeout=timeout
+            )
+
         try:
-            response = openai.ChatCompletion.create(
+            response = retry_call(llamar, "interpretar_consulta", timeout=self.timeout, retries=self.max_retries,
+                                  backoff=self.backoff, retry_on=_errores_reintentables(openai))
+            respuesta = response['choices'][0]['message']['content'].strip()
+            self._registrar_uso(response)
+        except Exception as e:
+            self.logger.error("Error al obtener respuesta del LLM: %s", e)
+            self._degradar_si_agotado(e)
+            respuesta = "{}"  # Retornamos un JSON vacío en caso de error.
+        
+        return respuesta
+
+    @staticmethod
+    def _degradar_si_agotado(error):
+        if isinstance(error, (DeadlineExceeded, TimeoutError)) or type(error).__name__ == "Timeout":
+            degrade("interpretar_consulta", f"el LLM no respondió a tiempo ({error})")
+
+    async def _obtener_respuesta_llm_async(self, prompt):
+        """
+        Variante asíncrona de '_obtener_respuesta_llm' (usa openai.ChatCompletion.acreate).
+        """
+        import openai
+        if self.rate_limiter is not None:
+            # 'acquire' es bloqueante: se espera la ficha en una hebra para no detener el bucle de eventos.
+            import asyncio
+            await asyncio.to_thread(self.rate_limiter.acquire)
+
+        def llamar(timeout):
+            return openai.ChatCompletion.acreate(
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=self.temperature,
-                max_tokens=150
+                max_tokens=150,
+                request_timeout=timeout
             )
+
+        try:
+            response = await retry_call_async(llamar, "interpretar_consulta", timeout=self.timeout,
+                                              retries=self.max_retries, backoff=self.backoff,
+                                              retry_on=_errores_reintentables(openai))
             respuesta = response['choices'][0]['message']['content'].strip()
+            self._registrar_uso(response)
         except Exception as e:
             self.logger.error("Error al obtener respuesta del LLM: %s", e)
+            self._degradar_si_agotado(e)
             respuesta = "{}"  # Retornamos un JSON vacío en caso de error.
         
         return respuesta
@@ -1,23 +1,57 @@
 # modules/response_formatter.py
 
+from tracing import record
+
+_ufuncs = None
+
+
+def _cell_ufuncs():
+    """
+    Funciones universales de NumPy sobre celdas (str, len y str.ljust). NumPy se importa en el primer
+    formateo de una tabla, no al importar el módulo.
+    """
+    global _ufuncs
+    if _ufuncs is None:
+        import numpy as np
+        # Convierte cada celda con str() (igual que el formateo fila a fila original), en un solo recorrido.
+        _ufuncs = (np, np.frompyfunc(str, 1, 1), np.frompyfunc(len, 1, 1), np.frompyfunc(str.ljust, 2, 1))
+    return _ufuncs
+
+
 class ResponseFormatter:
     """
     Agente encargado de formatear los resultados obtenidos de la consulta SQL en una respuesta
     legible en lenguaje natural.
-    
+
     Dependiendo del tipo de consulta, se puede:
       - Mostrar un mensaje simple para resultados agregados (ej. contar, promedio).
       - Formatear una tabla para resultados de listas.
+
+    Con 'max_rows' y/o 'max_bytes' la tabla se recorta a ese presupuesto y termina con un resumen de las
+    filas omitidas; solo se convierten a texto las filas que caben, de modo que la memoria usada no depende
+    del tamaño del resultado. Las celdas se convierten y miden por bloques con NumPy (no fila a fila), e
+    'iter_respuesta' entrega la respuesta en fragmentos para mostrarla de forma incremental.
     """
-    
-    def __init__(self):
-        pass
+
+    def __init__(self, max_rows=None, max_bytes=None, max_col_width=None, align=False, chunk_rows=500):
+        """
+        :param max_rows: (Opcional) Número máximo de filas de la tabla.
+        :param max_bytes: (Opcional) Tamaño máximo aproximado de la tabla en bytes (UTF-8).
+        :param max_col_width: (Opcional) Ancho máximo de una celda; las más largas se cortan con '…'.
+        :param align: Si es True, rellena las columnas al ancho de su celda más larga.
+        :param chunk_rows: Filas por fragmento en 'iter_respuesta'.
+        """
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_col_width = max_col_width
+        self.align = align
+        self.chunk_rows = chunk_rows
 
     def formatear_respuesta(self, resultados, estructura_consulta=None):
         """
-        Recibe los resultados obtenidos (un diccionario con claves "columns" y "data") y 
+        Recibe los resultados obtenidos (un diccionario con claves "columns" y "data") y
         genera una respuesta legible en lenguaje natural.
-        
+
         :param resultados: Diccionario con el resultado de la consulta, por ejemplo:
                            {
                                "columns": ["id", "nombre", "edad"],
@@ -31,8 +65,18 @@ class ResponseFormatter:
                                     o 'promedio').
         :return: Cadena de texto con la respuesta formateada.
         """
+        respuesta = "".join(self.iter_respuesta(resultados, estructura_consulta))
+        record("response_chars", len(respuesta))
+        return respuesta
+
+    def iter_respuesta(self, resultados, estructura_consulta=None):
+        """
+        Genera la misma respuesta que 'formatear_respuesta' en fragmentos (encabezado, bloques de
+        'chunk_rows' filas y, si se recortó, el resumen de filas omitidas), sin construir la cadena completa.
+        """
         if not resultados:
-            return "No se encontraron resultados o se produjo un error en la consulta."
+            yield "No se encontraron resultados o se produjo un error en la consulta."
+            return
 
         # Si se conoce la acción (por ejemplo, contar o promedio) se puede personalizar el mensaje.
         accion = ""
@@ -45,24 +89,70 @@ class ResponseFormatter:
             if resultados.get("data") and len(resultados["data"]) == 1 and len(resultados["data"][0]) == 1:
                 valor = resultados["data"][0][0]
                 if accion == "contar":
-                    return f"El número de registros es: {valor}."
+                    yield f"El número de registros es: {valor}."
+                    return
                 elif accion == "promedio":
-                    return f"El valor promedio es: {valor}."
-        
+                    yield f"El valor promedio es: {valor}."
+                    return
+
         # En caso de que se trate de una consulta que retorna múltiples registros (por ejemplo, listar),
         # formateamos los resultados como una tabla.
-        columnas = resultados.get("columns", [])
+        columnas = list(resultados.get("columns", []))
         datos = resultados.get("data", [])
+        total = len(datos)
+
+        # Filas candidatas: las que caben en 'max_rows' y, como cada fila ocupa al menos su separador
+        # de columnas y el salto de línea, las que pueden caber en 'max_bytes'.
+        limite = total if self.max_rows is None else min(total, self.max_rows)
+        if self.max_bytes is not None:
+            limite = min(limite, self.max_bytes // (3 * max(len(columnas) - 1, 0) + 1) + 1)
+
+        np, _, _len, _ljust = _cell_ufuncs()
+        celdas = self._celdas(datos, limite, len(columnas))
+        anchos = None
+        if self.align:
+            # Ancho de cada columna en una sola pasada sobre todas las celdas.
+            anchos = _len(celdas).max(axis=0, initial=0).astype(np.int64) if celdas.size else np.zeros(len(columnas), dtype=np.int64)
+            anchos = np.maximum(anchos, [len(c) for c in columnas])
+            celdas = _ljust(celdas, anchos) if celdas.size else celdas
+            columnas = [c.ljust(w) for c, w in zip(columnas, anchos.tolist())]
 
         # Construir encabezado.
         header = " | ".join(columnas)
         separator = "-" * len(header)
-        filas = [header, separator]
+        yield header + "\n" + separator
+        usados = len((header + separator).encode("utf-8")) + 1
 
-        # Construir cada fila de resultados.
-        for fila in datos:
-            fila_str = " | ".join(str(item) for item in fila)
-            filas.append(fila_str)
+        mostradas = 0
+        for inicio in range(0, limite, self.chunk_rows):
+            lineas = list(map(" | ".join, celdas[inicio:inicio + self.chunk_rows].tolist()))
+            caben = len(lineas)
+            if self.max_bytes is not None:
+                tamanos = np.fromiter(map(len, map(str.encode, lineas)), dtype=np.int64, count=len(lineas)) + 1
+                acumulado = usados + np.cumsum(tamanos)
+                caben = int(np.searchsorted(acumulado, self.max_bytes, side="right"))
+                usados = int(acumulado[caben - 1]) if caben else usados
+            if caben:
+                yield "\n" + "\n".join(lineas[:caben])
+            mostradas += caben
+            if caben < len(lineas):
+                break
 
-        respuesta = "\n".join(filas)
-        return respuesta
+        if mostradas < total:
+            yield f"\n... y {total - mostradas} filas más (se muestran {mostradas} de {total})."
+
+    def _celdas(self, datos, limite, num_columnas):
+        """
+        Convierte a texto las primeras 'limite' filas: arreglo de cadenas (objetos) de forma (filas, columnas).
+        """
+        np, _to_str, _len, _ = _cell_ufuncs()
+        celdas = np.empty((limite, num_columnas), dtype=object)
+        if not celdas.size:
+            return celdas
+        celdas[:] = datos[:limite]
+        celdas = _to_str(celdas)
+        if self.max_col_width:
+            largas = _len(celdas).astype(np.int64) > self.max_col_width
+            if largas.any():
+                celdas[largas] = [c[:max(self.max_col_width - 1, 0)] + "…" for c in celdas[largas]]
+        return celdas
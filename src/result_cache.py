@@ -0,0 +1,285 @@
+# modules/result_cache.py
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Tablas referenciadas en FROM / JOIN (con o sin comillas invertidas).
+TABLE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+`?([A-Za-z0-9_$]+)`?", re.IGNORECASE)
+
+
+def normalizar_sql(sql):
+    """
+    Normaliza una sentencia SQL para usarla como clave: espacios colapsados y sin ';' final.
+    Las palabras clave no se pasan a minúsculas para no alterar los literales.
+    """
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def extraer_tablas(sql):
+    """
+    Retorna el conjunto de tablas referenciadas en FROM/JOIN de la sentencia.
+    """
+    return {match.lower() for match in TABLE_PATTERN.findall(sql)}
+
+
+def estimar_bytes(resultados):
+    """
+    Estimación aproximada del tamaño en memoria de un resultado {"columns", "data"} (o de un ColumnarResult).
+    """
+    if hasattr(resultados, "nbytes"):
+        return resultados.nbytes
+    total = sys.getsizeof(resultados.get("data", []))
+    for row in resultados.get("data", []):
+        total += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return total
+
+
+def _copiar(resultados):
+    """
+    Copia superficial de un resultado para que el llamador no modifique la entrada cacheada.
+    Los ColumnarResult son de solo lectura y se comparten sin copiar.
+    """
+    if not isinstance(resultados, dict):
+        return resultados
+    return {"columns": list(resultados["columns"]), "data": list(resultados["data"])}
+
+
+class ResultCache:
+    """
+    Caché de resultados de sentencias SELECT, indexada por el SQL normalizado y la identidad de la conexión
+    (por ejemplo, connection_pool.pool_key(db_config)).
+
+      - TTL por tabla ('table_ttls'); una entrada expira con el menor TTL de las tablas que consulta.
+      - Límite de memoria ('max_bytes') con expulsión LRU.
+      - Invalidación por marcadores de cambio: cada 'marker_check_interval' segundos se compara el
+        UPDATE_TIME de information_schema (o MAX(id) con marker="max_id", que solo detecta inserciones)
+        de las tablas consultadas. En MySQL 8 information_schema guarda en caché las estadísticas durante
+        'information_schema_stats_expiry' segundos (86400 por defecto), por lo que la lectura se hace con
+        ese valor a 0 en la sesión; aun así UPDATE_TIME no se conserva tras reiniciar el servidor y en
+        InnoDB tiene resolución de segundos. No se usa TABLE_ROWS, que es una estimación que cambia sin
+        que cambien los datos; si cambió, se descartan todas las entradas de esa tabla. El marcador se
+        lee en 'get', antes de ejecutar la consulta, y 'set' no guarda un resultado si alguna de sus tablas
+        cambió después de que empezara la consulta ('started_at'): una escritura que llegue entre la
+        consulta y la lectura del marcador no queda cacheada como vigente.
+      - 'invalidate_table' e 'invalidate' permiten invalidar de forma explícita.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, default_ttl=60, table_ttls=None, marker="update_time",
+                 marker_check_interval=5):
+        """
+        :param max_bytes: Memoria máxima aproximada ocupada por los resultados cacheados.
+        :param default_ttl: Segundos de validez de un resultado si sus tablas no tienen TTL propio.
+        :param table_ttls: (Opcional) Diccionario {tabla: ttl_en_segundos}.
+        :param marker: Marcador de cambio: "update_time", "max_id" (solo inserciones, lectura del índice de
+                       la clave primaria) o None para depender solo del TTL.
+        :param marker_check_interval: Segundos mínimos entre dos comprobaciones del marcador de una tabla.
+        """
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.table_ttls = {t.lower(): ttl for t, ttl in (table_ttls or {}).items()}
+        self.marker = marker
+        self.marker_check_interval = marker_check_interval
+        self._entries = OrderedDict()  # clave -> (resultados, expira_en, tablas, bytes)
+        self._markers = {}  # (namespace, tabla) -> (valor, comprobado_en, cambiado_en)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def es_cacheable(sql):
+        return bool(sql) and normalizar_sql(sql).upper().startswith("SELECT")
+
+    def _ttl_for(self, tables):
+        ttls = [self.table_ttls[t] for t in tables if t in self.table_ttls]
+        return min(ttls) if ttls else self.default_ttl
+
+    def _probe_markers(self, get_connection, tables):
+        """
+        Lee el marcador de cambio actual de cada tabla.
+
+        :return: Diccionario {tabla: marcador}.
+        """
+        if not tables or not self.marker:
+            return {}
+        conn = get_connection()
+        cursor = conn.cursor()
+        markers = {}
+        try:
+            if self.marker == "update_time":
+                # Sin esto MySQL 8 responde con las estadísticas cacheadas (hasta 24 h de antigüedad). Las versiones
+                # sin la variable (MySQL 5.7, MariaDB) no las cachean.
+                try:
+                    cursor.execute("SET SESSION information_schema_stats_expiry = 0;")
+                except Exception as e:
+                    self.logger.debug("information_schema_stats_expiry no disponible: %s", e)
+                placeholders = ",".join(["%s"] * len(tables))
+                cursor.execute(
+                    f"SELECT table_name, update_time FROM information_schema.tables "
+                    f"WHERE table_schema = DATABASE() AND table_name IN ({placeholders});",
+                    list(tables)
+                )
+                for table_name, update_time in cursor.fetchall():
+                    markers[table_name.lower()] = str(update_time)
+            else:
+                # MAX(id) se resuelve con el índice de la clave primaria (COUNT(*) recorrería la tabla).
+                for table in tables:
+                    cursor.execute(f"SELECT MAX(id) FROM `{table}`;")
+                    markers[table] = str(cursor.fetchone()[0])
+        finally:
+            cursor.close()
+            conn.close()
+        return markers
+
+    def _check_markers(self, namespace, tables, get_connection):
+        """
+        Comprueba (como máximo cada 'marker_check_interval' segundos) si alguna tabla cambió e invalida sus entradas.
+        """
+        now = time.monotonic()
+        with self._lock:
+            pending = [
+                t for t in tables
+                if now - self._markers.get((namespace, t), (None, float("-inf")))[1] >= self.marker_check_interval
+            ]
+        if not pending:
+            return
+        try:
+            markers = self._probe_markers(get_connection, pending)
+        except Exception as e:
+            self.logger.warning("No se pudieron leer los marcadores de cambio: %s", e)
+            return
+        with self._lock:
+            for table in pending:
+                value = markers.get(table)
+                previous = self._markers.get((namespace, table))
+                changed_at = previous[2] if previous is not None else float("-inf")
+                if previous is not None and previous[0] != value:
+                    self.logger.info("La tabla %s cambió; se invalidan sus resultados cacheados.", table)
+                    self._invalidate_locked(lambda key, entry: key[0] == namespace and table in entry[2])
+                    changed_at = now
+                self._markers[(namespace, table)] = (value, now, changed_at)
+
+    def _changed_since(self, namespace, tables, started_at):
+        with self._lock:
+            return any(self._markers.get((namespace, t), (None, 0.0, float("-inf")))[2] >= started_at
+                       for t in tables)
+
+    def get(self, namespace, sql, get_connection=None):
+        """
+        Retorna una copia del resultado cacheado o None.
+
+        :param namespace: Identidad de la conexión (p. ej. host, puerto, usuario y base de datos).
+        :param sql: Sentencia SQL.
+        :param get_connection: (Opcional) Función de conexión usada para comprobar los marcadores de cambio.
+                               Se comprueban también si no hay entrada, para que el marcador registrado sea
+                               anterior a la consulta que se ejecutará a continuación.
+        """
+        key = (namespace, normalizar_sql(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+        if get_connection is not None and self.es_cacheable(sql):
+            self._check_markers(namespace, entry[2] if entry is not None else extraer_tablas(sql), get_connection)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove_locked(key)
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            resultados = entry[0]
+        return _copiar(resultados)
+
+    def set(self, namespace, sql, resultados, started_at=None):
+        """
+        Guarda el resultado de una sentencia SELECT.
+
+        :param started_at: (Opcional) Instante (time.monotonic) en que empezó la consulta, tras el 'get' que
+                           leyó los marcadores; si alguna tabla cambió desde entonces no se guarda.
+        """
+        if not resultados or not self.es_cacheable(sql):
+            return
+        tables = frozenset(extraer_tablas(sql))
+        size = estimar_bytes(resultados)
+        if size > self.max_bytes:
+            return
+        if started_at is not None and self._changed_since(namespace, tables, started_at):
+            self.logger.info("Las tablas de la consulta cambiaron durante su ejecución; no se cachea.")
+            return
+
+        key = (namespace, normalizar_sql(sql))
+        stored = _copiar(resultados)
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = (stored, time.monotonic() + self._ttl_for(tables), tables, size)
+            self._bytes += size
+            self._stats["stores"] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+                self._stats["evictions"] += 1
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
+
+    def _invalidate_locked(self, predicate):
+        keys = [key for key, entry in self._entries.items() if predicate(key, entry)]
+        for key in keys:
+            self._remove_locked(key)
+        self._stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def invalidate_table(self, table, namespace=None):
+        """
+        Descarta los resultados que dependen de 'table' (opcionalmente solo para una conexión).
+
+        :return: Número de entradas descartadas.
+        """
+        table = table.lower()
+        with self._lock:
+            return self._invalidate_locked(
+                lambda key, entry: table in entry[2] and (namespace is None or key[0] == namespace)
+            )
+
+    def invalidate(self, namespace=None):
+        """
+        Vacía la caché completa o solo las entradas de una conexión.
+        """
+        with self._lock:
+            return self._invalidate_locked(lambda key, entry: namespace is None or key[0] == namespace)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
+
+
+# Caché compartida por el proceso.
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Retorna la caché de resultados compartida por el proceso (configurable con RESULT_CACHE_MAX_MB
+    y RESULT_CACHE_TTL).
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                max_bytes=int(os.environ.get("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024,
+                default_ttl=int(os.environ.get("RESULT_CACHE_TTL", "60")),
+            )
+        return _result_cache
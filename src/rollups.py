@@ -0,0 +1,356 @@
+# modules/rollups.py
+
+import logging
+import os
+import threading
+import time
+
+from plate_search import COLOR_ATTRIBUTE_ID
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+# Granularidades mantenidas: nombre -> (tabla, ancho del intervalo en milisegundos).
+GRANULARITIES = {
+    "hour": ("rollup_objects_hour", HOUR_MS),
+    "day": ("rollup_objects_day", DAY_MS),
+}
+STATE_TABLE = "rollup_state"
+# Fila de 'rollup_state' con el número de objetos agregados que tienen más de una detección de color activa
+# (-1 si no se sabe, p. ej. agregados construidos antes de llevar la cuenta).
+MULTI_COLOR_STATE = "multi_color_objects"
+# Valor de las dimensiones (intervalo, cámara, categoría) de los objetos en los que es NULL o cuyo video no
+# existe: esos objetos se cuentan igual, para que los totales coincidan con COUNT(*) sobre 'object'.
+UNKNOWN = -1
+
+
+class RollupManager:
+    """
+    Agregados materializados de objetos detectados por intervalo (hora y día) x cámara x categoría x color.
+
+    Las tablas 'rollup_objects_hour' y 'rollup_objects_day' guardan el número de objetos de cada combinación
+    y se actualizan de forma incremental: cada 'refresh' agrega solo los objetos con id mayor que la marca
+    de agua guardada en 'rollup_state' y suma los conteos a las filas existentes. La marca de agua se avanza
+    con una actualización condicional en la misma transacción, por lo que dos procesos no pueden sumar el
+    mismo lote dos veces.
+
+    El color de un objeto es el de su detección de color activa (attribute_id = 2, status = 1), o '' si no
+    tiene; se asume que las detecciones de un objeto se insertan junto con él (las que lleguen más tarde
+    requieren 'rebuild'). Los objetos sin video, sin categoría o sin 'epoch' se agregan con el valor UNKNOWN
+    en esa dimensión (no se descartan ni detienen la actualización). Un conteo de detecciones de color solo equivale a un conteo de objetos con color
+    si ningún objeto tiene más de una: 'multi_color_objects' lleva la cuenta de los que sí, y mientras no
+    sea 0 los conteos de 'detections' no se dirigen a los agregados.
+
+    'route_count' y 'count_series_query' traducen consultas elegibles a lecturas de estas tablas; las usan
+    SQLGenerationAgent y DataAnalysisAgent cuando se les pasa un RollupManager. La construcción inicial y las
+    actualizaciones se hacen en una hebra de fondo ('start_refresher'): las solicitudes solo leen el estado
+    y, mientras los agregados no estén al día, se responden con la consulta directa.
+    """
+
+    def __init__(self, get_connection, refresh_interval=60, batch_size=200000, max_staleness=None):
+        """
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param refresh_interval: Segundos mínimos entre actualizaciones incrementales.
+        :param batch_size: Número de ids de 'object' agregados por lote.
+        :param max_staleness: Segundos tras los cuales los agregados no se usan para responder si no se han
+                              podido actualizar (por defecto, 10 veces 'refresh_interval').
+        """
+        self.get_connection = get_connection
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.max_staleness = max_staleness if max_staleness is not None else 10 * refresh_interval
+        self.high_water_mark = None
+        self.multi_color_objects = -1
+        self.last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def ensure_tables(self):
+        """
+        Crea las tablas de agregados y de estado si no existen.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            for table, _ in GRANULARITIES.values():
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    "bucket BIGINT NOT NULL, camera_id INT NOT NULL, category_id INT NOT NULL, "
+                    "color VARCHAR(64) NOT NULL, object_count BIGINT NOT NULL, "
+                    "PRIMARY KEY (bucket, camera_id, category_id, color))"
+                )
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+                "name VARCHAR(64) NOT NULL PRIMARY KEY, high_water_mark BIGINT NOT NULL, updated_at BIGINT)"
+            )
+            cursor.execute(f"SELECT high_water_mark FROM {STATE_TABLE} WHERE name = %s", ("objects",))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(f"INSERT INTO {STATE_TABLE} (name, high_water_mark, updated_at) VALUES (%s, %s, %s)",
+                               ("objects", 0, int(time.time())))
+                row = (0,)
+            cursor.execute(f"SELECT high_water_mark FROM {STATE_TABLE} WHERE name = %s", (MULTI_COLOR_STATE,))
+            multi_color = cursor.fetchone()
+            if multi_color is None:
+                # Agregados ya construidos sin la cuenta: se desconoce hasta el próximo 'rebuild'.
+                multi_color = (0 if row[0] == 0 else -1,)
+                cursor.execute(f"INSERT INTO {STATE_TABLE} (name, high_water_mark, updated_at) VALUES (%s, %s, %s)",
+                               (MULTI_COLOR_STATE, multi_color[0], int(time.time())))
+            conn.commit()
+            self.high_water_mark = row[0]
+            self.multi_color_objects = multi_color[0]
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _aggregate_batch(self, cursor, low, high):
+        """
+        Agrega por hora los objetos con id en (low, high].
+
+        :return: Tupla (conteos, objetos con más de una detección de color activa); los conteos son un
+                 diccionario {granularidad: {(bucket, camera_id, category_id, color): conteo}}.
+        """
+        # LEFT JOIN y COALESCE: un objeto sin video o con dimensiones NULL se cuenta en el valor UNKNOWN.
+        cursor.execute(
+            f"SELECT COALESCE(FLOOR(o.epoch / {HOUR_MS}) * {HOUR_MS}, {UNKNOWN}) AS bucket, "
+            f"COALESCE(v.camera_id, {UNKNOWN}) AS camera_id, COALESCE(o.category_id, {UNKNOWN}) AS category_id, "
+            "COALESCE(c.color, '') AS color, COUNT(*), SUM(CASE WHEN c.colors > 1 THEN 1 ELSE 0 END) "
+            "FROM object o "
+            "LEFT JOIN videos v ON v.id = o.video_id "
+            "LEFT JOIN (SELECT object_id, MAX(description) AS color, COUNT(*) AS colors FROM detections "
+            f"WHERE attribute_id = {COLOR_ATTRIBUTE_ID} AND status = 1 AND object_id > %s AND object_id <= %s "
+            "GROUP BY object_id) c ON c.object_id = o.id "
+            "WHERE o.id > %s AND o.id <= %s "
+            f"GROUP BY COALESCE(FLOOR(o.epoch / {HOUR_MS}) * {HOUR_MS}, {UNKNOWN}), "
+            f"COALESCE(v.camera_id, {UNKNOWN}), COALESCE(o.category_id, {UNKNOWN}), COALESCE(c.color, '')",
+            (low, high, low, high)
+        )
+        counts = {name: {} for name in GRANULARITIES}
+        multi_color = 0
+        for bucket, camera_id, category_id, color, count, multi in cursor.fetchall():
+            multi_color += int(multi or 0)
+            bucket = int(bucket)
+            for name, (_, width) in GRANULARITIES.items():
+                key = (bucket // width * width if bucket != UNKNOWN else UNKNOWN, int(camera_id), int(category_id),
+                       color)
+                counts[name][key] = counts[name].get(key, 0) + int(count)
+        return counts, multi_color
+
+    def refresh(self, force=False):
+        """
+        Incorpora a los agregados los objetos nuevos (id mayor que la marca de agua).
+
+        :param force: Si es True, actualiza aunque no haya pasado 'refresh_interval' y espera si otra hebra
+                      ya está actualizando.
+        :return: Número de ids de 'object' procesados.
+        """
+        if not force and time.time() - self.last_refresh < self.refresh_interval:
+            return 0
+        if not self._refresh_lock.acquire(blocking=force):
+            return 0
+        added = 0
+        try:
+            if self.high_water_mark is None:
+                self.ensure_tables()
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT MAX(id) FROM object")
+                max_id = cursor.fetchone()[0] or 0
+                cursor.execute(f"SELECT high_water_mark FROM {STATE_TABLE} WHERE name = %s", ("objects",))
+                hwm = cursor.fetchone()[0]
+                conn.commit()
+                while hwm < max_id:
+                    high = min(hwm + self.batch_size, max_id)
+                    counts, multi_color = self._aggregate_batch(cursor, hwm, high)
+                    # Avanzar la marca de agua solo si nadie más lo hizo desde que se leyó.
+                    cursor.execute(
+                        f"UPDATE {STATE_TABLE} SET high_water_mark = %s, updated_at = %s "
+                        "WHERE name = %s AND high_water_mark = %s",
+                        (high, int(time.time()), "objects", hwm)
+                    )
+                    if cursor.rowcount != 1:
+                        conn.rollback()
+                        self.logger.info("Otro proceso actualizó los agregados; se omite este lote.")
+                        break
+                    if multi_color:
+                        cursor.execute(
+                            f"UPDATE {STATE_TABLE} SET high_water_mark = high_water_mark + %s "
+                            "WHERE name = %s AND high_water_mark >= 0",
+                            (multi_color, MULTI_COLOR_STATE)
+                        )
+                    for name, (table, _) in GRANULARITIES.items():
+                        rows = [key + (count,) for key, count in counts[name].items()]
+                        if rows:
+                            cursor.executemany(
+                                f"INSERT INTO {table} (bucket, camera_id, category_id, color, object_count) "
+                                "VALUES (%s, %s, %s, %s, %s) "
+                                "ON DUPLICATE KEY UPDATE object_count = object_count + VALUES(object_count)",
+                                rows
+                            )
+                    conn.commit()
+                    added += high - hwm
+                    hwm = high
+                cursor.execute(f"SELECT high_water_mark FROM {STATE_TABLE} WHERE name = %s", (MULTI_COLOR_STATE,))
+                row = cursor.fetchone()
+                conn.commit()
+                self.high_water_mark = hwm
+                self.multi_color_objects = row[0] if row is not None else -1
+            finally:
+                cursor.close()
+                conn.close()
+            self.last_refresh = time.time()
+            if added:
+                self.logger.info("Agregados actualizados hasta el objeto %s.", self.high_water_mark)
+        except Exception as e:
+            self.logger.error("Error al actualizar los agregados: %s", e)
+        finally:
+            self._refresh_lock.release()
+        return added
+
+    def rebuild(self):
+        """
+        Vacía los agregados y los recalcula desde el principio.
+        """
+        self.ensure_tables()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            for table, _ in GRANULARITIES.values():
+                cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"UPDATE {STATE_TABLE} SET high_water_mark = 0 WHERE name IN (%s, %s)",
+                           ("objects", MULTI_COLOR_STATE))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        self.high_water_mark = 0
+        return self.refresh(force=True)
+
+    def start_refresher(self, interval=None):
+        """
+        Inicia una hebra en segundo plano que construye los agregados (la primera vez, de inmediato) y los
+        actualiza cada 'interval' segundos.
+        """
+        interval = interval or self.refresh_interval
+        if self._refresher is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            self.refresh(force=True)
+            while not self._stop.wait(interval):
+                self.refresh(force=True)
+
+        self._refresher = threading.Thread(target=run, name="rollups-refresher", daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self):
+        self._stop.set()
+        self._refresher = None
+
+    def is_fresh(self):
+        """
+        Indica si los agregados pueden usarse para responder. Solo lee el estado: las actualizaciones las
+        hace la hebra de 'start_refresher' (o una llamada explícita a 'refresh').
+        """
+        return bool(self.last_refresh) and time.time() - self.last_refresh <= self.max_staleness
+
+    def _dimension_filters(self, table, filters):
+        """
+        Traduce los filtros de la estructura de consulta a filtros sobre las dimensiones de los agregados.
+
+        :return: Diccionario {dimensión: valor}, o None si la consulta no es equivalente a un conteo de objetos.
+        """
+        filters = filters or {}
+        if table == "object":
+            if set(filters) - {"category_id"}:
+                return None
+            return {"category_id": filters["category_id"]} if "category_id" in filters else {}
+        if table == "detections":
+            # Conteo de detecciones de color activas = conteo de objetos con ese color (o con algún color),
+            # solo si ningún objeto tiene más de una detección de color activa.
+            if set(filters) - {"attribute_id", "status", "description"} or self.multi_color_objects != 0:
+                return None
+            if str(filters.get("attribute_id")) != str(COLOR_ATTRIBUTE_ID) or str(filters.get("status")) != "1":
+                return None
+            return {"color": filters["description"]} if "description" in filters else {}
+        return None
+
+    def route_count(self, table, filters):
+        """
+        Sentencia equivalente a 'SELECT COUNT(*) FROM <table> WHERE <filtros>' sobre los agregados diarios.
+
+        :return: Tupla (plantilla_sql, parametros), o (None, None) si la consulta no es elegible o los agregados
+                 no están al día.
+        """
+        dimensions = self._dimension_filters(table, filters)
+        if dimensions is None or any(isinstance(v, dict) for v in dimensions.values()) or not self.is_fresh():
+            return None, None
+        # Los objetos sin color ('') no tienen detección de color: no cuentan como detecciones.
+        where_clause, params = self._where(dimensions, colored_only=table == "detections")
+        return f"SELECT COALESCE(SUM(object_count), 0) AS `count` FROM {GRANULARITIES['day'][0]}{where_clause}", params
+
+    def count_series_query(self, table, time_column, bucket_ms, filters=None):
+        """
+        Serie de conteos de objetos por intervalo de 'bucket_ms' milisegundos, leída de los agregados.
+
+        :param table: Tabla de la serie ('object' o 'detections').
+        :param time_column: Columna de tiempo; solo 'object.epoch' (en milisegundos) es elegible.
+        :param bucket_ms: Ancho del intervalo; debe ser múltiplo de una hora.
+        :param filters: Filtros de la estructura de consulta.
+        :return: Tupla (plantilla_sql, parametros) con columnas `timestamp` y `count`, o (None, None).
+        """
+        dimensions = self._dimension_filters(table, filters)
+        if dimensions is None or (table, time_column) != ("object", "epoch") or bucket_ms % HOUR_MS:
+            return None, None
+        if any(isinstance(v, dict) for v in dimensions.values()) or not self.is_fresh():
+            return None, None
+        granularity = "day" if bucket_ms % DAY_MS == 0 else "hour"
+        # Los objetos sin 'epoch' no pertenecen a ningún intervalo de la serie.
+        where_clause, params = self._where(dimensions, known_bucket=True)
+        sql = (
+            f"SELECT FLOOR(bucket / {bucket_ms}) * {bucket_ms} AS `timestamp`, SUM(object_count) AS `count` "
+            f"FROM {GRANULARITIES[granularity][0]}{where_clause} "
+            f"GROUP BY FLOOR(bucket / {bucket_ms}) ORDER BY FLOOR(bucket / {bucket_ms})"
+        )
+        return sql, params
+
+    @staticmethod
+    def _where(dimensions, colored_only=False, known_bucket=False):
+        clauses = [f"{column} = %s" for column in dimensions]
+        params = [dimensions[column] for column in dimensions]
+        if colored_only and "color" not in dimensions:
+            clauses.append("color <> ''")
+        if known_bucket:
+            clauses.append(f"bucket <> {UNKNOWN}")
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+# Agregados compartidos por el proceso, uno por base de datos (clave: pool_key(db_config)).
+# Se activan con ROLLUPS_ENABLED=1; ROLLUPS_REFRESH fija los segundos entre actualizaciones.
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+
+def rollups_enabled():
+    return os.environ.get("ROLLUPS_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+def get_rollups(db_key, get_connection):
+    """
+    Retorna el RollupManager de la base de datos identificada por 'db_key' (o None si están desactivados).
+    En el primer uso inicia su actualización en segundo plano; hasta que termine la construcción inicial
+    los conteos se responden con la consulta directa.
+    """
+    if not rollups_enabled():
+        return None
+    with _rollups_lock:
+        manager = _rollups.get(db_key)
+        if manager is None:
+            manager = RollupManager(get_connection, refresh_interval=int(os.environ.get("ROLLUPS_REFRESH", "60")))
+            _rollups[db_key] = manager
+            manager.start_refresher()
+    return manager
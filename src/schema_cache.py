@@ -0,0 +1,247 @@
+# modules/schema_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from tracing import record
+
+
+class SchemaCache:
+    """
+    Caché de esquemas a nivel de proceso (y opcionalmente en disco) compartida entre peticiones.
+
+    'process_query' crea un DBSchemaAgent por cada consulta, por lo que su caché interna no sobrevive
+    más allá de una petición. Esta caché guarda el 'schema_dict' por (host, puerto, base de datos) y lo
+    reutiliza mientras siga vigente:
+      - Cada 'check_interval' segundos se compara una huella barata del esquema
+        (ver DBSchemaAgent.get_schema_fingerprint); si no cambió, se sigue usando la copia cacheada.
+      - Pasado 'ttl' segundos la entrada se recarga completamente.
+      - 'invalidate' permite descartar entradas de forma explícita.
+
+    También notifica a los suscriptores (ver 'subscribe') cuando un esquema se carga o cambia.
+    """
+
+    def __init__(self, ttl=3600, check_interval=60, cache_dir=None):
+        """
+        :param ttl: Segundos máximos que un esquema puede permanecer en caché sin recarga completa.
+        :param check_interval: Segundos entre comprobaciones de la huella del esquema (0 para comprobar siempre).
+        :param cache_dir: (Opcional) Directorio donde persistir los esquemas en disco entre reinicios.
+        """
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.cache_dir = cache_dir
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._key_locks = {}  # clave -> threading.Lock de verificación y recarga
+        self._listeners = []
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(db_config, main_tables=None, include_sample_data=False):
+        """
+        Construye la clave de caché a partir de la configuración de la base de datos.
+        """
+        return (
+            db_config.get("host", "localhost"),
+            int(db_config.get("port", 3306) or 3306),
+            db_config.get("database", ""),
+            tuple(sorted(main_tables)) if main_tables else None,
+            bool(include_sample_data),
+        )
+
+    def subscribe(self, callback):
+        """
+        Registra una función 'callback(key, schema)' que se llamará cada vez que un esquema
+        se cargue por primera vez o cambie.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, key, schema):
+        for callback in list(self._listeners):
+            try:
+                callback(key, schema)
+            except Exception as e:
+                self.logger.error("Error en el suscriptor de la caché de esquemas: %s", e)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"schema_{digest}.json")
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            return {
+                "schema": payload["schema"],
+                "fingerprint": payload["fingerprint"],
+                "loaded_at": payload["loaded_at"],
+                # Forzar la verificación de la huella en el primer uso tras leer de disco.
+                "checked_at": 0.0,
+            }
+        except Exception as e:
+            self.logger.warning("No se pudo leer la caché de esquema en disco (%s): %s", path, e)
+            return None
+
+    def _save_to_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "schema": entry["schema"],
+                    "fingerprint": entry["fingerprint"],
+                    "loaded_at": entry["loaded_at"],
+                }, f, default=str)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.warning("No se pudo guardar la caché de esquema en disco (%s): %s", path, e)
+
+    def _fresh_locked(self, key, schema_agent, now):
+        """
+        Retorna el esquema cacheado si sigue vigente sin consultar la base de datos, o None.
+        Debe llamarse con 'self._lock' adquirido.
+        """
+        entry = self._entries.get(key)
+        if (entry is not None and now - entry["loaded_at"] < self.ttl
+                and now - entry["checked_at"] < self.check_interval):
+            schema_agent.cached_schema = entry["schema"]
+            record("schema_cache_hit", True)
+            return entry["schema"]
+        return None
+
+    def get_schema(self, db_config, schema_agent):
+        """
+        Retorna el esquema para 'db_config', usando la caché cuando sigue vigente.
+
+        El lock de la caché solo protege las entradas: la verificación de la huella y la recarga se hacen con
+        un lock por clave, de modo que una base de datos lenta no bloquea a las demás y las peticiones
+        concurrentes de la misma clave esperan a una sola recarga.
+
+        :param db_config: Diccionario de configuración de la base de datos.
+        :param schema_agent: DBSchemaAgent usado para cargar el esquema y calcular su huella.
+        :return: Diccionario del esquema (mismo formato que DBSchemaAgent.get_schema_dict).
+        """
+        key = self.make_key(db_config, schema_agent.main_tables, schema_agent.include_sample_data)
+        with self._lock:
+            schema = self._fresh_locked(key, schema_agent, time.time())
+            if schema is not None:
+                return schema
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            now = time.time()
+            with self._lock:
+                # Otra petición pudo verificar o recargar la entrada mientras se esperaba el lock.
+                schema = self._fresh_locked(key, schema_agent, now)
+                if schema is not None:
+                    return schema
+                entry = self._entries.get(key)
+            if entry is None:
+                entry = self._load_from_disk(key)
+                if entry is not None:
+                    with self._lock:
+                        self._entries[key] = entry
+
+            if entry is not None and now - entry["loaded_at"] < self.ttl:
+                try:
+                    fingerprint = schema_agent.get_schema_fingerprint()
+                except Exception as e:
+                    # Si la verificación falla se sigue usando la copia cacheada.
+                    self.logger.warning("No se pudo verificar la huella del esquema: %s", e)
+                    fingerprint = entry["fingerprint"]
+                if fingerprint == entry["fingerprint"]:
+                    with self._lock:
+                        entry["checked_at"] = now
+                    schema_agent.cached_schema = entry["schema"]
+                    record("schema_cache_hit", True)
+                    return entry["schema"]
+                self.logger.info("El esquema de %s cambió; se recargará.", key[2])
+            else:
+                fingerprint = None
+
+            previous = entry["schema"] if entry is not None else None
+            # Recarga completa del esquema.
+            schema_agent.cached_schema = None
+            if fingerprint is None:
+                try:
+                    fingerprint = schema_agent.get_schema_fingerprint()
+                except Exception as e:
+                    self.logger.warning("No se pudo calcular la huella del esquema: %s", e)
+                    fingerprint = ""
+            schema = schema_agent.get_schema_dict()
+            record("schema_cache_hit", False)
+            record("schema_tables", len(schema))
+            entry = {
+                "schema": schema,
+                "fingerprint": fingerprint,
+                "loaded_at": now,
+                "checked_at": now,
+            }
+            with self._lock:
+                self._entries[key] = entry
+            self._save_to_disk(key, entry)
+
+        if schema != previous:
+            self._notify(key, schema)
+        return schema
+
+    def invalidate(self, db_config=None):
+        """
+        Descarta las entradas de la caché (en memoria y en disco).
+
+        :param db_config: (Opcional) Si se indica, solo se invalidan las entradas de esa base de datos.
+                          Si es None, se vacía la caché completa.
+        """
+        with self._lock:
+            if db_config is None:
+                keys = list(self._entries.keys())
+            else:
+                prefix = self.make_key(db_config)[:3]
+                keys = [k for k in self._entries if k[:3] == prefix]
+            for key in keys:
+                self._entries.pop(key, None)
+                if self.cache_dir:
+                    try:
+                        os.remove(self._disk_path(key))
+                    except OSError:
+                        pass
+            if db_config is None and self.cache_dir:
+                for name in os.listdir(self.cache_dir):
+                    if name.startswith("schema_") and name.endswith(".json"):
+                        try:
+                            os.remove(os.path.join(self.cache_dir, name))
+                        except OSError:
+                            pass
+
+
+# Caché compartida por el proceso. El directorio en disco se configura con SCHEMA_CACHE_DIR.
+_schema_cache = None
+_schema_cache_lock = threading.Lock()
+
+
+def get_schema_cache():
+    """
+    Retorna la caché de esquemas compartida por el proceso.
+    """
+    global _schema_cache
+    with _schema_cache_lock:
+        if _schema_cache is None:
+            _schema_cache = SchemaCache(
+                ttl=int(os.environ.get("SCHEMA_CACHE_TTL", "3600")),
+                check_interval=int(os.environ.get("SCHEMA_CACHE_CHECK_INTERVAL", "60")),
+                cache_dir=os.environ.get("SCHEMA_CACHE_DIR") or None,
+            )
+        return _schema_cache
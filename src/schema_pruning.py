@@ -0,0 +1,193 @@
+# modules/schema_pruning.py
+
+import json
+import logging
+
+from llm_cache import normalizar_consulta
+
+# Abreviaturas de tipos de datos usadas en el prompt compacto.
+TYPE_ABBREVIATIONS = {
+    "varchar": "str",
+    "char": "str",
+    "text": "txt",
+    "longtext": "txt",
+    "mediumtext": "txt",
+    "int": "int",
+    "bigint": "int",
+    "smallint": "int",
+    "mediumint": "int",
+    "tinyint": "int",
+    "decimal": "dec",
+    "float": "num",
+    "double": "num",
+    "datetime": "dt",
+    "timestamp": "ts",
+    "date": "date",
+    "json": "json",
+}
+
+# Palabras vacías que no aportan a la relevancia.
+STOPWORDS = {
+    "de", "del", "la", "las", "el", "los", "un", "una", "unos", "unas", "que", "en", "y", "o", "a",
+    "por", "para", "con", "hay", "cuantos", "cuantas", "cual", "cuales", "me", "mi", "es", "son",
+    "the", "of", "how", "many", "what", "is", "are", "in", "and", "or", "to",
+}
+
+
+def tokenize(text):
+    """
+    Divide un texto (o un nombre técnico en snake_case) en tokens normalizados, sin palabras vacías.
+    """
+    return [t for t in normalizar_consulta(text.replace("_", " ")).split() if t not in STOPWORDS]
+
+
+def stem(token):
+    """
+    Reducción muy simple de plurales en español e inglés ("carros" -> "carro", "colores" -> "color").
+    """
+    if len(token) > 4 and token.endswith("es"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def estimate_tokens(text):
+    """
+    Estimación aproximada del número de tokens de un texto (≈ 4 caracteres por token).
+    """
+    return (len(text) + 3) // 4
+
+
+class SchemaPruner:
+    """
+    Pre-filtro que reduce el esquema enviado al LLM a las tablas relevantes para la consulta.
+
+    Cada tabla se puntúa según:
+      - Coincidencias de tokens de la consulta con el nombre técnico y el nombre humanizado de la tabla
+        (obtenido del mapa semántico de SemanticMappingAgent).
+      - Coincidencias con los nombres de sus columnas.
+      - Un bono por ser vecina (llave foránea en schema[...]["relations"]) de una tabla relevante.
+    Solo las 'top_k' tablas mejor puntuadas se incluyen, en formato JSON compacto y con tipos abreviados,
+    recortando además tablas hasta respetar el presupuesto 'max_tokens'.
+    """
+
+    def __init__(self, top_k=5, max_tokens=None, neighbor_weight=0.5):
+        """
+        :param top_k: Número máximo de tablas a incluir en el prompt.
+        :param max_tokens: (Opcional) Presupuesto aproximado de tokens para esquema + mapa semántico.
+        :param neighbor_weight: Fracción de la puntuación de una tabla que se transfiere a sus vecinas por FK.
+        """
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.neighbor_weight = neighbor_weight
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def rank_tables(self, consulta, schema, semantic_map):
+        """
+        Puntúa las tablas del esquema frente a la consulta.
+
+        :return: Lista de tuplas (tabla, puntuación) ordenada de mayor a menor relevancia.
+        """
+        query_stems = {stem(t) for t in tokenize(consulta)}
+        scores = {}
+        for table, details in schema.items():
+            info = semantic_map.get(table, {})
+            table_stems = {stem(t) for t in tokenize(table) + tokenize(info.get("human_name", ""))}
+            score = 3.0 * len(query_stems & table_stems)
+
+            column_stems = set()
+            for col in details.get("columns", {}):
+                column_stems.update(stem(t) for t in tokenize(col))
+                column_stems.update(stem(t) for t in tokenize(info.get("columns", {}).get(col, "")))
+            score += 1.0 * len(query_stems & column_stems)
+            scores[table] = score
+
+        # Propagar relevancia a las tablas vecinas por llaves foráneas (en ambos sentidos).
+        bonus = {table: 0.0 for table in schema}
+        for table, details in schema.items():
+            for rel in details.get("relations", []):
+                ref = rel.get("referenced_table")
+                if ref in scores:
+                    bonus[ref] = max(bonus[ref], self.neighbor_weight * scores[table])
+                    bonus[table] = max(bonus[table], self.neighbor_weight * scores[ref])
+        ranked = [(table, scores[table] + bonus[table]) for table in schema]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked
+
+    @staticmethod
+    def compact_table(details):
+        """
+        Representación compacta de una tabla: tipos abreviados, '*' para llaves primarias
+        y relaciones como 'columna>tabla.columna'.
+        """
+        columns = {}
+        for col, info in details.get("columns", {}).items():
+            col_type = str(info.get("type", "")).lower()
+            abbrev = TYPE_ABBREVIATIONS.get(col_type, col_type)
+            columns[col] = abbrev + ("*" if info.get("key") == "PRI" else "")
+        compact = {"c": columns}
+        relations = [
+            f"{rel['column']}>{rel['referenced_table']}.{rel['referenced_column']}"
+            for rel in details.get("relations", [])
+        ]
+        if relations:
+            compact["fk"] = relations
+        return compact
+
+    @staticmethod
+    def compact_semantic(table, info):
+        """
+        Versión compacta del mapa semántico de una tabla: solo los nombres humanizados que aportan
+        información respecto al nombre técnico.
+        """
+        columns = {
+            col: human for col, human in info.get("columns", {}).items()
+            if human.lower().replace(" ", "_") != col.lower()
+        }
+        compact = {"n": info.get("human_name", table)}
+        if columns:
+            compact["c"] = columns
+        return compact
+
+    def prune(self, consulta, schema, semantic_map):
+        """
+        Selecciona las tablas relevantes y genera los textos compactos de esquema y mapa semántico.
+
+        :return: Tupla (schema_text, semantic_text, report) donde 'report' incluye las tablas elegidas
+                 y la estimación de tokens antes y después del recorte.
+        """
+        ranked = self.rank_tables(consulta, schema, semantic_map)
+        selected = [table for table, _ in ranked[:self.top_k]]
+
+        def render(tables):
+            schema_text = json.dumps(
+                {t: self.compact_table(schema[t]) for t in tables},
+                separators=(",", ":"), ensure_ascii=False, default=str
+            )
+            semantic_text = json.dumps(
+                {t: self.compact_semantic(t, semantic_map.get(t, {})) for t in tables},
+                separators=(",", ":"), ensure_ascii=False
+            )
+            return schema_text, semantic_text
+
+        schema_text, semantic_text = render(selected)
+        if self.max_tokens is not None:
+            while len(selected) > 1 and estimate_tokens(schema_text + semantic_text) > self.max_tokens:
+                selected.pop()
+                schema_text, semantic_text = render(selected)
+
+        full_tokens = estimate_tokens(
+            json.dumps(schema, indent=2, default=str) + json.dumps(semantic_map, indent=2)
+        )
+        pruned_tokens = estimate_tokens(schema_text + semantic_text)
+        report = {
+            "tables_total": len(schema),
+            "tables_selected": selected,
+            "tokens_full": full_tokens,
+            "tokens_pruned": pruned_tokens,
+            "tokens_saved": max(0, full_tokens - pruned_tokens),
+        }
+        self.logger.info("Prompt recortado: %d -> %d tokens aprox. (%d tablas de %d).",
+                         full_tokens, pruned_tokens, len(selected), len(schema))
+        return schema_text, semantic_text, report
@@ -0,0 +1,201 @@
+# modules/semantic_index.py
+
+import logging
+import threading
+from collections import defaultdict
+
+from schema_pruning import tokenize, stem
+
+# Grupos de sinónimos español/inglés usados para ampliar los términos indexados.
+SYNONYM_GROUPS = [
+    ["carro", "auto", "coche", "vehiculo", "car", "vehicle"],
+    ["objeto", "object", "item"],
+    ["camara", "camera", "cam"],
+    ["video", "grabacion", "recording"],
+    ["deteccion", "detection", "detectado"],
+    ["categoria", "category", "tipo", "type", "clase", "class"],
+    ["placa", "plate", "matricula", "patente"],
+    ["color", "colour"],
+    ["fecha", "date", "dia", "day", "epoch", "timestamp", "hora", "time"],
+    ["ubicacion", "location", "lugar", "place", "sitio"],
+    ["usuario", "user", "persona", "person"],
+    ["atributo", "attribute", "caracteristica"],
+    ["precision", "accuracy", "confianza", "confidence"],
+    ["descripcion", "description", "valor", "value"],
+    ["imagen", "image", "img", "foto", "photo"],
+    ["estado", "status"],
+    ["nombre", "name"],
+]
+
+
+def _build_synonyms():
+    synonyms = {}
+    for group in SYNONYM_GROUPS:
+        stems = {stem(word) for word in group}
+        for word_stem in stems:
+            synonyms.setdefault(word_stem, set()).update(stems - {word_stem})
+    return synonyms
+
+
+SYNONYMS = _build_synonyms()
+
+
+class SemanticIndex:
+    """
+    Índice invertido sobre el mapa semántico (SemanticMappingAgent.generate_map) para resolver
+    tablas y columnas a partir de una consulta en lenguaje natural.
+
+    Indexa los tokens de los nombres técnicos y humanizados, sus raíces y sus sinónimos en español/inglés,
+    de modo que cada búsqueda solo recorre las listas de los tokens de la consulta en lugar de todo el esquema.
+    El índice se actualiza de forma incremental con 'update' cuando el esquema cambia.
+    """
+
+    TABLE_WEIGHT = 3.0
+    COLUMN_WEIGHT = 1.0
+    SYNONYM_FACTOR = 0.8
+
+    def __init__(self, semantic_map=None):
+        # término -> {tabla: peso}
+        self._table_postings = defaultdict(dict)
+        # término -> {(tabla, columna): peso}
+        self._column_postings = defaultdict(dict)
+        # tabla -> (entrada del mapa semántico indexada, términos de tabla, términos de columnas)
+        self._indexed = {}
+        self._lock = threading.RLock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if semantic_map:
+            self.update(semantic_map)
+
+    def __len__(self):
+        return len(self._indexed)
+
+    @classmethod
+    def _terms(cls, *names):
+        """
+        Términos ponderados de un conjunto de nombres: raíces de sus tokens y sus sinónimos.
+        """
+        terms = {}
+        for name in names:
+            for token in tokenize(name):
+                token_stem = stem(token)
+                terms[token_stem] = 1.0
+                for synonym in SYNONYMS.get(token_stem, ()):
+                    terms.setdefault(synonym, cls.SYNONYM_FACTOR)
+        return terms
+
+    def _add_table(self, table, info):
+        table_terms = self._terms(table, info.get("human_name", ""))
+        for term, weight in table_terms.items():
+            self._table_postings[term][table] = self.TABLE_WEIGHT * weight
+
+        column_terms = {}
+        for column, human in info.get("columns", {}).items():
+            terms = self._terms(column, human)
+            column_terms[column] = terms
+            for term, weight in terms.items():
+                self._column_postings[term][(table, column)] = self.COLUMN_WEIGHT * weight
+        self._indexed[table] = (info, table_terms, column_terms)
+
+    def _remove_table(self, table):
+        info, table_terms, column_terms = self._indexed.pop(table)
+        for term in table_terms:
+            postings = self._table_postings.get(term)
+            if postings is not None:
+                postings.pop(table, None)
+                if not postings:
+                    del self._table_postings[term]
+        for column, terms in column_terms.items():
+            for term in terms:
+                postings = self._column_postings.get(term)
+                if postings is not None:
+                    postings.pop((table, column), None)
+                    if not postings:
+                        del self._column_postings[term]
+
+    def update(self, semantic_map):
+        """
+        Sincroniza el índice con 'semantic_map', reindexando solo las tablas añadidas, eliminadas o modificadas.
+
+        :return: Número de tablas reindexadas o eliminadas.
+        """
+        changed = 0
+        with self._lock:
+            for table in list(self._indexed):
+                if table not in semantic_map or semantic_map[table] != self._indexed[table][0]:
+                    self._remove_table(table)
+                    changed += 1
+            for table, info in semantic_map.items():
+                if table not in self._indexed:
+                    self._add_table(table, info)
+                    changed += 1
+        if changed:
+            self.logger.debug("Índice semántico actualizado (%d tablas).", changed)
+        return changed
+
+    def _query_terms(self, consulta):
+        return {stem(token) for token in tokenize(consulta)}
+
+    def search_tables(self, consulta, limit=5):
+        """
+        Busca las tablas relevantes para la consulta.
+
+        La puntuación de cada tabla suma el peso de los términos coincidentes con su nombre y, en menor
+        medida, con los nombres de sus columnas.
+
+        :return: Lista de tuplas (tabla, puntuación) ordenada de mayor a menor, sin tablas con puntuación 0.
+        """
+        scores = defaultdict(float)
+        with self._lock:
+            for term in self._query_terms(consulta):
+                for table, weight in self._table_postings.get(term, {}).items():
+                    scores[table] += weight
+                # Cada término aporta como máximo una columna por tabla.
+                best_column = {}
+                for (table, _column), weight in self._column_postings.get(term, {}).items():
+                    best_column[table] = max(best_column.get(table, 0.0), weight)
+                for table, weight in best_column.items():
+                    scores[table] += weight
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+    def search_columns(self, consulta, table=None, limit=5):
+        """
+        Busca las columnas relevantes para la consulta, opcionalmente restringidas a una tabla.
+
+        :return: Lista de tuplas ((tabla, columna), puntuación) ordenada de mayor a menor.
+        """
+        scores = defaultdict(float)
+        with self._lock:
+            for term in self._query_terms(consulta):
+                for key, weight in self._column_postings.get(term, {}).items():
+                    if table is None or key[0] == table:
+                        scores[key] += weight
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+    def best_table(self, consulta):
+        """
+        Retorna la tabla con mayor puntuación o None si ninguna coincide.
+        """
+        ranked = self.search_tables(consulta, limit=1)
+        return ranked[0][0] if ranked else None
+
+
+# Índices compartidos por el proceso, uno por base de datos.
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_semantic_index(db_key, semantic_map=None):
+    """
+    Retorna el índice semántico de la base de datos 'db_key', creándolo si no existe.
+    Si se proporciona 'semantic_map', el índice se sincroniza con él de forma incremental.
+    """
+    with _indexes_lock:
+        index = _indexes.get(db_key)
+        if index is None:
+            index = SemanticIndex()
+            _indexes[db_key] = index
+    if semantic_map is not None:
+        index.update(semantic_map)
+    return index
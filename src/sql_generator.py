@@ -15,26 +15,90 @@ class SQLGenerationAgent:
               "$lte": "02-02-2025"
           }
       - (Opcional) 'columna': para acciones de promedio.
+
+    Si se indica un RollupManager, los conteos elegibles se responden desde los agregados materializados
+    ('last_rollup_hit' indica si la última sentencia se dirigió a ellos).
     """
     
-    def __init__(self, limit=25):
+    def __init__(self, limit=25, rollups=None):
         self.limit = limit
+        self.rollups = rollups
+        self.last_rollup_hit = False
         self.logger = logging.getLogger(self.__class__.__name__)
     
     def generar_sql(self, estructura, schema):
+        """
+        Genera la sentencia SQL con los valores incrustados como literales (útil para mostrarla al usuario).
+        Para ejecutar, es preferible 'generar_sql_parametrizada', que permite reutilizar sentencias preparadas.
+
+        :return: Cadena SQL o None si la estructura no es válida.
+        """
+        template, params = self.generar_sql_parametrizada(estructura, schema)
+        if template is None:
+            return None
+        return self.renderizar_sql(template, params)
+
+    def generar_sql_parametrizada(self, estructura, schema):
+        """
+        Genera la sentencia SQL como plantilla con marcadores '%s' y la lista de parámetros, de modo que
+        consultas con la misma forma y distintos valores compartan la misma sentencia preparada.
+
+        :return: Tupla (plantilla, parámetros) o (None, None) si la estructura no es válida.
+        """
         action = estructura.get("accion", "").lower()
         table = estructura.get("tabla", "")
         filters = estructura.get("filtros", {})
 
         if not table:
             self.logger.error("No se especificó la tabla en la estructura de consulta.")
-            return None
+            return None, None
 
         if table not in schema:
             self.logger.error("La tabla '%s' no existe en el esquema.", table)
-            return None
+            return None, None
+
+        self.last_rollup_hit = False
+        if action == "contar" and self.rollups is not None:
+            template, params = self.rollups.route_count(table, filters)
+            if template is not None:
+                self.logger.info("Conteo dirigido a los agregados materializados: %s", template)
+                self.last_rollup_hit = True
+                return template, params
+
+        where_clause, params = self.construir_filtros(table, filters, schema)
+
+        sql_query = ""
+        if action == "contar":
+            sql_query = f"SELECT COUNT(*) FROM `{table}`{where_clause} LIMIT {self.limit};"
+        elif action == "listar":
+            sql_query = f"SELECT * FROM `{table}`{where_clause} LIMIT {self.limit};"
+        elif action == "promedio":
+            avg_column = estructura.get("columna")
+            if not avg_column:
+                self.logger.error("Para la acción 'promedio' se requiere especificar la columna a promediar.")
+                return None, None
+            if avg_column not in schema[table]["columns"]:
+                self.logger.error("La columna '%s' no existe en la tabla '%s'.", avg_column, table)
+                return None, None
+            sql_query = f"SELECT AVG(`{avg_column}`) FROM `{table}`{where_clause} LIMIT {self.limit};"
+        else:
+            self.logger.error("Acción '%s' no reconocida para la generación de SQL.", action)
+            return None, None
+
+        return sql_query, params
 
+    def construir_filtros(self, table, filters, schema):
+        """
+        Construye la cláusula WHERE (con marcadores '%s') a partir de los filtros de la estructura de consulta.
+        Se reutiliza en las consultas de agregación de DataAnalysisAgent.
+
+        :param table: Tabla consultada (debe existir en 'schema').
+        :param filters: Diccionario de filtros columna -> valor (o rango {"$gte": ..., "$lte": ...}).
+        :param schema: Esquema de la base de datos.
+        :return: Tupla (" WHERE ..." o cadena vacía, parámetros).
+        """
         where_clauses = []
+        params = []
         for col, val in filters.items():
             # Validar que la columna exista en la tabla
             if col not in schema[table]["columns"]:
@@ -52,61 +116,51 @@ class SQLGenerationAgent:
 
             # Si el filtro es un diccionario (por ejemplo, para rangos)
             if isinstance(val, dict):
-                if "$gte" in val:
-                    try:
-                        if is_date_field:
-                            date_obj = datetime.datetime.strptime(val["$gte"], "%d-%m-%Y")
-                            # Convertir a epoch en milisegundos
-                            epoch_val = int(date_obj.timestamp() * 1000)
-                            clause = f"`{col}` >= {epoch_val}"
-                        else:
-                            clause = f"`{col}` >= '{str(val['$gte']).replace('\'', '\'\'')}'"
-                    except Exception as e:
-                        self.logger.error("Error al procesar $gte en la columna %s: %s", col, e)
-                        clause = f"`{col}` >= '{str(val['$gte']).replace('\'', '\'\'')}'"
-                    where_clauses.append(clause)
-                if "$lte" in val:
-                    try:
-                        if is_date_field:
-                            date_obj = datetime.datetime.strptime(val["$lte"], "%d-%m-%Y")
+                for operator, sql_operator in (("$gte", ">="), ("$lte", "<=")):
+                    if operator not in val:
+                        continue
+                    value = val[operator]
+                    if is_date_field:
+                        try:
+                            date_obj = datetime.datetime.strptime(value, "%d-%m-%Y")
                             # Convertir a epoch en milisegundos
-                            epoch_val = int(date_obj.timestamp() * 1000)
-                            clause = f"`{col}` <= {epoch_val}"
-                        else:
-                            clause = f"`{col}` <= '{str(val['$lte']).replace('\'', '\'\'')}'"
-                    except Exception as e:
-                        self.logger.error("Error al procesar $lte en la columna %s: %s", col, e)
-                        clause = f"`{col}` <= '{str(val['$lte']).replace('\'', '\'\'')}'"
-                    where_clauses.append(clause)
+                            value = int(date_obj.timestamp() * 1000)
+                        except Exception as e:
+                            self.logger.error("Error al procesar %s en la columna %s: %s", operator, col, e)
+                            value = str(value)
+                    else:
+                        value = str(value)
+                    where_clauses.append(f"`{col}` {sql_operator} %s")
+                    params.append(value)
             else:
                 # Procesar filtro simple
-                if isinstance(val, (int, float)):
-                    clause = f"`{col}` = {val}"
-                else:
-                    val_str = str(val).replace("'", "''")
-                    clause = f"`{col}` = '{val_str}'"
-                where_clauses.append(clause)
+                where_clauses.append(f"`{col}` = %s")
+                params.append(val if isinstance(val, (int, float)) else str(val))
         
         where_clause = ""
         if where_clauses:
             where_clause = " WHERE " + " AND ".join(where_clauses)
-        
-        sql_query = ""
-        if action == "contar":
-            sql_query = f"SELECT COUNT(*) FROM `{table}`{where_clause} LIMIT {self.limit};"
-        elif action == "listar":
-            sql_query = f"SELECT * FROM `{table}`{where_clause} LIMIT {self.limit};"
-        elif action == "promedio":
-            avg_column = estructura.get("columna")
-            if not avg_column:
-                self.logger.error("Para la acción 'promedio' se requiere especificar la columna a promediar.")
-                return None
-            if avg_column not in schema[table]["columns"]:
-                self.logger.error("La columna '%s' no existe en la tabla '%s'.", avg_column, table)
-                return None
-            sql_query = f"SELECT AVG(`{avg_column}`) FROM `{table}`{where_clause} LIMIT {self.limit};"
-        else:
-            self.logger.error("Acción '%s' no reconocida para la generación de SQL.", action)
-            return None
+        return where_clause, params
+
+    @staticmethod
+    def renderizar_sql(template, params):
+        """
+        Sustituye los marcadores '%s' de la plantilla por literales SQL (solo para mostrar o registrar la sentencia).
+        """
+        def literal(value):
+            if isinstance(value, bool):
+                return str(int(value))
+            if isinstance(value, (int, float)):
+                return str(value)
+            if value is None:
+                return "NULL"
+            return "'" + str(value).replace("'", "''") + "'"
 
-        return sql_query
+        parts = template.split("%s")
+        if len(parts) - 1 != len(params):
+            raise ValueError("El número de parámetros no coincide con los marcadores de la plantilla.")
+        rendered = [parts[0]]
+        for value, part in zip(params, parts[1:]):
+            rendered.append(literal(value))
+            rendered.append(part)
+        return "".join(rendered)
@@ -0,0 +1,293 @@
+# modules/tracing.py
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Span activo en el contexto actual (se propaga a los hilos lanzados con asyncio.to_thread).
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    Etapa medida del pipeline: nombre, duración y atributos (filas, bytes, tokens, aciertos de caché, etc.).
+    """
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes)
+        self.children = []
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, value):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self):
+        data = {
+            "name": self.name,
+            "ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+        }
+        if self.attributes:
+            data["attrs"] = self.attributes
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict() for child in self.children]
+        return data
+
+
+class Tracer:
+    """
+    Traza de una petición: agrupa los spans de cada etapa y, al finalizar, los envía a los exportadores.
+
+    Uso:
+        tracer = Tracer()
+        with tracer.span("ejecutar_sql", sql=sql):
+            ...
+            record("rows", len(data))   # desde cualquier agente, sin pasar el tracer
+        resumen = tracer.finish()
+    """
+
+    def __init__(self, name="process_query", exporters=None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.root = Span(name)
+        self.exporters = list(get_exporters() if exporters is None else exporters)
+        self._token = _current_span.set(self.root)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def span(self, name, **attributes):
+        """
+        Abre un span hijo del span activo (o de la raíz de esta traza).
+        """
+        return _open_span(_current_span.get() or self.root, name, attributes)
+
+    def finish(self):
+        """
+        Cierra la traza, la exporta y retorna su resumen.
+        """
+        self.root.duration_ms = (time.perf_counter() - self.root.start) * 1000
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # La traza se cerró en un contexto distinto del que la abrió.
+            _current_span.set(None)
+        summary = self.summary()
+        for exporter in self.exporters:
+            try:
+                exporter.export(summary)
+            except Exception as e:
+                self.logger.error("Error en el exportador de trazas %s: %s", exporter.__class__.__name__, e)
+        return summary
+
+    def summary(self):
+        """
+        Resumen de la petición: duración total, tiempos por etapa y atributos acumulados.
+        """
+        stages = {}
+
+        def collect(span):
+            for child in span.children:
+                stage = stages.setdefault(child.name, {"ms": 0.0})
+                stage["ms"] = round(stage["ms"] + (child.duration_ms or 0.0), 3)
+                for key, value in child.attributes.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool) and key in stage:
+                        stage[key] += value
+                    else:
+                        stage[key] = value
+                collect(child)
+
+        collect(self.root)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "total_ms": round(self.root.duration_ms or 0.0, 3),
+            "attrs": self.root.attributes,
+            "stages": stages,
+            "spans": [child.to_dict() for child in self.root.children],
+        }
+
+
+def record(key, value):
+    """
+    Registra un atributo en el span activo (no hace nada si no hay una traza en curso).
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.set(key, value)
+
+
+def record_add(key, value):
+    """
+    Suma 'value' al atributo 'key' del span activo (no hace nada si no hay una traza en curso).
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.add(key, value)
+
+
+@contextmanager
+def _open_span(parent, name, attributes):
+    child = Span(name, parent=parent, **attributes)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.error = str(e)
+        raise
+    finally:
+        child.duration_ms = (time.perf_counter() - child.start) * 1000
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Abre un span hijo del span activo. Si no hay una traza en curso no mide nada.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _open_span(parent, name, attributes) as child:
+        yield child
+
+
+class JsonLogExporter:
+    """
+    Exporta cada traza como una línea JSON en el logger indicado.
+    """
+
+    def __init__(self, logger_name="tracing", level=logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def export(self, summary):
+        self.logger.log(self.level, json.dumps(summary, default=str, ensure_ascii=False))
+
+
+class PrometheusExporter:
+    """
+    Acumula métricas por etapa (conteo y suma de milisegundos, más contadores numéricos como filas,
+    bytes o tokens) y las expone en formato de texto de Prometheus.
+    """
+
+    def __init__(self, prefix="nlsql"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._total_ms = 0.0
+        self._stages = {}
+        self._server = None
+
+    def export(self, summary):
+        with self._lock:
+            self._requests += 1
+            self._total_ms += summary.get("total_ms", 0.0)
+            for name, stage in summary.get("stages", {}).items():
+                metrics = self._stages.setdefault(name, {"count": 0})
+                metrics["count"] += 1
+                for key, value in stage.items():
+                    if isinstance(value, bool):
+                        value = int(value)
+                    if isinstance(value, (int, float)):
+                        metrics[key] = metrics.get(key, 0) + value
+
+    def render(self):
+        """
+        Retorna las métricas acumuladas en formato de texto de Prometheus.
+        """
+        p = self.prefix
+        with self._lock:
+            lines = [
+                f"# TYPE {p}_requests_total counter",
+                f"{p}_requests_total {self._requests}",
+                f"# TYPE {p}_request_ms_sum counter",
+                f"{p}_request_ms_sum {self._total_ms:.3f}",
+                f"# TYPE {p}_stage_count counter",
+            ]
+            for name, metrics in sorted(self._stages.items()):
+                lines.append(f'{p}_stage_count{{stage="{name}"}} {metrics["count"]}')
+            lines.append(f"# TYPE {p}_stage_total counter")
+            for name, metrics in sorted(self._stages.items()):
+                for key, value in sorted(metrics.items()):
+                    if key == "count":
+                        continue
+                    lines.append(f'{p}_stage_total{{stage="{name}",metric="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9464, host="127.0.0.1"):
+        """
+        Inicia un servidor HTTP local (en un hilo) que expone las métricas en /metrics.
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, name="prometheus-exporter", daemon=True)
+        thread.start()
+        return self._server
+
+
+# Exportadores registrados a nivel de proceso.
+_exporters = []
+
+
+def add_exporter(exporter):
+    """
+    Registra un exportador (cualquier objeto con un método 'export(summary)') para todas las trazas.
+    """
+    _exporters.append(exporter)
+    return exporter
+
+
+def get_exporters():
+    return list(_exporters)
+
+
+def configure_from_env():
+    """
+    Registra los exportadores indicados por variables de entorno:
+      - TRACE_JSON_LOG=1: una línea JSON por petición en el logger "tracing".
+      - TRACE_PROMETHEUS_PORT=<puerto>: endpoint local /metrics en formato Prometheus.
+    Solo tiene efecto la primera vez que se llama.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    if os.environ.get("TRACE_JSON_LOG"):
+        add_exporter(JsonLogExporter())
+    port = os.environ.get("TRACE_PROMETHEUS_PORT")
+    if port:
+        add_exporter(PrometheusExporter()).serve(int(port))
+
+
+_configured = False
@@ -0,0 +1,132 @@
+# modules/warmup.py
+
+import importlib
+import logging
+import os
+import re
+import threading
+from urllib.parse import unquote
+
+from connection_pool import pool_key
+from app import preparar_contexto
+from intent_parser import get_value_dictionary
+
+logger = logging.getLogger(__name__)
+
+# Módulos pesados que solo se usan en el análisis y los gráficos; se importan en segundo plano para que
+# la primera consulta que los necesite no pague su importación.
+WARMUP_MODULES = ("numpy", "pandas", "matplotlib.pyplot")
+
+# usuario[:clave]@host[:puerto]/base_de_datos
+DB_URL_PATTERN = re.compile(
+    r"(?P<user>[^:@/]+)(?::(?P<password>[^@]*))?@(?P<host>[^:/@]+)(?::(?P<port>\d+))?/(?P<database>[\w$-]+)"
+)
+
+
+def parse_db_url(url):
+    """
+    Convierte 'usuario:clave@host:puerto/base_de_datos' en un db_config (puerto 3306 por defecto).
+    """
+    match = DB_URL_PATTERN.fullmatch(url.strip())
+    if not match:
+        raise ValueError(f"URL de base de datos no válida: {url}")
+    return {
+        "database": match.group("database"),
+        "user": unquote(match.group("user")),
+        "password": unquote(match.group("password") or ""),
+        "host": match.group("host"),
+        "port": int(match.group("port") or 3306),
+    }
+
+
+def configured_databases():
+    """
+    Bases de datos a precalentar al iniciar, definidas en WARMUP_DATABASES (URLs separadas por comas).
+    """
+    configs = []
+    for url in os.environ.get("WARMUP_DATABASES", "").split(","):
+        if url.strip():
+            try:
+                configs.append(parse_db_url(url))
+            except ValueError as e:
+                logger.warning("%s", e)
+    return configs
+
+
+def warm_up(db_config):
+    """
+    Prepara de forma síncrona lo que necesita la primera respuesta para 'db_config': una conexión del pool,
+    el esquema (en la caché del proceso), el mapa y el índice semánticos y el diccionario de valores. Si los
+    agregados materializados están activos, preparar_contexto inicia además su construcción en segundo plano.
+    """
+    contexto = preparar_contexto(db_config)
+    get_value_dictionary(pool_key(db_config), contexto["get_connection"], contexto["db_name"], contexto["schema"])
+    return contexto
+
+
+def import_heavy_modules(modules=WARMUP_MODULES):
+    """
+    Importa los módulos pesados del análisis (ver WARMUP_MODULES) si aún no están cargados.
+    """
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("No se pudo precargar %s: %s", name, e)
+
+
+# Precalentamientos lanzados por el proceso (clave: pool_key(db_config) o "modules"), para no repetirlos
+# en cada ejecución del script de Streamlit.
+_warmups = {}
+_warmups_lock = threading.Lock()
+
+
+def start_warmup(db_configs=None, import_modules=True):
+    """
+    Lanza en una hebra de fondo el precalentamiento de las bases de datos indicadas (por defecto, las de
+    WARMUP_DATABASES) y la importación de los módulos pesados. Cada base de datos se precalienta una sola
+    vez por proceso; las llamadas repetidas no hacen nada.
+
+    :return: Lista de threading.Event (uno por tarea lanzada o ya en curso) que se activan al terminar.
+    """
+    if db_configs is None:
+        db_configs = configured_databases()
+    tasks = [(pool_key(db_config), warm_up, (db_config,)) for db_config in db_configs]
+    if import_modules:
+        tasks.append(("modules", import_heavy_modules, ()))
+
+    events = []
+    new_tasks = []
+    with _warmups_lock:
+        for key, func, args in tasks:
+            if key not in _warmups:
+                _warmups[key] = threading.Event()
+                new_tasks.append((key, func, args))
+            events.append(_warmups[key])
+    if not new_tasks:
+        return events
+
+    def run():
+        # Primero las bases de datos (lo que más tarda la primera respuesta) y luego los módulos.
+        for key, func, args in new_tasks:
+            try:
+                func(*args)
+                logger.info("Precalentamiento completado: %s", key)
+            except Exception as e:
+                logger.warning("Error en el precalentamiento de %s: %s", key, e)
+            finally:
+                _warmups[key].set()
+
+    threading.Thread(target=run, name="warmup", daemon=True).start()
+    return events
+
+
+def wait_warmup(timeout=None):
+    """
+    Espera a que terminen los precalentamientos lanzados.
+
+    :return: True si todos terminaron dentro de 'timeout'.
+    """
+    with _warmups_lock:
+        events = list(_warmups.values())
+    return all(event.wait(timeout) for event in events)
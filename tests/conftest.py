@@ -0,0 +1,37 @@
+# tests/conftest.py
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from sqlite_standin import make_connect_func, refresh_information_schema  # noqa: E402
+
+
+@pytest.fixture
+def standin_db(tmp_path):
+    """
+    Base de datos vacía en el sustituto SQLite de MySQL.
+
+    :return: Función (ddl_y_datos) -> get_connection: ejecuta las sentencias, regenera information_schema
+             y retorna una función que abre conexiones nuevas.
+    """
+    path = str(tmp_path / "test.sqlite")
+
+    def create(statements):
+        connect = make_connect_func(path)
+        conn = connect()
+        try:
+            for statement in statements:
+                conn.raw.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+        refresh_information_schema(path)
+        return connect
+
+    return create
@@ -0,0 +1,55 @@
+# tests/test_intent_parser.py
+
+import pytest
+
+from intent_parser import RuleBasedIntentParser
+from semantic_index import SemanticIndex
+
+# Tablas del esquema de la aplicación (como las describe el mapa semántico del sustituto SQLite).
+SCHEMA = {
+    "categories": {"columns": {"id": {"type": "int", "key": "PRI"}, "category": {"type": "varchar", "key": ""}}},
+    "cameras": {"columns": {"id": {"type": "int", "key": "PRI"}, "camera_id": {"type": "varchar", "key": ""},
+                            "location": {"type": "varchar", "key": ""}}},
+    "videos": {"columns": {"id": {"type": "int", "key": "PRI"}, "camera_id": {"type": "int", "key": ""},
+                           "epoch": {"type": "bigint", "key": ""}}},
+    "object": {"columns": {"id": {"type": "int", "key": "PRI"}, "category_id": {"type": "int", "key": ""},
+                           "video_id": {"type": "int", "key": ""}, "epoch": {"type": "bigint", "key": ""}}},
+    "detections": {"columns": {"id": {"type": "int", "key": "PRI"}, "object_id": {"type": "int", "key": ""},
+                               "description": {"type": "varchar", "key": ""}}},
+    "vehicle": {"columns": {"id": {"type": "int", "key": "PRI"}, "color": {"type": "varchar", "key": ""}}},
+}
+SEMANTIC_MAP = {
+    "categories": {"human_name": "Categories", "columns": {"category": "Category"}},
+    "cameras": {"human_name": "Cameras", "columns": {"camera_id": "Camera Id", "location": "Location"}},
+    "videos": {"human_name": "Videos", "columns": {"camera_id": "Camera Id", "epoch": "Epoch"}},
+    "object": {"human_name": "Object", "columns": {"category_id": "Category Id", "video_id": "Video Id"}},
+    "detections": {"human_name": "Detections", "columns": {"object_id": "Object Id", "description": "Description"}},
+    "vehicle": {"human_name": "Vehículos", "columns": {"color": "Color"}},
+}
+VALUE_DICTIONARY = {
+    "categories": {"category": {"car": "car", "truck": "truck"}},
+    "vehicle": {"color": {"red": "red", "blue": "blue"}},
+}
+
+
+@pytest.fixture
+def parser():
+    return RuleBasedIntentParser(SCHEMA, SEMANTIC_MAP, VALUE_DICTIONARY, index=SemanticIndex(SEMANTIC_MAP))
+
+
+@pytest.mark.parametrize("consulta, estructura", [
+    ("cuantas camaras hay", {"accion": "contar", "tabla": "cameras", "filtros": {}}),
+    ("cuantos objetos hay", {"accion": "contar", "tabla": "object", "filtros": {}}),
+    ("cuantos carros rojos hay", {"accion": "contar", "tabla": "vehicle", "filtros": {"color": "red"}}),
+])
+def test_spanish_synonyms_and_values_do_not_lower_confidence(parser, consulta, estructura):
+    assert parser.interpretar(consulta) == estructura
+
+
+def test_synonym_of_the_table_is_fully_explained(parser):
+    # "carros" es sinónimo de "vehículo" en SemanticIndex: no debe penalizarse como palabra desconocida.
+    assert parser.parse("cuantos carros rojos hay")[1] == 1.0
+
+
+def test_unexplained_words_still_fall_back_to_llm(parser):
+    assert parser.interpretar("cuantas camaras instaladas despues del incendio del martes hay") is None
@@ -0,0 +1,68 @@
+# tests/test_rollups.py
+
+from rollups import RollupManager
+
+# Objetos con dimensiones incompletas: 3 sin video (video_id inexistente), 4 sin categoría, 5 sin 'epoch'
+# y 6 sin video_id.
+SCHEMA = [
+    "CREATE TABLE videos (id INTEGER PRIMARY KEY, camera_id INTEGER, epoch BIGINT)",
+    "CREATE TABLE object (id INTEGER PRIMARY KEY, category_id INTEGER, video_id INTEGER, epoch BIGINT)",
+    "CREATE TABLE detections (id INTEGER PRIMARY KEY, object_id INTEGER, attribute_id INTEGER, status INTEGER, "
+    "description VARCHAR(64))",
+    "INSERT INTO videos VALUES (1, 7, 1738368000000)",
+    "INSERT INTO object VALUES (1, 1, 1, 1738368000000), (2, 2, 1, 1738371600000), (3, 1, 99, 1738368000000), "
+    "(4, NULL, 1, 1738368000000), (5, 2, 1, NULL), (6, 1, NULL, 1738371600000)",
+    "INSERT INTO detections VALUES (1, 1, 2, 1, 'red'), (2, 3, 2, 1, 'blue'), (3, 5, 2, 1, 'red'), "
+    "(4, 6, 1, 1, 'ABC123')",
+]
+
+
+def _scalar(get_connection, sql, params=()):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _routed(get_connection, manager, table, filters):
+    sql, params = manager.route_count(table, filters)
+    assert sql is not None
+    return _scalar(get_connection, sql, params)
+
+
+def test_routed_counts_match_raw_counts_with_orphan_and_null_rows(standin_db):
+    get_connection = standin_db(SCHEMA)
+    manager = RollupManager(get_connection)
+    manager.rebuild()
+
+    assert manager.high_water_mark == 6
+    assert _routed(get_connection, manager, "object", {}) == _scalar(get_connection, "SELECT COUNT(*) FROM object")
+    for category_id in (1, 2):
+        assert _routed(get_connection, manager, "object", {"category_id": category_id}) == _scalar(
+            get_connection, "SELECT COUNT(*) FROM object WHERE category_id = %s", (category_id,))
+    color_filters = {"attribute_id": 2, "status": 1}
+    assert _routed(get_connection, manager, "detections", color_filters) == _scalar(
+        get_connection, "SELECT COUNT(*) FROM detections WHERE attribute_id = 2 AND status = 1")
+    assert _routed(get_connection, manager, "detections", dict(color_filters, description="red")) == _scalar(
+        get_connection, "SELECT COUNT(*) FROM detections WHERE attribute_id = 2 AND status = 1 AND description = 'red'")
+
+
+def test_series_excludes_objects_without_epoch(standin_db):
+    get_connection = standin_db(SCHEMA)
+    manager = RollupManager(get_connection)
+    manager.rebuild()
+
+    sql, params = manager.count_series_query("object", "epoch", 3600 * 1000)
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        series = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+        conn.close()
+    assert series == {1738368000000: 3, 1738371600000: 2}